@@ -20,6 +20,8 @@ from datetime import datetime
 from datetime import timedelta
 import time
 
+from cls_RecordSpool import RecordSpool
+
 #BUG: This can only handle 127 bytes, so the data transferred is 
 # This will need to set the HUB address??
 
@@ -195,25 +197,21 @@ def WriteDataToDir(dataset):
     gbl_log.info("[DAcc] Writing new record to disk:%s" % data_record_name)
 
     #TODO: Need to handle a failure to open the file
-    with open(data_record_name, mode='w') as f:
+    # Written in binary so the payload, which can be a memoryview onto the receive buffer, is not copied
+    with open(data_record_name, mode='wb') as f:
         #json.dump(dataset, f)
-        f.write(dataset.decode('utf-8'))        # Debug TEst
+        f.write(dataset)
         status = True
     return status
 
     return
 
-def CheckForData():
+def CheckForData(spool):
     """
-    Check for files in the directory, return True or False
+    Check for files in the record spool, return True or False
     """
-    status = False
-    list_of_files = os.listdir(path=SS.RECORDFILE_LOCATION+'/.')
-    for obj in list_of_files:
-        status = obj.endswith(SS.RECORDFILE_EXT)
-        if status == True:
-            break
-            gbl_log("[CTRL] Status of finding a record with .rec:%s" % status)
+    status = spool.next_record() != ''
+    gbl_log.debug("[CTRL] Status of finding a record with .rec:%s" % status)
     return status
 
 def SendRecord(lora, decoder, record):
@@ -254,37 +252,40 @@ def SendRecord(lora, decoder, record):
             gbl_log.debug("[CTRL] LoRa Comms returned a negative response")
     return data_sent
     
-def RemoveRecordFile(record_to_remove):
+def RemoveRecordFile(record_to_remove, spool=None):
     """
-    Remove the file from the directory
+    Remove the file from the directory, and from the spool if given
     """
+    if spool is not None:
+        spool.discard(record_to_remove)
 
     if os.path.isfile(SS.RECORDFILE_LOCATION+'/' + record_to_remove):
         os.remove(SS.RECORDFILE_LOCATION+'/' + record_to_remove)
         gbl_log.info("[CTRL] Record File deleted:%s" % SS.RECORDFILE_LOCATION+'/' + record_to_remove)
     return
 
-def RenameRecordFile(record_to_rename):
+def RenameRecordFile(record_to_rename, spool=None):
     """
-    Rename the current file to the old name so it is no longer sent
+    Rename the current file to the old name so it is no longer sent, and drop it from the spool if given
     """
+    if spool is not None:
+        spool.discard(record_to_rename)
     if os.path.isfile(SS.RECORDFILE_LOCATION+'/' + record_to_rename):
         os.rename(SS.RECORDFILE_LOCATION+'/' + record_to_rename, SS.RECORDFILE_LOCATION+'/' + record_to_rename[-3:] + SS.RECORDFILE_OLD)
         gbl_log.info("[DAcc] Record File renamed:%s" % SS.RECORDFILE_LOCATION+'/' + record_to_rename[-3:] + SS.RECORDFILE_OLD)
     return
         
-def SendData(lora, decoder):
+def SendData(lora, decoder, spool):
     """
-    Take all the files in the directory and send them one at a time
-    Given the LoRa class and the Decoder class to use
+    Take all the files in the record spool and send them one at a time
+    Given the LoRa class, the Decoder class and the RecordSpool to use
     Needs to handle association as well as data sending
     """
 
-    gbl_log.info("[CTRL] Getting the list of files to use and selecting one")
+    gbl_log.info("[CTRL] Getting the files to use from the spool of %s records" % len(spool))
     status = False
-    list_of_files = os.listdir(path=SS.RECORDFILE_LOCATION+'/.')
-    list_of_files.sort()
-    gbl_log.debug("[CTRL] Files to Use :%s" % list_of_files)
+    list_of_files = spool.names(len(spool))
+    gbl_log.debug("[CTRL] Files to Use :%s" % len(list_of_files))
     for record_to_use in list_of_files:
         gbl_log.debug("[CTRL] File being checked for extension of %s:%s" % (SS.RECORDFILE_EXT, record_to_use))
         if record_to_use[-len(SS.RECORDFILE_EXT):] == SS.RECORDFILE_EXT:
@@ -299,14 +300,14 @@ def SendData(lora, decoder):
                     gbl_log.debug("[CTRL] Length of record:%s" % len(record))
                     status = SendRecord(lora,decoder,record)
                     if status == True:
-                        RemoveRecordFile(record_to_use)
+                        RemoveRecordFile(record_to_use, spool)
                         record_try_count = 0
                     else:
                         record_try_count = record_try_count + 1
                         if record_try_count > SS.RECORD_TRY_COUNT:
                             gbl_log.error("[CTRL] Failed to send record over %s times, record archived" % record_try_count)
                             gbl_log.info("[CTRL] Archived Record:%s" % record)
-                            RenameRecordFile(record)
+                            RenameRecordFile(record, spool)
                         else:
                             time.sleep(record_try_count)        # Wait for a period before retrying
                 else:
@@ -397,6 +398,7 @@ def Node(op_info):
     associated = False
     try:
         comms = LoRa()
+        spool = RecordSpool(SS.RECORDFILE_LOCATION, SS.RECORDFILE_EXT)
         decode = Receiver(op_info['hub_addr'], op_info['node_addr'])
         while True:
             # Start the timer
@@ -408,10 +410,10 @@ def Node(op_info):
                 print("\r\r\r\r\r\r\rAssoc'd", end="")
 
             if associated:
-                if CheckForData():
+                if CheckForData(spool):
                     # If there is a file to send, send it
                     print("\r\r\r\r\r\r\rSending", end="")
-                    SendData(comms, decode)
+                    SendData(comms, decode, spool)
 
             # Wait for timeout
             waiting = False
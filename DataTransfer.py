@@ -10,6 +10,12 @@ Command Line Options
     - Operate as a Node                             -n --node
     - Display Customer Parameters                   -o --displayinfo
     - Set Customer Parameters                       -a --setinfo
+    - Add a Node to the Hub's registry              -r --addnode ADDR
+    - Remove a Node from the Hub's registry         -x --removenode ADDR
+
+The nodes the Hub accepts are in the node registry file (SS.NODE_REGISTRY_FILE), which starts with
+the Node Address from the operational info. Nodes added or removed while the Hub is running are
+picked up without a restart.
 
 Operational Info (op_info)
 ['dir_read_freq'] - The frequency of directory reading
@@ -34,6 +40,12 @@ import time
 from LoRaCommsReceiverV2 import LoRaComms as LoRa
 from cls_CognIoTRF import Node
 from cls_CognIoTRF import Hub
+from cls_NodeRegistry import NodeRegistry
+from cls_HubPipeline import HubPipeline, sync_directory
+from cls_RecordStore import SegmentLog
+from cls_RecordDatabase import RecordDatabase
+from cls_RecordSpool import RecordSpool
+from cls_RecordOutbox import RecordOutbox
 
 
 
@@ -56,6 +68,10 @@ def SetandGetArguments():
                     help="Display the Configuration Information, e.g. Read or Write directory")
     Para_group.add_argument("-s", "--setinfo", action="store_true",
                     help="Set the Configuration parameters, e.g.Read Frequency")
+    Para_group.add_argument("-r", "--addnode", metavar="ADDR",
+                    help="Add the Node Address to the Hub's node registry")
+    Para_group.add_argument("-x", "--removenode", metavar="ADDR",
+                    help="Remove the Node Address from the Hub's node registry")
     gbl_log.debug("[CTRL] Parser values captured: %s" % parser.parse_args())
     return parser.parse_args()
 
@@ -189,15 +205,30 @@ def SaveOperationalInfo(op_info):
 
     return
 
-def WriteDataToDir(dataset):
+def LoadNodeRegistry(op_info):
+    """
+    Load the registry of the nodes the Hub accepts and return it
+    If there is no registry file yet, it is created with the Node Address from the op_info
+    """
+    filename = SS.OPFILE_LOCATION + '/' + SS.NODE_REGISTRY_FILE
+    new_registry = os.path.isfile(filename) == False
+    registry = NodeRegistry(filename)
+    if new_registry and 'node_addr' in op_info:
+        gbl_log.info("[CTRL] Creating the node registry with node:%s" % op_info['node_addr'])
+        registry.add(op_info['node_addr'])
+    return registry
+
+def WriteDataToDir(dataset, node=None, received=None):
     """
     Write the given data to the operational directory
+    The node and time received are given by the HubPipeline and not used, the file name has the time written
     Takes the given data and creates a new file with the contents of it
     Format of the filename is based on standard settings
         RECORDFILE_NAME+timestamp+RECORDFILE_EXT
     Stored in sub folder
         RECORDFILE_LOCATION
     Returns true if the record is written, or false if it isn't
+    The file is flushed to the card, CommitDataDir flushes the directory holding it
     Disk space management is handled by the calling program
     """
     status = False
@@ -209,48 +240,103 @@ def WriteDataToDir(dataset):
     gbl_log.info("[DAcc] Writing new record to disk:%s" % data_record_name)
 
     #TODO: Need to handle a failure to open the file
-    with open(data_record_name, mode='w') as f:
+    # Written in binary so the payload, which can be a memoryview onto the receive buffer, is not copied
+    with open(data_record_name, mode='wb') as f:
         #json.dump(dataset, f)
-        f.write(dataset.decode('utf-8'))        # Debug TEst
+        f.write(dataset)
+        f.flush()
+        os.fsync(f.fileno())
         status = True
     return status
 
     return
 
+def CommitDataDir(force=False):
+    """
+    The store_commit for WriteDataToDir, flushes the record directory to the card so the files
+    written are there once the records are marked as stored
+    Returns True if it is flushed, or False if it isn't
+    """
+    try:
+        sync_directory(SS.RECORDFILE_LOCATION)
+    except OSError:
+        gbl_log.warning("[DAcc] Unable to flush the record directory:%s" % SS.RECORDFILE_LOCATION)
+        return False
+    return True
+
 def Hub_Loop(op_info):
     """
     Perform the necessary functionality to operate as a Hub
+    The packets are received, decoded and Acked, and the records stored, in the stages of a
+    HubPipeline, so the Ack is sent as soon as the records are in the write-ahead log rather than
+    waiting for each one to be written to its own file
+    With RECORD_STORE set to "segments" the records are appended to a SegmentLog instead of a file each,
+    or with "database" inserted into a RecordDatabase, with those older than RECORD_RETENTION deleted
     """
     gbl_log.info("[CTRL] Starting Hub Operation")
+    segment_log = None
+    database = None
+    decode = None
+    pipeline = None
     try:
-        comms = LoRa()
-        decode = Hub(op_info['hub_addr'], op_info['node_addr'])
+        comms = LoRa(fast_start=SS.LORA_FAST_START, pipelined=SS.LORA_PIPELINED)
+        decode = Hub(op_info['hub_addr'], [], registry=LoadNodeRegistry(op_info))
+        store = WriteDataToDir
+        store_commit = CommitDataDir
+        if SS.RECORD_STORE == "segments":
+            gbl_log.info("[CTRL] Storing the records in a segment log in:%s" % SS.RECORDFILE_LOCATION)
+            segment_log = SegmentLog(SS.RECORDFILE_LOCATION, segment_size=SS.SEGMENT_SIZE, segment_age=SS.SEGMENT_AGE,
+                                     commit_records=SS.COMMIT_RECORDS, commit_ms=SS.COMMIT_MS)
+            store = segment_log.append
+            store_commit = segment_log.commit
+        elif SS.RECORD_STORE == "database":
+            gbl_log.info("[CTRL] Storing the records in the database:%s/%s" % (SS.RECORDFILE_LOCATION, SS.RECORD_DATABASE))
+            database = RecordDatabase(SS.RECORDFILE_LOCATION + '/' + SS.RECORD_DATABASE,
+                                      commit_records=SS.COMMIT_RECORDS, commit_ms=SS.COMMIT_MS)
+            store = database.append
+            store_commit = database.commit
+        pipeline = HubPipeline(comms, decode, store, wal_file=SS.OPFILE_LOCATION + '/' + SS.HUB_WAL_FILE,
+                               receive_queue_size=SS.HUB_RECEIVE_QUEUE, store_queue_size=SS.HUB_STORE_QUEUE,
+                               store_commit=store_commit)
+        pipeline.start()
+        print("\r\r\r\r\r\r\rRunning", end="")
+        next_stats = time.monotonic() + SS.HUB_STATS_INTERVAL
         while True:
-            message = comms.receive()
-            print("\r\r\r\r\r\r\rWaiting", end="")
-            gbl_log.debug("[CTRL] Message received from the comms:%s" % message)
-            decode.decode_and_respond(message)
-            if decode.reply_status():
-                print("\r\r\r\r\r\r\rReading", end="")
-                gbl_log.debug("[CTRL] response is valid:%s" % decode.reply_status())
-                if decode.reply_payload_len() > 0:
-                    gbl_log.debug("[CTRL] response length is:%s" % decode.reply_payload_len())
-                    WriteDataToDir(decode.reply_payload())
-                status = comms.transmit(decode.reply())
-                #TODO: Add some capability to retry if failure
+            time.sleep(SS.HUB_CHECK_INTERVAL)
+            stopped = pipeline.stopped_stages()
+            if len(stopped) > 0:
+                gbl_log.critical("[CTRL] Hub pipeline stages stopped:%s, stopping the Hub" % stopped)
+                print("\nCRITICAL ERROR Hub stopped receiving - contact Support\n")
+                break
+            if time.monotonic() >= next_stats:
+                next_stats = next_stats + SS.HUB_STATS_INTERVAL
+                gbl_log.info("[CTRL] Hub pipeline:%s" % pipeline.snapshot())
+                if database is not None and SS.RECORD_RETENTION > 0:
+                    database.expire(time.time() - SS.RECORD_RETENTION)
 
     except KeyboardInterrupt:
         # CTRL - C entered
         print(" CTRL-C entered")
         gbl_log.debug("[CTRL] User Interrupt occurred (Ctrl-C)")
-        gbl_log.info("[CTRL] End of Processing")
-
         #TODO: Need to add in some functionality here to stop the sensor.
     except:
         #Error occurrred
         gbl_log.critical("[CTRL] Error occurred whilst looping to read values")
         print("\nCRITICAL ERROR during rading of sensor values- contact Support\n")
         gbl_log.exception("[CTRL] Start reading loop Exception Data")
+
+    # Stop the pipeline first, so the records it has queued are stored before the store is closed
+    if pipeline is not None:
+        pipeline.stop()
+    if segment_log is not None:
+        segment_log.close()
+    if database is not None:
+        database.close()
+    gbl_log.info("[CTRL] End of Processing")
+    if pipeline is not None:
+        gbl_log.info("[CTRL] Hub pipeline:%s" % pipeline.snapshot())
+    if decode is not None:
+        gbl_log.info("[CTRL] Payload compression:%s" % decode.compression_stats.snapshot())
     return
 
 def ValidateRecord(contents):
@@ -264,43 +350,110 @@ def ValidateRecord(contents):
     #TODO: Add other checks for validation
     return status
 
-def GetRecord():
+def GetRecord(spool):
     """
-    Get a file from the directory and return its name and the contents of it
+    Get a file from the record spool and return its name and the contents of it
+    The spool is the RecordSpool of the record directory, so the directory isn't listed each time
 
     If there isn't any record, return an empty list
     """
 
-    gbl_log.info("[CTRL] Getting the list of files to use and selecting one")
+    gbl_log.info("[CTRL] Getting the next file to use from the spool of %s records" % len(spool))
     record = ''
     chosen_record = ''
-    list_of_files = os.listdir(path=SS.RECORDFILE_LOCATION+'/.')
-    if len(list_of_files) > 0:
-        list_of_files.sort()
-        gbl_log.debug("[CTRL] Files to Use :%s" % list_of_files)
-        # Check for files before returning one
-        for record_to_use in list_of_files:
-            gbl_log.debug("[CTRL] File being checked for extension of %s:%s" % (SS.RECORDFILE_EXT, record_to_use))
-            if record_to_use.endswith(SS.RECORDFILE_EXT):
-                gbl_log.debug("[CTRL] Record Selected for use:%s" % record_to_use)
+    record_to_use = spool.next_record()
+    while record_to_use != '':
+        gbl_log.debug("[CTRL] Record Selected for use:%s" % record_to_use)
+        try:
+            with open(SS.RECORDFILE_LOCATION+'/'+record_to_use, mode='r') as f:
+                #record = json.load(f)
+                record=f.read()        #TEST
+                gbl_log.debug("[CTRL] Record loaded for use:%s" % record)
+        except OSError:
+            # Removed since the spool was updated
+            gbl_log.info("[CTRL] Record file not found:%s" % record_to_use)
+            spool.discard(record_to_use)
+            record = ''
+        else:
+            if ValidateRecord(record):
+                # The record is good and therefore I need to exit
+                chosen_record= record_to_use
+                break
+            # The file is not valid and therefore is moved to the archive list
+            RenameRecordFile(record_to_use, spool)
+            record = ''
+        record_to_use = spool.next_record()
+    return (chosen_record, record)
+
+def GetRecords(spool, count, exclude=()):
+    """
+    Get up to count files from the record spool, skipping those in exclude, and return a list of
+    the name and contents of each one, in the same order as GetRecord
 
+    If there aren't any records, return an empty list
+    """
+    gbl_log.info("[CTRL] Getting up to %s files to use from the spool of %s records" % (count, len(spool)))
+    records = []
+    skip = set(exclude)
+    list_of_files = spool.names(count, skip)
+    while len(list_of_files) > 0:
+        for record_to_use in list_of_files:
+            skip.add(record_to_use)
+            try:
                 with open(SS.RECORDFILE_LOCATION+'/'+record_to_use, mode='r') as f:
-                    #record = json.load(f)
-                    record=f.read()        #TEST
-                    gbl_log.debug("[CTRL] Record loaded for use:%s" % record)
-                if ValidateRecord(record):
-                    # The record is good and therefore I need to exit
-                    chosen_record= record_to_use
-                    break
-                else:
-                    # The file is not valid and therefore is moved to the archive list
-                    RenameRecordFile(record_to_use)
-    return (chosen_record, record)
+                    record = f.read()
+            except OSError:
+                # Removed since the spool was updated
+                spool.discard(record_to_use)
+                continue
+            if ValidateRecord(record):
+                records.append((record_to_use, record))
+            else:
+                # The file is not valid and therefore is moved to the archive list
+                RenameRecordFile(record_to_use, spool)
+        # Any that weren't valid are made up from the records after them
+        list_of_files = spool.names(count - len(records), skip)
+    gbl_log.debug("[CTRL] Records selected for use:%s" % [name for name, record in records])
+    return records
+
+def GetOutboxRecords(outbox, count, exclude=()):
+    """
+    Get up to count records from the outbox, skipping those with tags in exclude, and return a list
+    of the tag and contents of each one, in the same way as GetRecords
 
-def RemoveRecordFile(record_to_remove):
+    Records that aren't valid are acknowledged so they are not sent
+    If there aren't any records, return an empty list
+    """
+    gbl_log.info("[CTRL] Getting up to %s records to use from the outbox" % count)
+    records = []
+    skip = set(exclude)
+    outbox_records = outbox.records(count, skip)
+    while len(outbox_records) > 0:
+        invalid = []
+        for tag, record in outbox_records:
+            skip.add(tag)
+            try:
+                record = record.decode('utf-8')
+            except UnicodeDecodeError:
+                record = ''
+            if ValidateRecord(record):
+                records.append((tag, record))
+            else:
+                gbl_log.info("[CTRL] Record in the outbox not valid, not sent:%s" % (tag,))
+                invalid.append(tag)
+        if len(invalid) == 0:
+            break
+        outbox.acknowledge(invalid)
+        # Any that weren't valid are made up from the records after them
+        outbox_records = outbox.records(count - len(records), skip)
+    return records
+
+def RemoveRecordFile(record_to_remove, spool=None):
     """
-    Remove the file from the directory
+    Remove the file from the directory, and from the spool if given
     """
+    if spool is not None:
+        spool.discard(record_to_remove)
 
     if os.path.isfile(SS.RECORDFILE_LOCATION+'/' + record_to_remove):
         os.remove(SS.RECORDFILE_LOCATION+'/' + record_to_remove)
@@ -309,10 +462,12 @@ def RemoveRecordFile(record_to_remove):
         gbl_log.info("[CTRL] Record file not found:%s" % SS.RECORDFILE_LOCATION+'/' + record_to_remove)
     return
 
-def RenameRecordFile(record_to_rename):
+def RenameRecordFile(record_to_rename, spool=None):
     """
-    Rename the current file to the old name so it is no longer sent
+    Rename the current file to the old name so it is no longer sent, and drop it from the spool if given
     """
+    if spool is not None:
+        spool.discard(record_to_rename)
     if os.path.isfile(SS.RECORDFILE_LOCATION+'/' + record_to_rename):
         os.rename(SS.RECORDFILE_LOCATION+'/' + record_to_rename, SS.RECORDFILE_LOCATION+'/' + record_to_rename[-3:] + SS.RECORDFILE_OLD)
         gbl_log.info("[DAcc] Record File renamed:%s" % SS.RECORDFILE_LOCATION+'/' + record_to_rename[:-3] + SS.RECORDFILE_OLD)
@@ -326,7 +481,8 @@ def Node_Loop_old(op_info):
     """
     gbl_log.info("[CTRL] Starting Node Operation")
     try:
-        comms = LoRa()
+        comms = LoRa(fast_start=SS.LORA_FAST_START, pipelined=SS.LORA_PIPELINED)
+        spool = RecordSpool(SS.RECORDFILE_LOCATION, SS.RECORDFILE_EXT)
         sender = Node(op_info['hub_addr'], op_info['node_addr'])
         retries = SS.RETRIES
         while True:
@@ -336,7 +492,7 @@ def Node_Loop_old(op_info):
 
             # Loop round to get data and send it
 
-            record_name, data_record = GetRecord()
+            record_name, data_record = GetRecord(spool)
             gbl_log.info("[CTRL] Record to send >%s< and its contents:%s" % ( record_name, data_record))
             if len(data_record) > 0:
                 data_to_send = True
@@ -356,10 +512,10 @@ def Node_Loop_old(op_info):
                     gbl_log.info("[CTRL] Message Reply Status:%s" % status)
                     if status == True:
                         # if good, remove the record
-                        RemoveRecordFile(record_name)
+                        RemoveRecordFile(record_name, spool)
                         retries = SS.RETRIES
                         # check for more data
-                        record_name, data_record = GetRecord()
+                        record_name, data_record = GetRecord(spool)
                         if len(data_record) > 0:
                             data_to_send = True
                         else:
@@ -430,15 +586,18 @@ def Node_Loop(op_info):
     Perform the necessary functions to act as a node.
     """
     gbl_log.info("[CTRL] Starting Node Operation")
+    sender = None
     try:
-        comms = LoRa()
-        sender = Node(op_info['node_addr'], op_info['hub_addr'])
+        comms = LoRa(fast_start=SS.LORA_FAST_START, pipelined=SS.LORA_PIPELINED)
+        spool = RecordSpool(SS.RECORDFILE_LOCATION, SS.RECORDFILE_EXT)
+        sender = Node(op_info['node_addr'], op_info['hub_addr'], binary_records=SS.BINARY_RECORDS,
+                      compression=SS.PAYLOAD_COMPRESSION)
         retries = SS.RETRIES
         data_to_send = False
 
         """
         if data_to_send == False:
-            record_name, data_record = GetRecord()
+            record_name, data_record = GetRecord(spool)
             gbl_log.info("[CTRL] Record to send >%s< and its contents:%s" % ( record_name, data_record))
             if len(data_record) > 0:
                 # pass in the data
@@ -469,7 +628,7 @@ def Node_Loop(op_info):
                 retries = SS.RETRIES
                 if data_to_send == True and sender.read_data_sent_status():
                     # if good, remove the record
-                    RemoveRecordFile(record_name)
+                    RemoveRecordFile(record_name, spool)
                     # check for more data
             else:
                 # else drop out but increase the retries count.
@@ -482,7 +641,7 @@ def Node_Loop(op_info):
                     retries = SS.RETRIES
                 else:
                     time.sleep(retries)        # Wait for a period before retrying
-            record_name, data_record = GetRecord()
+            record_name, data_record = GetRecord(spool)
             if len(data_record) > 0:
                 sender.set_data_to_be_sent(data_record)
                 data_to_send = True
@@ -510,6 +669,8 @@ def Node_Loop(op_info):
         print(" CTRL-C entered")
         gbl_log.debug("[CTRL] User Interrupt occurred (Ctrl-C)")
         gbl_log.info("[CTRL] End of Processing")
+        if sender is not None:
+            gbl_log.info("[CTRL] Payload compression:%s" % sender.compression_stats.snapshot())
 
         #TODO: Need to add in some functionality here to stop the sensor.
     except:
@@ -520,6 +681,119 @@ def Node_Loop(op_info):
 
     return
 
+def Node_Window_Loop(op_info):
+    """
+    Perform the necessary functions to act as a node, using the windowed transfer mode so up to
+    SS.TRANSFER_WINDOW packets are sent before waiting for the hub to acknowledge them.
+    If the hub only agrees a window of 1, or SS.TRANSFER_WINDOW is 1, each packet is acknowledged
+    in turn.
+    If SS.AGGREGATE_LIMIT is set, each packet holds as many records as fit in that many bytes.
+    If SS.NODE_OUTBOX is set, the records are taken from the outbox queue files and the cursor moved
+    on as they are acknowledged, rather than a file being read and removed for each one.
+    """
+    gbl_log.info("[CTRL] Starting Node Operation, window:%s" % SS.TRANSFER_WINDOW)
+    sender = None
+    try:
+        comms = LoRa(fast_start=SS.LORA_FAST_START, pipelined=SS.LORA_PIPELINED)
+        if SS.NODE_OUTBOX:
+            outbox = RecordOutbox(SS.RECORDFILE_LOCATION)
+            get_records = lambda count, exclude: GetOutboxRecords(outbox, count, exclude)
+        else:
+            spool = RecordSpool(SS.RECORDFILE_LOCATION, SS.RECORDFILE_EXT)
+            get_records = lambda count, exclude: GetRecords(spool, count, exclude)
+        sender = Node(op_info['node_addr'], op_info['hub_addr'], window=SS.TRANSFER_WINDOW,
+                      aggregate_limit=SS.AGGREGATE_LIMIT, binary_records=SS.BINARY_RECORDS,
+                      delta_records=SS.DELTA_RECORDS, compression=SS.PAYLOAD_COMPRESSION)
+        retries = SS.RETRIES
+
+        while True:
+            endtime = datetime.now() + timedelta(seconds=op_info['dir_read_freq'])
+
+            if sender.associated == False:
+                # Associate, agreeing the window with the hub
+                comms.transmit(sender.message_to_send())
+                reply = comms.receivetimeout(SS.REPLY_WAIT)
+                if sender.check_response(reply) == False:
+                    gbl_log.debug("[CTRL] Association failed, waiting before retrying")
+                    time.sleep(SS.REPLY_WAIT)
+                    continue
+                gbl_log.info("[CTRL] Associated with the hub, window:%s" % sender.window)
+
+            # Fill the window with the records not already in it
+            in_window = set(sender.queued_tags())
+            if SS.AGGREGATE_LIMIT > 0:
+                # queue_records takes the (data, tag) of each record, the tag being the file name or outbox position
+                records = [(data_record, record_name) for record_name, data_record in
+                           get_records(sender.window_space() * SS.AGGREGATE_READ, in_window)]
+                while len(records) > 0 and sender.window_space() > 0:
+                    records = records[sender.queue_records(records):]
+            else:
+                for record_name, data_record in get_records(sender.window_space(), in_window):
+                    sender.queue_data(data_record, record_name)
+
+            if len(sender.outstanding) > 0:
+                print("\r\r\r\r\r\r\rSending", end="")
+                for message in sender.window_messages():
+                    status = comms.transmit(message)
+                    gbl_log.debug("[CTRL] Message Send Status:%s" % status)
+                reply = comms.receivetimeout(SS.REPLY_WAIT)
+                acknowledged = sender.check_window_response(reply)
+                if SS.NODE_OUTBOX:
+                    outbox.acknowledge(acknowledged)
+                else:
+                    for record_name in acknowledged:
+                        RemoveRecordFile(record_name, spool)
+                if len(acknowledged) > 0:
+                    retries = SS.RETRIES
+                else:
+                    gbl_log.debug("[CTRL] Nothing acknowledged, checking the retry count")
+                    retries = retries - 1
+                    if retries == 0:
+                        sender.force_reassociation()
+                        retries = SS.RETRIES
+                continue
+
+            # No records to send, wait for the next read of the directory
+            print("\r\r\r\r\r\r\rWaiting", end="")
+            while endtime > datetime.now():
+                time.sleep(0.1)
+
+    except KeyboardInterrupt:
+        # CTRL - C entered
+        print(" CTRL-C entered")
+        gbl_log.debug("[CTRL] User Interrupt occurred (Ctrl-C)")
+        gbl_log.info("[CTRL] End of Processing")
+        if sender is not None:
+            gbl_log.info("[CTRL] Payload compression:%s" % sender.compression_stats.snapshot())
+    except:
+        #Error occurrred
+        gbl_log.critical("[CTRL] Error occurred whilst sending the records")
+        print("\nCRITICAL ERROR during sending of records - contact Support\n")
+        gbl_log.exception("[CTRL] Node window loop Exception Data")
+
+    return
+
+def UseNodeWindowLoop():
+    """
+    Return True if the node settings need Node_Window_Loop rather than Node_Loop, which sends a file
+    per packet and waits for each Ack.
+    Node_Window_Loop also works when only a window of 1 is requested or agreed, so it is used
+    whenever a setting only it supports is on, reading the records from the outbox or aggregating
+    them into each packet.
+    """
+    return SS.TRANSFER_WINDOW > 1 or SS.NODE_OUTBOX or SS.AGGREGATE_LIMIT > 0
+
+def CheckNodeSettings():
+    """
+    Warn about node settings that have no effect on their own.
+    The delta blocks are built from the records aggregated into a packet, so SS.DELTA_RECORDS needs
+    SS.AGGREGATE_LIMIT to be set as well.
+    """
+    if SS.DELTA_RECORDS and SS.AGGREGATE_LIMIT <= 0:
+        gbl_log.warning("[CTRL] DELTA_RECORDS is set without AGGREGATE_LIMIT, records are sent one per packet without delta encoding")
+        print("\nWARNING: DELTA_RECORDS needs AGGREGATE_LIMIT to be set, records are sent without delta encoding\n")
+    return
+
 def main():
     # The main program that calls all the necessary routines for the rest.
 
@@ -538,11 +812,25 @@ def main():
     if args.hub:
         Hub_Loop(operational_info)
     elif args.node:
-        Node_Loop(operational_info)
+        CheckNodeSettings()
+        if UseNodeWindowLoop():
+            Node_Window_Loop(operational_info)
+        else:
+            Node_Loop(operational_info)
     elif args.displayinfo:
         DisplayOperationalParameters(operational_info)
     elif args.setinfo:
         SetOperationalParameters()
+    elif args.addnode:
+        if LoadNodeRegistry(operational_info).add(args.addnode):
+            print("Node %s added" % args.addnode)
+        else:
+            print("Unable to add Node %s, addresses are 4 characters" % args.addnode)
+    elif args.removenode:
+        if LoadNodeRegistry(operational_info).remove(args.removenode):
+            print("Node %s removed" % args.removenode)
+        else:
+            print("Node %s is not in the registry" % args.removenode)
     else:
         Hub_Loop(operational_info)
 
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+'''
+Benchmark of how quickly a node drains a backlog of records to the hub, against the window size
+of the windowed transfer mode and the payload limit for aggregating records into one packet
+
+A node and a hub run on VirtualLoRaModules sharing a VirtualAir, so the airtime of each packet and
+the time taken by the modules are included, and packets can be lost. The node sends a backlog of
+records using Node.queue_data / window_messages / check_window_response as Node_Window_Loop does,
+and the hub answers as Hub_Loop does. A window of 1 is the stop-and-wait transfer.
+
+For aggregation the airtime of each record is also worked out for each payload limit, as LoRa
+airtime goes up in steps of whole symbols, so some limits pack the records into less airtime.
+
+Usage
+    python3 DataTransfer_Benchmark.py [records] [loss]
+
+For more info see www.CognIot.eu
+'''
+
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from LoRaCommsReceiverV2 import LoRaComms
+from VirtualLoRaModule import VirtualAir, VirtualLoRaModule, lora_airtime
+from cls_CognIoTRF import Hub, Node
+from cls_CognIoTCodec import pack_records, HEADER_LEN
+
+HUB_ADDR = 'HUB1'
+NODE_ADDR = 'ND01'
+
+# The default number of records in the backlog and the chance of each packet being lost
+RECORDS = 40
+LOSS = 0.0
+
+# The window sizes compared
+WINDOWS = (1, 2, 4, 8)
+
+# The aggregation payload limits compared, 0 is a record per packet, and the window used for them
+AGGREGATE_LIMITS = (0, 60, 120, 180, 243)
+AGGREGATE_WINDOW = 4
+
+# How long the node waits for the Ack to each window
+REPLY_WAIT = 1
+
+# A typical JSON record, numbered so each one is different
+RECORD = '[[1, 42, "Lux", "2017-10-18 10:00:%05d"]]'
+
+
+def hub_loop(comms, hub, stored, running):
+    # Receive the packets, store the new data and reply, as Hub_Loop does
+    while running.is_set():
+        message = comms.receivetimeout(0.2)
+        if len(message) == 0:
+            continue
+        hub.decode_and_respond(message)
+        if hub.reply_new_data() and hub.reply_payload_len() > 0:
+            stored.extend(bytes(record) for record in hub.reply_records())
+        if hub.reply_status():
+            comms.transmit(hub.reply())
+    return
+
+def drain(comms, node, records):
+    # Send all the records and return the number of windows sent
+    backlog = list(records)
+    windows = 0
+    while len(backlog) > 0 or len(node.outstanding) > 0:
+        if node.associated == False:
+            comms.transmit(node.message_to_send())
+            node.check_response(comms.receivetimeout(REPLY_WAIT))
+            continue
+        while node.window_space() > 0 and len(backlog) > 0:
+            if node.aggregate_limit > 0:
+                count = node.queue_records([(record, record) for record in backlog])
+                del backlog[:count]
+            else:
+                record = backlog.pop(0)
+                node.queue_data(record, record)
+        for message in node.window_messages():
+            comms.transmit(message)
+        node.check_window_response(comms.receivetimeout(REPLY_WAIT))
+        windows = windows + 1
+    return windows
+
+def measure(window, records, loss, configdir, aggregate_limit=0):
+    # Drain the records with the given window, returns the records per second and windows sent
+    air = VirtualAir(loss=loss)
+    hub_module = VirtualLoRaModule(air, name='hub', link='memory')
+    node_module = VirtualLoRaModule(air, name='node', link='memory')
+    hub_comms = LoRaComms(fast_start=True, pipelined=True, config_file=os.path.join(configdir, 'hub.json'),
+                          transport=hub_module.transport(), data_pin=hub_module.data_pin)
+    node_comms = LoRaComms(fast_start=True, config_file=os.path.join(configdir, 'node.json'),
+                           transport=node_module.transport(), data_pin=node_module.data_pin)
+    hub = Hub(HUB_ADDR, [NODE_ADDR])
+    node = Node(NODE_ADDR, HUB_ADDR, window=window, aggregate_limit=aggregate_limit)
+
+    stored = []
+    running = threading.Event()
+    running.set()
+    hub_thread = threading.Thread(target=hub_loop, args=(hub_comms, hub, stored, running), daemon=True)
+    hub_thread.start()
+
+    starttime = time.monotonic()
+    windows = drain(node_comms, node, records)
+    period = time.monotonic() - starttime
+
+    running.clear()
+    hub_thread.join()
+    hub_comms.exit_comms()
+    node_comms.exit_comms()
+    hub_module.stop()
+    node_module.stop()
+
+    # Every record must have been stored once, whatever was lost
+    assert sorted(record.decode('utf-8') for record in stored) == sorted(records), "records lost or stored twice"
+    return len(records) / period, windows, node.window
+
+def airtime_per_record(records, limit):
+    # The airtime in ms for each record, when packed into packets of up to limit bytes of payload
+    encoded = [record.encode('utf-8') for record in records]
+    airtime = 0
+    while len(encoded) > 0:
+        if limit > 0:
+            payload, count = pack_records(encoded, limit)
+        else:
+            count = 0
+        if count <= 1:
+            payload, count = encoded[0], 1
+        airtime = airtime + lora_airtime(HEADER_LEN + len(payload))
+        del encoded[:count]
+    return airtime * 1000 / len(records)
+
+def main():
+    records = RECORDS
+    loss = LOSS
+    if len(sys.argv) > 1:
+        records = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        loss = float(sys.argv[2])
+    backlog = [RECORD % count for count in range(0, records)]
+
+    print("Backlog of %s records of %s bytes, packet loss %0.0f%%" % (records, len(backlog[0]), loss * 100))
+    with tempfile.TemporaryDirectory() as configdir:
+        baseline = None
+        for window in WINDOWS:
+            rate, windows, agreed = measure(window, backlog, loss, configdir)
+            if baseline is None:
+                baseline = rate
+            print("Window %s (agreed %s): %6.2f records/s, %4s windows sent, %0.2fx stop-and-wait" %
+                  (window, agreed, rate, windows, rate / baseline))
+
+        print("Aggregation with a window of %s" % AGGREGATE_WINDOW)
+        baseline = None
+        for limit in AGGREGATE_LIMITS:
+            rate, windows, agreed = measure(AGGREGATE_WINDOW, backlog, loss, configdir, aggregate_limit=limit)
+            if baseline is None:
+                baseline = rate
+            print("Limit %3s bytes: %6.2f records/s, %4s windows sent, airtime %5.1fms/record, %0.2fx a record per packet" %
+                  (limit, rate, windows, airtime_per_record(backlog, limit), rate / baseline))
+    return
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.CRITICAL)
+    main()
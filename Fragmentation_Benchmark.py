@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+'''
+Benchmark of sending records too long for one packet, in fragments
+
+A node and a hub run on VirtualLoRaModules sharing a VirtualAir, as in DataTransfer_Benchmark, and
+the node sends a backlog of long records, e.g. sensor dumps, which are split into fragments of up
+to the MTU. For each record length and window size it reports the records per second, the time the
+hub took from the first fragment of a record to the last, and the most memory the hub held in
+fragments for the node, from Hub.reassembly_stats.
+
+With packet loss, only the fragments the hub didn't receive are sent again.
+
+Usage
+    python3 Fragmentation_Benchmark.py [records] [loss]
+
+For more info see www.CognIot.eu
+'''
+
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from LoRaCommsReceiverV2 import LoRaComms
+from VirtualLoRaModule import VirtualAir, VirtualLoRaModule
+from cls_CognIoTRF import Hub, Node
+from DataTransfer_Benchmark import hub_loop, drain, HUB_ADDR, NODE_ADDR
+
+# The default number of records in the backlog and the chance of each packet being lost
+RECORDS = 2
+LOSS = 0.0
+
+# The number of readings in each record compared, about 45 bytes each, and the windows compared
+READINGS = (4, 20, 80, 300)
+WINDOWS = (1, 8)
+
+
+def generate_records(count, readings):
+    # Records of the given number of readings, numbered so each one is different
+    return [json.dumps([[1, record, "Lux", "2017-10-18 10:%02d:%02d" % (reading // 60 % 60, reading % 60)]
+                        for reading in range(0, readings)]) for record in range(0, count)]
+
+def measure(window, records, loss, configdir):
+    # Drain the records with the given window, returns the records per second and reassembly figures
+    air = VirtualAir(loss=loss)
+    hub_module = VirtualLoRaModule(air, name='hub', link='memory')
+    node_module = VirtualLoRaModule(air, name='node', link='memory')
+    hub_comms = LoRaComms(fast_start=True, pipelined=True, config_file=os.path.join(configdir, 'hub.json'),
+                          transport=hub_module.transport(), data_pin=hub_module.data_pin)
+    node_comms = LoRaComms(fast_start=True, config_file=os.path.join(configdir, 'node.json'),
+                           transport=node_module.transport(), data_pin=node_module.data_pin)
+    hub = Hub(HUB_ADDR, [NODE_ADDR])
+    node = Node(NODE_ADDR, HUB_ADDR, window=window, aggregate_limit=0)
+
+    stored = []
+    running = threading.Event()
+    running.set()
+    hub_thread = threading.Thread(target=hub_loop, args=(hub_comms, hub, stored, running), daemon=True)
+    hub_thread.start()
+
+    starttime = time.monotonic()
+    drain(node_comms, node, records)
+    period = time.monotonic() - starttime
+
+    running.clear()
+    hub_thread.join()
+    hub_comms.exit_comms()
+    node_comms.exit_comms()
+    hub_module.stop()
+    node_module.stop()
+
+    # Every record must have been stored once, whatever was lost
+    assert sorted(record.decode('utf-8') for record in stored) == sorted(records), "records lost or stored twice"
+    return len(records) / period, hub.reassembly_stats()
+
+def main():
+    records = RECORDS
+    loss = LOSS
+    if len(sys.argv) > 1:
+        records = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        loss = float(sys.argv[2])
+
+    print("Backlog of %s records, packet loss %0.0f%%" % (records, loss * 100))
+    with tempfile.TemporaryDirectory() as configdir:
+        for readings in READINGS:
+            backlog = generate_records(records, readings)
+            for window in WINDOWS:
+                rate, stats = measure(window, backlog, loss, configdir)
+                print("Record %5s bytes, window %s: %6.2f records/s, %3s reassembled, "
+                      "completion mean %6.0fms max %6.0fms, most held %5s bytes" %
+                      (len(backlog[0]), window, rate, stats['completed'], stats['mean_completion_ms'],
+                       stats['max_completion_ms'], stats['max_held_bytes']))
+    return
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.CRITICAL)
+    main()
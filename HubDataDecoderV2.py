@@ -13,6 +13,9 @@ An instance of the NODE class is created for each Node <==> Hub association
 import logging
 import time
 
+from cls_CognIoTCodec import decode, packet_codec, ResponseTable, CONTROL
+from cls_CognIoTCodec import CMD_ASSOCIATION_REQUEST, CMD_ASSOCIATION_RESPONSE, CMD_DATA_PACKET, CMD_PING, CMD_ACK, CMD_NACK
+
 # Pointers to the position of the parts of the packet
 START_HUB_ADDR = 0          # Position in packet where hub address starts
 HUB_CONTROL_BYTE = 4        # Position of the Hub Control byte
@@ -26,15 +29,15 @@ PAYLOAD = 12                # Position in packet where the payload starts
 #TODO: Change all these to all capitals with underscores
 
 # Constants that will not change in program
-# Command bytes that are used by protocol
-AssociationRequest = chr(0x30).encode('utf-8')
-AssociationResponse = chr(0x31).encode('utf-8')
-DataPacket = chr(0x37).encode('utf-8')
-Ping = chr(0x32).encode('utf-8')
+# Command bytes that are used by protocol, the packets are built and decoded by cls_CognIoTCodec
+AssociationRequest = bytes((CMD_ASSOCIATION_REQUEST,))
+AssociationResponse = bytes((CMD_ASSOCIATION_RESPONSE,))
+DataPacket = bytes((CMD_DATA_PACKET,))
+Ping = bytes((CMD_PING,))
 
 # Response codes
-ACK = chr(0x22).encode('utf-8')                 # all good and confirmed
-NACK = chr(0x99).encode('utf-8')                # General NACK response
+ACK = bytes((CMD_ACK,))                 # all good and confirmed
+NACK = bytes((CMD_NACK,))               # General NACK response
 
 
 # initialise global variables for data packet. Defined here so that they are global
@@ -57,6 +60,8 @@ class NODE:
         self.associated = False                 # Associated is used to determine if the unit is already associated
         self.node = node.encode('utf-8')        # The Node address that the instance supports
         self.hub = hub.encode('utf-8')          # The Hub address in use
+        self.codec = packet_codec(self.node, self.hub)      # Builds the packets sent to the hub
+        self.responses = ResponseTable(self.hub, self.node) # The replies to the node, built once
         self.last_incoming_message = b''        # Set to the last valid packet
         logging.info("[HDD]: NODE class instantiated with node:%s, hub:%s" % (self.node, self.hub))
         self._reset_values()
@@ -70,14 +75,6 @@ class NODE:
         # Return the message to send
         # These are from the contents of the message, clear them all when processing the message 
         self._reset_values()
-        self.hub_addr = b''         # The address of the hub in the message
-        self.hub_control = b''      # The Control byte of the Hub in the message (future use)
-        self.node_addr = b''        # The address of the node in the message
-        self.node_control = b''     # The Control byte of the node in the message (future use)
-        self.command = b''          # The command in the message
-        self.payload_len = b''      # The length byte in the message
-        self.payload = b''          # The payload in the message (optional)
-                
         self.response = b''         # The message to be returned
         self.response_status = False    # The status of the responding message (True = Valid message)
         logging.info("[HDD]: Message received for processing:%s" % message)
@@ -90,24 +87,24 @@ class NODE:
                 if self.associated:
                     # Possible commands are data packet and ping (if associated)
                     logging.info("[HDD]: HUB <==> NODE are associated")
-                    if self.command == Ping:
+                    if self.command == CMD_PING:
                         # Send the Ping response
                         logging.info("[HDD]: Ping Command Received")
 
                         #TODO: Need to include the ability to send data back in the ping response
                         self.response = self._generate_ack()
                         self.response_status = True
-                    elif self.command == DataPacket:
+                    elif self.command == CMD_DATA_PACKET:
                         # Send an Acknowledge
                         logging.info("[HDD]: Data Packet Command Received")
                         if message == self.last_incoming_message:
                             self._display_message("RECV: Duplicate Packet Seen")
                             logging.info("[HDD]: Duplicate Data Packet Received")
                         else:
-                            self.last_incoming_message = message
+                            self.last_incoming_message = bytes(message)     # message can be a view onto the receive buffer
                             self.response = self._generate_ack()
                             self.response_status = True
-                    elif self.command == AssociationRequest:
+                    elif self.command == CMD_ASSOCIATION_REQUEST:
                         # send Association Response again
                         logging.info("[HDD]: Association Request Command Received")
                         self.response = self._association_response()
@@ -119,7 +116,7 @@ class NODE:
                 else:
                     # Possible commands are association request
                     logging.info("[HDD]: HUB & NODE are NOT associated")
-                    if self.command == AssociationRequest:
+                    if self.command == CMD_ASSOCIATION_REQUEST:
                         # send Association Response
                         logging.info("[HDD]: Association Request Command Received")
                         self.response = self._association_response()
@@ -147,8 +144,8 @@ class NODE:
 
     def reply_payload_len(self):
         # The length of the data in the payload
-        return int.from_bytes(self.payload_len, byteorder='big')
-        
+        return self.payload_len
+
     def reply_payload(self):
         # The data that has been sent
         return self.payload
@@ -161,11 +158,7 @@ class NODE:
         #TODO: Hub becomes receiver HUB - RECEIVER
         #TODO: Node becomes sender  NODE - SENDER
 
-        self.outgoing_message = b''
-        self.outgoing_message = self.outgoing_message + self.hub + CONTROL_BYTE      # Sender address & Control byte
-        self.outgoing_message = self.outgoing_message + self.node + CONTROL_BYTE    # Receiver address & Control byte
-        self.outgoing_message = self.outgoing_message + AssociationRequest
-        self.outgoing_message = self.outgoing_message + ZeroPayload
+        self.outgoing_message = self.codec.encode(CMD_ASSOCIATION_REQUEST)
         return self.outgoing_message
 
     def outgoing_DataPack(self, data):
@@ -177,13 +170,7 @@ class NODE:
         #self.hub, self.node, CONTROL_BYTE, 
         #TODO: Hub becomes receiver HUB - RECEIVER
         #TODO: Node becomes sender  NODE - SENDER
-        self.outgoing_message = b''
-        self.outgoing_message = self.outgoing_message + self.hub + CONTROL_BYTE      # Sender address & Control byte
-        self.outgoing_message = self.outgoing_message + self.node + CONTROL_BYTE    # Receiver address & Control byte
-        self.outgoing_message = self.outgoing_message + DataPacket
-        self.outgoing_message = self.outgoing_message + str(len(data)).encode('utf-8')
-        self.outgoing_message = self.outgoing_message + data.encode('utf-8')
-        self.outgoing_message = self.outgoing_message + data.encode('utf-8')
+        self.outgoing_message = self.codec.encode(CMD_DATA_PACKET, data.encode('utf-8'))
         return self.outgoing_message
 
     def outgoing_Ping(self):
@@ -192,13 +179,7 @@ class NODE:
         # build the packet here using things like
         #TODO: Hub becomes receiver HUB - RECEIVER
         #TODO: Node becomes sender  NODE - SENDER
-        self.outgoing_message = b''
-        self.outgoing_message = self.outgoing_message + self.hub + CONTROL_BYTE      # Sender address & Control byte
-        self.outgoing_message = self.outgoing_message + self.node + CONTROL_BYTE    # Receiver address & Control byte
-        self.outgoing_message = self.outgoing_message + Ping
-        self.outgoing_message = self.outgoing_message + ZeroPayload
-
-        self.outgoing_message       # contains the message to be sent back
+        self.outgoing_message = self.codec.encode(CMD_PING)
         return self.outgoing_message
 
     
@@ -220,10 +201,10 @@ class NODE:
         elif self.hub != self.hub_addr:
             logging.info("[HDD]: Message Validation: Incorrect Hub Address")
             return False
-        elif self.hub_control != CONTROL_BYTE or self.node_control != CONTROL_BYTE:
+        elif self.hub_control != CONTROL or self.node_control != CONTROL:
             logging.info("[HDD]: Message Validation: Incorrect Control Byte")
             return False
-        elif len(self.payload) != int.from_bytes(self.payload_len, byteorder='big'):
+        elif len(self.payload) != self.payload_len:
             logging.info("[HDD]: Message Validation: Incorrect Payload length byte doesn't match payload length")
             return False
         return True
@@ -231,11 +212,11 @@ class NODE:
     def _reset_values(self):
         # These are from the contents of the message, clear them all when processing the message 
         self.hub_addr = b''         # The address of the hub in the message
-        self.hub_control = b''      # The Control byte of the Hub in the message (future use)
+        self.hub_control = 0        # The Control byte of the Hub in the message (future use)
         self.node_addr = b''        # The address of the node in the message
-        self.node_control = b''     # The Control byte of the node in the message (future use)
-        self.command = b''          # The command in the message
-        self.payload_len = b''      # The length byte in the message
+        self.node_control = 0       # The Control byte of the node in the message (future use)
+        self.command = 0            # The command byte in the message
+        self.payload_len = 0        # The length byte in the message
         self.payload = b''          # The payload in the message (optional)
                 
         self.response = b''         # The message to be returned
@@ -277,16 +258,15 @@ class NODE:
         # This routine takes the packet and splits it into its constituent parts
         # Returns True if successful, False if fails
         status = False
-        if len(packet) >= MIN_LENGTH:
-            self.hub_addr = packet[START_HUB_ADDR:HUB_CONTROL_BYTE]
-            self.hub_control = chr(packet[HUB_CONTROL_BYTE]).encode('utf-8')
-            self.node_addr = packet[START_NODE_ADDR:NODE_CONTROL_BYTE]
-            self.node_control = chr(packet[NODE_CONTROL_BYTE]).encode('utf-8')
-            self.command = chr(packet[COMMAND]).encode('utf-8')
-            self.payload_len = chr(packet[PAYLOAD_LEN]).encode('utf-8')
-            if len(packet) > PAYLOAD:
-                # Onlyadd the payload if the length is longer than then minimum length
-                self.payload = packet[PAYLOAD:]
+        frame = decode(packet)
+        if frame is not None:
+            self.hub_addr = frame.dest
+            self.hub_control = frame.dest_control
+            self.node_addr = frame.src
+            self.node_control = frame.src_control
+            self.command = frame.command
+            self.payload_len = frame.payload_len
+            self.payload = frame.payload
             status = True
         logging.debug("[HDD]: Hub Address    :%s" % self.hub_addr)
         logging.debug("[HDD]: Node Address   :%s" % self.node_addr)
@@ -296,38 +276,20 @@ class NODE:
         return status
     
     def _association_response(self):
-        # Create a generic generates an Ack for response to a number of messages
-        packet_to_send = b''
-        packet_to_send = packet_to_send + self.node_addr + self.node_control    # Receiver address & Control byte
-        packet_to_send = packet_to_send + self.hub_addr + self.hub_control      # Sender address & Control byte
-        packet_to_send = packet_to_send + AssociationResponse                   # Association Response
-        packet_to_send = packet_to_send + ZeroPayload                           # add zero payload length
-
+        # The Association Response, from the response table as the packet has been validated
         self._display_message("SEND: Association Response")
-        return packet_to_send
-    
+        return self.responses.association_response
+
     def _generate_ack(self):
         # Create a generic generates an Ack for response to a number of messages
-        packet_to_send = b''
-        packet_to_send = packet_to_send + self.node_addr + self.node_control    # Receiver address & Control byte
-        packet_to_send = packet_to_send + self.hub_addr + self.hub_control      # Sender address & Control byte
-        packet_to_send = packet_to_send + ACK                                   # Acknowledge
-        packet_to_send = packet_to_send + ZeroPayload                           # add zero payload length
-
         self._display_message("SEND: Acknowledge")
-        return packet_to_send
-    
+        return self.responses.ack
+
     def _generate_nack(self):
         # Create a generic Nack for response to a number of messages
         # No additional decoding of Nack is completed.
-        packet_to_send = b''
-        packet_to_send = packet_to_send + self.node_addr + self.node_control    # Receiver address & Control byte
-        packet_to_send = packet_to_send + self.hub_addr + self.hub_control      # Sender address & Control byte
-        packet_to_send = packet_to_send + NACK                                  # Acknowledge
-        packet_to_send = packet_to_send + ZeroPayload                           # add zero payload length
-
         self._display_message("SEND: Negative Response")
-        return packet_to_send
+        return self.responses.nack
     
     def _display_message(self, prompt):
         # Takes the current packet being processed and splits it onto the screen / log file
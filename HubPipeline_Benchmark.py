@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+'''
+Benchmark of the hub pipeline against the hub loop storing each record before it Acks, when
+storing a record is slow, e.g. an SD card stalling on a write
+
+A node and a hub run on VirtualLoRaModules sharing a VirtualAir, as in DataTransfer_Benchmark. The
+node sends a backlog of records in stop-and-wait, waiting REPLY_WAIT seconds for each Ack, and each
+record takes STORE_DELAY seconds to store. For each it reports the records per second, the packets
+the node sent, more than one per record being retransmissions, and for the pipeline the latency
+of each stage and the depth of the queues from HubPipeline.snapshot().
+
+Usage
+    python3 HubPipeline_Benchmark.py [records] [store_delay]
+
+For more info see www.CognIot.eu
+'''
+
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from LoRaCommsReceiverV2 import LoRaComms
+from VirtualLoRaModule import VirtualAir, VirtualLoRaModule
+from cls_CognIoTRF import Hub, Node
+from cls_HubPipeline import HubPipeline, STAGES
+from DataTransfer_Benchmark import hub_loop, HUB_ADDR, NODE_ADDR, RECORD
+
+# The default number of records in the backlog and the time taken to store each one
+RECORDS = 10
+STORE_DELAY = 1.5
+
+# How long the node waits for each Ack, shorter than the store delay so the loop storing before it
+# Acks makes the node retransmit
+REPLY_WAIT = 1
+
+
+def send(comms, node, records):
+    # Send each record with set_data_to_be_sent until it is Acked, as Node_Loop does, returns the
+    # number of packets sent
+    packets = 0
+    for record in records:
+        while True:
+            node.set_data_to_be_sent(record)
+            comms.transmit(node.message_to_send())
+            packets = packets + 1
+            if node.check_response(comms.receivetimeout(REPLY_WAIT)) and node.read_data_sent_status():
+                break
+    return packets
+
+def measure(records, store_delay, configdir, pipelined):
+    # Send the records to a hub storing them with the delay, returns the records per second, the
+    # packets sent and the pipeline snapshot, None for the loop
+    air = VirtualAir()
+    hub_module = VirtualLoRaModule(air, name='hub', link='memory')
+    node_module = VirtualLoRaModule(air, name='node', link='memory')
+    hub_comms = LoRaComms(fast_start=True, pipelined=True, config_file=os.path.join(configdir, 'hub.json'),
+                          transport=hub_module.transport(), data_pin=hub_module.data_pin)
+    node_comms = LoRaComms(fast_start=True, config_file=os.path.join(configdir, 'node.json'),
+                           transport=node_module.transport(), data_pin=node_module.data_pin)
+    hub = Hub(HUB_ADDR, [NODE_ADDR])
+    node = Node(NODE_ADDR, HUB_ADDR)
+    while node.associated == False:
+        node_comms.transmit(node.message_to_send())
+        hub.decode_and_respond(hub_comms.receivetimeout(REPLY_WAIT))
+        hub_comms.transmit(hub.reply())
+        node.check_response(node_comms.receivetimeout(REPLY_WAIT))
+
+    stored = []
+    def store(record, node, received):
+        time.sleep(store_delay)
+        stored.append(record)
+
+    snapshot = None
+    if pipelined:
+        pipeline = HubPipeline(hub_comms, hub, store, wal_file=os.path.join(configdir, 'hub_wal.log'))
+        pipeline.start()
+    else:
+        running = threading.Event()
+        running.set()
+        hub_thread = threading.Thread(target=hub_loop, args=(hub_comms, hub, stored, running), daemon=True)
+        hub_thread.start()
+        # hub_loop stores each record before replying, store() adds the delay in the same place
+        hub.reply_records = slow_records(hub.reply_records, store_delay)
+
+    starttime = time.monotonic()
+    packets = send(node_comms, node, records)
+    period = time.monotonic() - starttime
+
+    if pipelined:
+        pipeline.stop()
+        snapshot = pipeline.snapshot()
+    else:
+        running.clear()
+        hub_thread.join()
+    hub_comms.exit_comms()
+    node_comms.exit_comms()
+    hub_module.stop()
+    node_module.stop()
+
+    assert sorted(bytes(record).decode('utf-8') for record in stored) == sorted(records), "records lost or stored twice"
+    return len(records) / period, packets, snapshot
+
+def slow_records(reply_records, store_delay):
+    # Wrap Hub.reply_records so each record takes the store delay, as hub_loop stores them in turn
+    def records():
+        for record in reply_records():
+            time.sleep(store_delay)
+            yield record
+    return records
+
+def main():
+    records = RECORDS
+    store_delay = STORE_DELAY
+    if len(sys.argv) > 1:
+        records = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        store_delay = float(sys.argv[2])
+    backlog = [RECORD % count for count in range(0, records)]
+
+    print("Backlog of %s records, %0.1fs to store each, the node waits %ss for each Ack" %
+          (records, store_delay, REPLY_WAIT))
+    with tempfile.TemporaryDirectory() as configdir:
+        for pipelined in (False, True):
+            rate, packets, snapshot = measure(backlog, store_delay, configdir, pipelined)
+            print("%-8s: %5.2f records/s, %3s packets sent for %s records" %
+                  ('Pipeline' if pipelined else 'Loop', rate, packets, records))
+        for stage in STAGES:
+            print("    %-14s mean %9.1fus  p99 %9.1fus  max %9.1fus" %
+                  (stage, snapshot[stage]['mean_us'], snapshot[stage]['p99_us'], snapshot[stage]['max_us']))
+        print("    queues %s" % snapshot['queues'])
+    return
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.CRITICAL)
+    main()
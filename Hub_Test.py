@@ -43,7 +43,7 @@ HT_ZERO_PAYLOAD = chr(0x00).encode('utf-8')           # used to indicate there i
 
 # Response codes
 HT_ACK = chr(0x22).encode('utf-8')                 # all good and confirmed
-HT_NACK = chr(0x99).encode('utf-8')                # General NACK response
+HT_NACK = b'\x99'                                  # General NACK response, a single byte
 
 def ht_association(test, hub, node, assc=True):
     # Build the Association Request Command
@@ -182,7 +182,7 @@ def ht_main():
 
     # Build a list of nodes and associated scenarios
     for node in node_list:
-        instance = HT_Hub.NODE(node, b'ABCD')
+        instance = HT_Hub.NODE(node.decode('utf-8'), 'ABCD')
         nodes.update({node: instance})
         node_scenarios = build_scenarios(node)
         scenarios.update({node:node_scenarios})
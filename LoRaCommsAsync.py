@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+asyncio version of the LoRa communications
+
+Provides the same functions as LoRaComms, but as coroutines so a single process can handle the
+radio alongside other tasks, e.g. storage and monitoring, on the same event loop.
+
+User functions are
+open                        coroutine that sets up the module and returns the instance
+transmit(message to send)   sends the message to send
+receive(timeout)            returns message received, or zero bytes if the timeout passes
+                            the message is a memoryview, valid until the next receive
+async for frame in comms    returns each message received
+close                       closes comms
+
+The serial port is read by the event loop when it has data, during each exchange with the module,
+and the data pin edge is passed to the event loop from the GPIO thread, so no threads are kept busy
+waiting. Each exchange holds the uart_lock of the LoRaComms, so it can still be used from other
+threads, e.g. by its transmit queue, and the latencies are recorded in its stats.
+"""
+
+import asyncio
+import contextlib
+import functools
+import logging
+import time
+
+from LoRaCommsReceiverV2 import LoRaComms, EDGE_RECHECK, POLL_INTERVAL, LORA_TIMEOUT
+from LoRaCommsReceiverV2 import SENDB, REC_LEN, RECC
+from cls_LoRaResponse import LoRaResponse, RESP_TIMEOUT
+from cls_LoRaStats import CMD_SEND, CMD_PAYLOAD, CMD_LENGTH, CMD_RECEIVE, CMD_GPIO_WAIT
+
+
+class AsyncLoRaComms:
+    '''
+    Class to handle all communications with the LoRa module from an asyncio event loop
+
+    The module is set up using LoRaComms, which is then used for the serial port, the parser and
+    the checking of the replies. Use AsyncLoRaComms.open() rather than creating it directly.
+
+    Any data passed in or out needs to be in binary format
+
+    '''
+
+    def __init__(self, comms, loop):
+        # comms is a LoRaComms instance that has completed its setup
+        self.comms = comms
+        self.loop = loop
+        self.fd = comms.fd
+        self.parser = comms.parser
+        self.lock = asyncio.Lock()              # Only one exchange at a time from the coroutines
+        self.rx_event = asyncio.Event()         # Set when bytes have been read from the serial port
+        self.data_ready = asyncio.Event()       # Set when the data pin goes high
+
+        if comms.edge_wait:
+            comms.data_pin.add_callback(self._data_pin_edge)
+        logging.info("[LCA]: Async LoRa comms started, edge wait:%s" % comms.edge_wait)
+        return
+
+    @classmethod
+    async def open(cls, **options):
+        # Set up the LoRa module and return an AsyncLoRaComms instance
+        # options are passed to LoRaComms, e.g. fast_start=True, pipelined=True
+        # The setup blocks, so it is run in the default executor
+        loop = asyncio.get_running_loop()
+        comms = await loop.run_in_executor(None, functools.partial(LoRaComms, **options))
+        return cls(comms, loop)
+
+    async def transmit(self, message):
+        # Send data out on the comms port
+        # Returns True if successful or False if not
+        if len(message) > 255:
+            logging.critical("[LCA]: Radio Message length is greater than 255 limit, aborting: %s" % message)
+            return False
+
+        async with self._exchange():
+            to_send = SENDB + b' ' + format(len(message), '02X').encode('utf-8')
+            starttime = time.perf_counter_ns()
+            if self.comms._write_to_sp(to_send) > 0:
+                reply = await self._read_response(dollar=True)
+                if self.comms._check_for_dollar(reply):
+                    self.comms.stats.record(CMD_SEND, True, starttime)
+                    starttime = time.perf_counter_ns()
+                    if self.comms._write_to_sp(message) > 0:
+                        reply = await self._read_response()
+                        if self.comms._check_lora_response(reply):
+                            self.comms.stats.record(CMD_PAYLOAD, True, starttime)
+                            return True
+                        self.comms._flush_input()
+                    self.comms.stats.record(CMD_PAYLOAD, False, starttime)
+                    return False
+                self.comms._flush_input()
+            self.comms.stats.record(CMD_SEND, False, starttime)
+        return False
+
+    async def receive(self, timeout=None):
+        # Wait for a packet and return it, or zero bytes if none arrives within timeout seconds
+        # If timeout is None it waits until a packet arrives
+        if await self._wait_for_data_pin(timeout) != 1:
+            return b''
+
+        async with self._exchange():
+            starttime = time.monotonic()
+            startns = time.perf_counter_ns()
+            if self.comms.pipelined:
+                sent = self.comms._write_to_sp(REC_LEN + b'\r\n' + RECC)
+            else:
+                sent = self.comms._write_to_sp(REC_LEN)
+            if sent <= 0:
+                return b''
+            reply = await self._read_response()
+            length = -1
+            if self.comms._check_lora_response(reply):
+                try:
+                    length = int(reply.data, 16)
+                except ValueError:
+                    logging.warning("[LCA]: Unable to decode the length from the LoRa module:%s" % reply.data)
+            self.comms.stats.record(CMD_LENGTH, length >= 0, startns)
+            if length < 0:
+                self.comms._flush_input()
+                return b''
+            startns = time.perf_counter_ns()
+            if self.comms.pipelined == False:
+                if length == 0:
+                    return b''
+                if self.comms._write_to_sp(RECC) <= 0:
+                    return b''
+            # With nothing to read this takes the reply to the pipelined AT+A, so it isn't left behind
+            reply = await self._read_response(data_len=length)
+            if length == 0:
+                return b''
+            status = self.comms._check_lora_response(reply)
+            self.comms.stats.record(CMD_RECEIVE, status, startns)
+            if status == False:
+                self.comms._flush_input()
+                return b''
+            self.comms.last_receive_latency = time.monotonic() - starttime
+        logging.info("[LCA]: Received Data Packet in %0.6fs" % self.comms.last_receive_latency)
+        self.comms._log_packet("Received Data Packet", reply.data)
+        return reply.data
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        # Return each packet received, waiting as long as needed
+        while True:
+            packet = await self.receive()
+            if len(packet) > 0:
+                return packet
+
+    def close(self):
+        # This routine is called on the exit of the main program
+        self.comms.exit_comms()
+        return
+
+#=======================================================================
+#
+#    P R I V A T E   F U N C T I O N S
+#
+#    Not to be Called Directly from outside call
+#
+#=======================================================================
+
+    @contextlib.asynccontextmanager
+    async def _exchange(self):
+        # Hold the module for one exchange, against the other coroutines with the asyncio lock and
+        # against the threads using the LoRaComms with its uart_lock
+        # The uart_lock is only tried, so the event loop isn't blocked while another thread has it
+        async with self.lock:
+            while self.comms.uart_lock.acquire(blocking=False) == False:
+                await asyncio.sleep(POLL_INTERVAL)
+            try:
+                # The serial port is only read by the event loop while it holds the lock
+                self.rx_event.clear()
+                self.loop.add_reader(self.fd.fileno(), self._serial_readable)
+                try:
+                    yield
+                finally:
+                    self.loop.remove_reader(self.fd.fileno())
+            finally:
+                self.comms.uart_lock.release()
+
+    def _serial_readable(self):
+        # Called by the event loop when the serial port has data to read
+        if self.comms._read_into_parser(0) > 0:
+            self.rx_event.set()
+        return
+
+    def _data_pin_edge(self, channel):
+        # Called from the GPIO event thread when the data pin goes high
+        self.loop.call_soon_threadsafe(self.data_ready.set)
+        return
+
+    async def _read_response(self, data_len=None, dollar=False, timeout=LORA_TIMEOUT):
+        # Wait for the parser to have a complete response from the module, see LoRaComms._read_response
+        deadline = self.loop.time() + timeout
+        response = self.parser.next_response(data_len, dollar)
+        while response is None:
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                leftover = self.parser.clear()
+                logging.warning("[LCA]: Timeout waiting for a response from the LoRa module, received:%s" % leftover)
+                return LoRaResponse(RESP_TIMEOUT, raw=leftover)
+            self.rx_event.clear()
+            try:
+                await asyncio.wait_for(self.rx_event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+            response = self.parser.next_response(data_len, dollar)
+        return response
+
+    async def _wait_for_data_pin(self, timeout=None):
+        # Wait for the data pin to be high, returns the pin status at the end of the wait
+        starttime = time.monotonic()
+        startns = time.perf_counter_ns()
+        deadline = None
+        if timeout is not None:
+            deadline = starttime + timeout
+        self.data_ready.clear()
+        status = self.comms.data_pin.input()
+        while status != 1:
+            wait = EDGE_RECHECK
+            if deadline is not None:
+                wait = min(deadline - time.monotonic(), wait)
+                if wait <= 0:
+                    break
+            if self.comms.edge_wait:
+                try:
+                    await asyncio.wait_for(self.data_ready.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                self.data_ready.clear()
+            else:
+                await asyncio.sleep(min(wait, POLL_INTERVAL))
+            status = self.comms.data_pin.input()
+        self.comms.last_wait_time = time.monotonic() - starttime
+        self.comms.stats.record(CMD_GPIO_WAIT, status == 1, startns)
+        return status
@@ -7,24 +7,31 @@ It is intended to be used as part of the LoRa Monitor.
 User funcitons are
 initialise
 transmit(message to send)   sends the message to send
-receive                     returns message received
+queue_transmit(message)     queues the message to be sent, returns a Future with the transmit status
+stats_snapshot              returns the latency and counts for each command type
+receive                     returns message received, as a memoryview valid until the next receive
 exitcomms                   closes comms
 """
 
 #TODO: Change logging to use self.log rather than logging.
 #          self.log = getLogger()
 
-#TODO: Improve peroformance. Currently waits for 1s to send a message, due to using readall, rather than read specific length
-
-import serial
 import logging
+import json
+import os
 import time
 import math
 import sys
 import random
-import RPi.GPIO as GPIO
-from datetime import datetime
-from datetime import timedelta
+import threading
+import queue
+import select
+from concurrent.futures import Future
+from LoRaTransport import SerialTransport, GpioDataPin
+from cls_LoRaResponse import LoRaResponseParser, LoRaResponse
+from cls_LoRaResponse import RESP_OK, RESP_DATA, RESP_DOLLAR, RESP_PROMPT, RESP_ERROR, RESP_TIMEOUT
+from cls_LoRaStats import LoRaStats, CMD_SEND, CMD_PAYLOAD, CMD_LENGTH, CMD_RECEIVE, CMD_CONFIG, CMD_GPIO_WAIT
+from cls_LoRaStats import EVT_FLUSH, EVT_SHORT_REPLY, EVT_NEGATIVE_REPLY
 
 # use _name for non public methods
 
@@ -45,8 +52,18 @@ INTERDELAY = 2.02
 
 # The timeout between sending a message to the LoRa and waiting for a response from it
 # This is not the time for radio comms, but typically for the OK00 from the LoRa module
+# Replies are read until the > prompt, so this is only reached if the module doesn't respond
 LORA_TIMEOUT = 0.5
 
+# The time to wait for a reply to each wake-up message before sending another
+WAKEUP_TIMEOUT = 0.1
+
+# The LoRa mode expected in the configuration (AT*q) reply, set by SLORAMODE_ONE
+LORAMODE_EXPECTED = '1'
+
+# The file the last known configuration of the LoRa module is saved to
+LORA_CONFIG_FILE = "loraconfig.json"
+
 # The delay applied after a failed message has been received. This could be either a
 # fail to send or a failed response
 FAILDELAY = 0.03
@@ -57,6 +74,16 @@ RETRY_COUNT = 3
 # The pin which has the LED connected
 LED_PIN = 23
 
+# When waiting on the data pin edge, the longest time to block before re-checking the pin level
+# This only guards against a missed edge, it does not delay the response to a packet
+EDGE_RECHECK = 1.0
+
+# The delay between reads of the data pin when edge detection is not available
+POLL_INTERVAL = 0.002
+
+# The maximum number of messages waiting in the transmit queue, 0 for no limit
+TX_QUEUE_SIZE = 0
+
 # LoRa Commands
 SENDB = b'AT+X'                     # Send a stream of n bytes long
 REC_LEN = b'AT+r'                   # Return the received length of data
@@ -66,6 +93,96 @@ VERSION = b'AT*v'                   # Read the version of the LoRa module
 GLORA =  b'AT*q'                    # Display the current configuration
 SLORAMODE_ONE = b'sloramode 1'      # Start the LoRa module at 868MHz
 
+class LoRaModuleConfig:
+    '''
+    The configuration of the LoRa module, taken from the VERSION (AT*v) and GLORA (AT*q) replies
+
+    version     - the version text reported by the module
+    settings    - dictionary of the settings reported by GLORA, one per line as 'name: value'
+
+    '''
+
+    def __init__(self, version='', settings=None):
+        self.version = version
+        if settings is None:
+            settings = {}
+        self.settings = settings
+        return
+
+    def set_version(self, reply):
+        # Take the version from the parsed VERSION reply
+        if reply.kind == RESP_OK:
+            self.version = reply.data.decode('utf-8', errors='replace').strip()
+        return
+
+    def set_settings(self, reply):
+        # Take the settings from the parsed GLORA reply, lines are 'name: value' or 'name=value'
+        if reply.kind != RESP_OK:
+            return
+        self.settings = {}
+        for line in reply.data.decode('utf-8', errors='replace').splitlines():
+            name, sep, value = line.replace('=', ':').partition(':')
+            if sep:
+                self.settings[name.strip()] = value.strip()
+        return
+
+    def lora_mode(self):
+        # Return the LoRa mode from the settings, or '' if it isn't there
+        for name in self.settings:
+            if _is_mode_setting(name):
+                return self.settings[name]
+        return ''
+
+    def differences(self, other):
+        # Return the names of the settings that are different in the other configuration, or
+        # missing from either of them
+        names = set(self.settings) | set(other.settings)
+        return sorted(name for name in names if self.settings.get(name) != other.settings.get(name))
+
+    def save(self, filename):
+        # Write the configuration to the given file
+        try:
+            with open(filename, mode='w') as f:
+                json.dump({'version': self.version, 'settings': self.settings}, f)
+        except OSError:
+            logging.warning("[LCR]: Unable to save the LoRa module configuration to %s" % filename)
+        return
+
+    @classmethod
+    def load(cls, filename):
+        # Read the configuration saved in the given file, returns None if there isn't a valid one
+        if not os.path.isfile(filename):
+            return None
+        try:
+            with open(filename, mode='r') as f:
+                snapshot = json.load(f)
+            return cls(snapshot['version'], snapshot['settings'])
+        except (OSError, ValueError, KeyError, TypeError):
+            logging.warning("[LCR]: Saved LoRa module configuration in %s is invalid, ignored" % filename)
+        return None
+
+    def __eq__(self, other):
+        return isinstance(other, LoRaModuleConfig) and self.version == other.version and self.settings == other.settings
+
+    def __repr__(self):
+        return "LoRaModuleConfig(version=%s, settings=%s)" % (self.version, self.settings)
+
+
+def _is_mode_setting(name):
+    # True if the GLORA setting is the LoRa mode, the one setting SLORAMODE_ONE changes
+    return 'mode' in name.lower()
+
+def setup_commands(differences):
+    # Return the commands to send to change the settings named in differences back to the snapshot
+    # The mode is set with SLORAMODE_ONE, any other setting can only be put back by a RESET, which
+    # also clears the mode so it is set again afterwards
+    if len(differences) == 0:
+        return []
+    if all(_is_mode_setting(name) for name in differences):
+        return [SLORAMODE_ONE]
+    return [RESET, SLORAMODE_ONE]
+
+
 class LoRaComms:
     '''
     Class to handle all communicaitons with the LoRa module
@@ -75,11 +192,50 @@ class LoRaComms:
 
     '''
 
-    def __init__(self):
+    def __init__(self, edge_wait=True, fast_start=False, config_file=LORA_CONFIG_FILE, pipelined=False,
+                 transport=None, data_pin=None):
         # initialise the comms  for the module
+        # edge_wait uses the rising edge of the data pin to wake up rather than polling it
+        # fast_start waits for the module replies instead of fixed delays and only sends the
+        # commands needed to get from the saved configuration (config_file) to the one required
+        # pipelined sends AT+r and AT+A together when receiving, saving a UART round trip
+        # transport and data_pin are the connections to the module, see LoRaTransport, by default
+        # the Pi UART and GPIO
+        if transport is None:
+            transport = SerialTransport(timeout=LORA_TIMEOUT)
+        if data_pin is None:
+            data_pin = GpioDataPin(INPUT_PIN, LED_PIN)
+        self.transport = transport
+        self.data_pin = data_pin
+        self.edge_wait = edge_wait
+        self.pipelined = pipelined
+        self.fast_start = fast_start
+        self.config_file = config_file
+        self.module_config = LoRaModuleConfig()     # The configuration reported by the module
+        self.startup_timing = {}                # The time taken by each phase of the startup
+        self.data_ready = threading.Event()     # Set from the GPIO thread on a rising edge
+        self.edge_time = 0                      # time.monotonic() of the last rising edge
+        self.last_wait_time = 0                 # How long the last data pin wait blocked for
+        self.last_edge_latency = 0              # Time from the pin edge to the wait waking up
+        self.last_receive_latency = 0           # Time from the data pin to the packet being read
+        self.receive_count = 0                  # Number of packets read
+        self.receive_latency_total = 0          # Total of the receive latency, for the average
+        self.uart_lock = threading.RLock()      # Held for each exchange with the module
+        self.transmit_queue = queue.Queue(TX_QUEUE_SIZE)
+        self.transmit_closed = False            # Set by exit_comms, no more messages are queued
+        self.transmit_closed_lock = threading.Lock()
+        self.transmit_thread = threading.Thread(target=self._transmit_worker, name="LoRaTransmit", daemon=True)
+        self.tx_stats = {'sent': 0, 'failed': 0, 'last_wait': 0, 'total_wait': 0, 'last_send': 0, 'total_send': 0}
+        self.parser = LoRaResponseParser()      # Holds the bytes read back from the module
+        self.stats = LoRaStats()                # Latency and counts for each command type
+        starttime = time.monotonic()
         self.fd = self._setup_uart()
+        phasetime = self._startup_phase('uart', starttime)
         self._setup_gpio()
+        self._startup_phase('gpio', phasetime)
         self._setup_lora()
+        self._log_startup_timing(starttime)
+        self.transmit_thread.start()
 
     def transmit(self, message):
         # Send data out on the comms port
@@ -90,38 +246,45 @@ class LoRaComms:
             logging.critical("[LCR]: Radio Message length is greater than 255 limit, aborting: %s" % message)
             return False
 
-        # Message to send is AT+X plus a space plus the length in 2 char hex, all encoded in binary string format
-        # Expect to get \r\n$ back to then send the data
-        to_send = SENDB + b' ' + format(len(message), '02X').encode('utf-8')
-        reply = self._write_to_sp(to_send)
-        if reply > 0:
-            reply = self._read_from_sp(3)       # MB: Added 3 to improve performance, expect \r\n$ as reply
-            if self._check_for_dollar(reply):
-                if self._write_to_sp(message) > 0:
-                    reply = self._read_from_sp(7)       # MB: Added 7 as expected response '\r\nOK00>'
-                    if self._check_lora_response(reply):
-                        return True
-                    else:
-                        # Response is incorrect, clear the buffer
-                        self.fd.flushInput()
-            else:
-                # Failed to get a $ in reply, clear the buffer
-                self.fd.flushInput()
-        return False
+        with self.uart_lock:
+            return self._transmit(message)
+
+    def queue_transmit(self, message):
+        # Add the message to the transmit queue and return straight away
+        # Returns a Future, its result is the True / False status from transmit once it is sent
+        # and it has wait_time (time queued) and send_time (time to send) added
+        # Once exit_comms has been called the Future fails straight away
+        future = Future()
+        with self.transmit_closed_lock:
+            if self.transmit_closed == False:
+                self.transmit_queue.put((message, future, time.monotonic()))
+                return future
+        logging.warning("[LCR]: Message not queued, the comms have been closed")
+        future.set_exception(RuntimeError("LoRa comms closed"))
+        return future
+
+    def transmit_queue_stats(self):
+        # Return the current queue depth and the times for the messages sent from the queue
+        stats = dict(self.tx_stats)
+        stats['depth'] = self.transmit_queue.qsize()
+        count = stats['sent'] + stats['failed']
+        if count > 0:
+            stats['average_wait'] = stats['total_wait'] / count
+            stats['average_send'] = stats['total_send'] / count
+        return stats
+
+    def stats_snapshot(self):
+        # Return the latency histogram and success / fail counts for each command type and the
+        # event counts, see LoRaStats.snapshot
+        return self.stats.snapshot()
 
     def receive(self):
         # Receive data on the comms port and return it to the calling program
         # NOTE: It can return zero bytes if there is no data to read
 
         self._wait_for_gpio()
-        length = self._get_data_length()
-        if length > 0:
-            reply = self._get_data_packet(length)
-            if len(reply) > 0:
-                data = self._strip_out_data(reply, length)
-                if data['success']:
-                    return data['reply']
-        return b''
+        with self.uart_lock:
+            return self._read_packet()
 
     def receivetimeout(self, waittime):
         # Receive data on the comms port and return it to the calling program if data received
@@ -129,18 +292,21 @@ class LoRaComms:
         # NOTE: It can return zero bytes if there is no data to read
 
         self._wait_for_gpio_timeout(waittime)
-        length = self._get_data_length()
-        if length > 0:
-            reply = self._get_data_packet(length)
-            if len(reply) > 0:
-                data = self._strip_out_data(reply, length)
-                if data['success']:
-                    return data['reply']
-        return b''
+        with self.uart_lock:
+            return self._read_packet()
 
     def exit_comms(self):
         # This routine is called on the exit of the main program
-        GPIO.cleanup()
+        # Let the messages already queued be sent before stopping, any left are failed
+        with self.transmit_closed_lock:
+            self.transmit_closed = True
+            self.transmit_queue.put(None)
+        self.transmit_thread.join()
+        while self.transmit_queue.empty() == False:
+            item = self.transmit_queue.get()
+            if item is not None and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(RuntimeError("LoRa comms closed"))
+        self.data_pin.cleanup()
         self.fd.close()
         return
 
@@ -154,6 +320,70 @@ class LoRaComms:
 
 
 
+    def _transmit(self, message):
+        # Send the message to the LoRa module, called with the uart_lock held
+        # Message to send is AT+X plus a space plus the length in 2 char hex, all encoded in binary string format
+        # Expect to get \r\n$ back to then send the data
+        to_send = SENDB + b' ' + format(len(message), '02X').encode('utf-8')
+        starttime = time.perf_counter_ns()
+        reply = self._write_to_sp(to_send)
+        if reply > 0:
+            reply = self._read_response(dollar=True)
+            if self._check_for_dollar(reply):
+                self.stats.record(CMD_SEND, True, starttime)
+                starttime = time.perf_counter_ns()
+                if self._write_to_sp(message) > 0:
+                    reply = self._read_response()       # Expected response '\r\nOK00>'
+                    if self._check_lora_response(reply):
+                        self.stats.record(CMD_PAYLOAD, True, starttime)
+                        return True
+                    else:
+                        # Response is incorrect, clear the buffer
+                        self._flush_input()
+                self.stats.record(CMD_PAYLOAD, False, starttime)
+                return False
+            else:
+                # Failed to get a $ in reply, clear the buffer
+                self._flush_input()
+        self.stats.record(CMD_SEND, False, starttime)
+        return False
+
+    def _transmit_worker(self):
+        # Runs in its own thread, sending the messages from the transmit queue in order
+        # A None in the queue stops the thread
+        while True:
+            item = self.transmit_queue.get()
+            if item is None:
+                break
+            message, future, queued = item
+            if future.set_running_or_notify_cancel() == False:
+                # Cancelled while waiting in the queue
+                continue
+            starttime = time.monotonic()
+            future.wait_time = starttime - queued
+            error = None
+            try:
+                status = self.transmit(message)
+            except Exception as e:
+                logging.exception("[LCR]: Transmit from the queue FAILED")
+                status = False
+                error = e
+            future.send_time = time.monotonic() - starttime
+            if status:
+                self.tx_stats['sent'] = self.tx_stats['sent'] + 1
+            else:
+                self.tx_stats['failed'] = self.tx_stats['failed'] + 1
+            self.tx_stats['last_wait'] = future.wait_time
+            self.tx_stats['total_wait'] = self.tx_stats['total_wait'] + future.wait_time
+            self.tx_stats['last_send'] = future.send_time
+            self.tx_stats['total_send'] = self.tx_stats['total_send'] + future.send_time
+            logging.debug("[LCR]: Queued message sent:%s, waited %0.6fs, sent in %0.6fs" % (status, future.wait_time, future.send_time))
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(status)
+        return
+
     def _write_to_sp(self, data_to_transmit):
         # Write the given data to the serial port
         # Returns the data length or 0 if failed
@@ -169,158 +399,348 @@ class LoRaComms:
             ans = 0
         return ans
 
-    def _read_from_sp(self, length=-1):
-        # Read data from the serial port, using length if given
-        # return the data, length of zero if nothing of failed
-        # Modified the serial setup to extend the delay for upto LORA_TIMEOUT time to allow for a slow response
+    def _read_response(self, data_len=None, dollar=False, timeout=LORA_TIMEOUT):
+        # Read from the serial port until the parser has a complete response from the module
+        # Only waits as long as the bytes take to arrive, up to the timeout if they don't
+        # data_len and dollar are passed to the parser, see LoRaResponseParser.next_response
+        # Returns a LoRaResponse, of kind RESP_TIMEOUT if nothing complete was received
+        deadline = time.monotonic() + timeout
+        response = self.parser.next_response(data_len, dollar)
+        while response is None:
+            if time.monotonic() >= deadline:
+                leftover = self.parser.clear()
+                logging.warning("[LCR]: Timeout waiting for a response from the LoRa module, received:%s" % leftover)
+                return LoRaResponse(RESP_TIMEOUT, raw=leftover)
+            # Read whatever is waiting, or block until at least 1 byte arrives
+            if self._read_into_parser(deadline - time.monotonic()) > 0:
+                response = self.parser.next_response(data_len, dollar)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("[LCR]: Response from the LoRa module:%s" % response)
+        return response
+
+    def _read_into_parser(self, timeout):
+        # Read the bytes waiting on the serial port straight into the parser's buffer, so they are
+        # not copied into a new bytes object on the way
+        # Waits up to timeout seconds for at least 1 byte, returns the number of bytes read
         try:
-            if length == -1:
-                #TODO: Possibly use the inWaiting capability rather than readall
-                reply = self.fd.readall()
-            else:
-                reply = self.fd.read(length)
-        except:
+            ready, _, _ = select.select([self.fd.fileno()], [], [], max(0, timeout))
+            if len(ready) == 0:
+                return 0
+            count = os.readv(self.fd.fileno(), [self.parser.read_space()])
+        except (OSError, ValueError):
             logging.warning("[LCR]: Reading of data on the serial port FAILED")
-            reply = b''
             self._led_error()
+            return 0
+        self.parser.commit(count)
+        return count
+
+    def _flush_input(self):
+        # Clear the serial buffer and any part response held by the parser
+        self.stats.count(EVT_FLUSH)
+        self.fd.flushInput()
+        leftover = self.parser.clear()
+        if len(leftover) > 0:
+            logging.debug("[LCR]: Discarded data from the LoRa module:%s" % leftover)
+        return
 
-        logging.debug("[LCR]: Data read back from the serial port :%s" % reply)
-        return reply
+    def _clear_input(self):
+        # Clear anything left over before a command is sent, so the next reply read is for it
+        # This is routine, so it is only counted as a flush if there was something to throw away
+        waiting = self.fd.in_waiting
+        self.fd.flushInput()
+        leftover = self.parser.clear()
+        if waiting > 0 or len(leftover) > 0:
+            self.stats.count(EVT_FLUSH)
+            logging.debug("[LCR]: Discarded %s bytes waiting and data from the LoRa module:%s" % (waiting, leftover))
+        return
 
     def _led_error(self):
         # Flash the LED for an error state
         return
 
     def _check_for_dollar(self, receive):
-        # Given the response, check for the $
+        # Given the parsed response, check for the $
         # A positive response is b'\r\n$'
-        if b'$' in receive:
+        if receive.kind == RESP_DOLLAR:
             return True
         else:
             return False
 
     def _check_lora_response(self, receive):
-        # For the given response, check the lora reply is a positive reply
+        # For the given parsed response, check the lora reply is a positive reply
         # return True if it is, else False if it isnt, capturingn the error message
         # A good response will have OK00 before the '>' prompt
-        response_posn = 5       # The position of the response from the end
-        if len(receive) < response_posn:
-            logging.warning("[LCR]: Length of response received is too short:%s" % receive)
-            return False
-
-        if b'OK00' in receive[len(receive) - response_posn:]:
+        if receive.kind == RESP_OK or receive.kind == RESP_DATA:
             return True
+        elif receive.kind == RESP_ERROR:
+            self.stats.count(EVT_NEGATIVE_REPLY)
+            logging.warning("[LCR]: Negative response received from the LoRa module:%s" % receive.code)
         else:
-            response = receive[len(receive) - response_posn:]
-            logging.warning("[LCR]: Negative response received from the LoRa module:%s" % response)
-            return False
+            self.stats.count(EVT_SHORT_REPLY)
+            logging.warning("[LCR]: Response received is incomplete:%s" % receive.raw)
+        return False
 
     def _setup_uart(self):
         """
         Setup the UART for communications and return an object referencing it. Does:-
-        -Initiates serial software
-        -Opens the serial port
+        -Opens the port of the transport
         -Checks all is ok and returns the object
         """
-        try:
-            ser = serial.Serial('/dev/serial0',
-                                baudrate=57600,
-                                parity=serial.PARITY_NONE,
-                                stopbits=serial.STOPBITS_ONE,
-                                bytesize=serial.EIGHTBITS,
-                                timeout=LORA_TIMEOUT)
-        except:
-            logging.critical("[SIM]: Unable to Setup communications on Serial0, trying ttyAMA0")
-            ser = ''
-
-        if ser =='':
-            try:
-                ser = serial.Serial('/dev/ttyAMA0',
-                                    baudrate=57600,
-                                    parity=serial.PARITY_NONE,
-                                    stopbits=serial.STOPBITS_ONE,
-                                    bytesize=serial.EIGHTBITS,
-                                    timeout=LORA_TIMEOUT)
-            except:
-                logging.critical("[SIM]: Unable to Setup communications on ttyAMA0")
-                sys.exit()
+        ser = self.transport.open()
+        if ser is None:
+            logging.critical("[LCR]: Unable to Setup communications on %s" % self.transport)
+            sys.exit()
 
-        time.sleep(INTERDELAY)
+        if self.fast_start == False:
+            time.sleep(INTERDELAY)
 
         # clear the serial buffer of any left over data
         ser.flushInput()
+        self.parser.clear()
 
         if ser.isOpen():
             # if serial comms are setup and the channel is opened
-            logging.info ("[LCR]: PI UART setup complete on channel %d as : %s" % (ser.fd, ser.getSettingsDict))
+            logging.info ("[LCR]: UART setup complete on %s" % ser.port)
         else:
             logging.critical("[LCR]: Unable to Setup communications")
             sys.exit()
         return ser
 
     def _setup_gpio(self):
-        # Setup the GPIO for the reading of the incoming data
-        GPIO.setwarnings(False)
-        GPIO.setmode(GPIO.BCM)
-        time.sleep(0.2)
-        GPIO.setup(INPUT_PIN, GPIO.IN)
-        GPIO.setup(LED_PIN, GPIO.OUT)
-        logging.debug("[LCR]: GPIO Setup Complete")
+        # Setup the data pin for the reading of the incoming data
+        settle = 0.2
+        if self.fast_start:
+            settle = 0
+        if self.edge_wait:
+            self.edge_wait = self.data_pin.setup(self._data_pin_edge, settle)
+        else:
+            self.data_pin.setup(None, settle)
+        logging.debug("[LCR]: GPIO Setup Complete, edge wait:%s" % self.edge_wait)
+        return
+
+    def _data_pin_edge(self, channel):
+        # Called from the GPIO event thread when the data pin goes high
+        self.edge_time = time.monotonic()
+        self.data_ready.set()
         return
 
     def _setup_lora(self):
         # Setup the LoRa module configuration
         logging.info("[LCR]: Setting up the LoRA module with the various commands")
+        if self.fast_start:
+            self._setup_lora_fast()
+            return
+        phasetime = time.monotonic()
         self._lora_module_wakeup()
         time.sleep(INTERDELAY)
-        
+        phasetime = self._startup_phase('wakeup', phasetime)
+
         self._send_config_command(RESET)
         time.sleep(INTERDELAY)
         time.sleep(INTERDELAY)
+        phasetime = self._startup_phase('reset', phasetime)
 
-        self._send_config_command(VERSION)
+        self.module_config.set_version(self._send_config_command(VERSION))
         time.sleep(INTERDELAY)
+        phasetime = self._startup_phase('version', phasetime)
         self._send_config_command(SLORAMODE_ONE)
         time.sleep(INTERDELAY)
-        self._send_config_command(GLORA)
+        self.module_config.set_settings(self._send_config_command(GLORA))
+        self._startup_phase('configure', phasetime)
+        self.module_config.save(self.config_file)
+        return
+
+    def _setup_lora_fast(self):
+        # Setup the LoRa module, moving on as soon as each reply is received rather than
+        # waiting fixed delays. The live configuration is compared with the snapshot saved the
+        # last time the module was set up, and only the commands to put back the settings that
+        # differ are sent. Without a snapshot the module is set up in full, unless it is already
+        # in the LoRa mode wanted.
+        phasetime = time.monotonic()
+        self._lora_module_wakeup()
+        phasetime = self._startup_phase('wakeup', phasetime)
+
+        # The version is always read, the module may have been swapped for one with the same settings
+        self.module_config.set_version(self._send_config_command(VERSION))
+        self.module_config.set_settings(self._send_config_command(GLORA))
+        phasetime = self._startup_phase('read', phasetime)
+
+        snapshot = LoRaModuleConfig.load(self.config_file)
+        if snapshot is None or snapshot.lora_mode() != LORAMODE_EXPECTED:
+            if self.module_config.lora_mode() == LORAMODE_EXPECTED:
+                commands = []
+                logging.info("[LCR]: No usable LoRa module snapshot, module already in mode %s" % LORAMODE_EXPECTED)
+            else:
+                commands = [RESET, SLORAMODE_ONE]
+                logging.info("[LCR]: No usable LoRa module snapshot, setting up in full")
+        else:
+            differences = snapshot.differences(self.module_config)
+            commands = setup_commands(differences)
+            logging.info("[LCR]: LoRa module settings different to the snapshot:%s, commands:%s" % (differences, commands))
+        self._send_setup_commands(commands)
+        if len(commands) > 0 and RESET not in commands and snapshot.differences(self.module_config) != []:
+            # Setting the mode wasn't enough, so the module is reset and set up again
+            logging.info("[LCR]: LoRa module still different to the snapshot, resetting")
+            self._send_setup_commands([RESET, SLORAMODE_ONE])
+        phasetime = self._startup_phase('configure', phasetime)
+
+        if self.module_config.lora_mode() != LORAMODE_EXPECTED:
+            logging.warning("[LCR]: LoRa module not in mode %s after setup:%s" % (LORAMODE_EXPECTED, self.module_config))
+        elif self.module_config != snapshot:
+            self.module_config.save(self.config_file)
+        logging.info("[LCR]: LoRa module configuration: %s" % self.module_config)
+        return
+
+    def _send_setup_commands(self, commands):
+        # Send the setup commands in turn and read the settings again afterwards, if any were sent
+        if len(commands) == 0:
+            return
+        for command in commands:
+            self._send_config_command(command)
+            if command == RESET:
+                # The module restarts after the reset, so wait for it to respond again
+                self._lora_module_wakeup()
+        self.module_config.set_settings(self._send_config_command(GLORA))
+        return
+
+    def _startup_phase(self, phase, since):
+        # Record the time taken for the phase of the startup, returns the time now for the next phase
+        now = time.monotonic()
+        self.startup_timing[phase] = now - since
+        return now
+
+    def _log_startup_timing(self, starttime):
+        # Log the breakdown of the startup time
+        breakdown = ", ".join(["%s:%0.3fs" % (phase, self.startup_timing[phase]) for phase in self.startup_timing])
+        logging.info("[LCR]: Startup completed in %0.3fs (fast start:%s) - %s" % (time.monotonic() - starttime, self.fast_start, breakdown))
         return
 
     def _wait_for_gpio(self):
-        # Routine monitors the GPIO pin and waits for the line to go high indicating a packet.
+        # Routine waits for the data pin to go high indicating a packet.
         logging.debug("[LCR]: Waiting for data pin to go high")
         logging.info(" ")       # Add blank line for readability of the log file
 
-        status = 0
-        while(status!=1):
-            status = GPIO.input(INPUT_PIN)
+        self._wait_for_data_pin()
         logging.debug("[LCR]: Data Pin gone high at time :%s" % time.strftime("%d-%m-%y %H:%M:%S"))
         return
 
     def _wait_for_gpio_timeout(self, waittime):
-        # Routine monitors the GPIO pin and waits for the line to go high indicating a packet.
+        # Routine waits for the data pin to go high indicating a packet, or for waittime seconds
         logging.debug("[LCR]: Timeout waiting for data pin to go high")
         logging.info(" ")       # Add blank line for readability of the log file
 
-        status = 0
-        endtime = datetime.now() + timedelta(seconds=waittime)
-        timeout = False
-        while (status==0) and timeout == False:
-            status = GPIO.input(INPUT_PIN)
-            if datetime.now() > endtime:
-                timeout=True
-        
+        status = self._wait_for_data_pin(waittime)
         logging.debug("[LCR]: Data Pin status at end of wait:%s, time :%s" % (status, time.strftime("%d-%m-%y %H:%M:%S")))
         return
-        
+
+    def _wait_for_data_pin(self, waittime=None):
+        # Block until the data pin is high, or until waittime seconds have passed if given
+        # In edge_wait mode it sleeps on the rising edge event so no CPU is used while idle,
+        # otherwise the pin is polled every POLL_INTERVAL
+        # Returns the pin status at the end of the wait
+        startns = time.perf_counter_ns()
+        starttime = time.monotonic()
+        if waittime is None:
+            deadline = None
+        else:
+            deadline = starttime + waittime
+        self.data_ready.clear()
+        status = self.data_pin.input()
+        while status != 1:
+            wait = EDGE_RECHECK
+            if deadline is not None:
+                wait = min(deadline - time.monotonic(), wait)
+                if wait <= 0:
+                    break
+            if self.edge_wait:
+                self.data_ready.wait(wait)
+                self.data_ready.clear()
+            else:
+                time.sleep(min(wait, POLL_INTERVAL))
+            status = self.data_pin.input()
+
+        waketime = time.monotonic()
+        self.last_wait_time = waketime - starttime
+        if status == 1 and self.edge_time >= starttime:
+            # The edge happened during this wait, so measure how long it took to wake up
+            self.last_edge_latency = waketime - self.edge_time
+        else:
+            self.last_edge_latency = 0
+        self.stats.record(CMD_GPIO_WAIT, status == 1, startns)
+        logging.debug("[LCR]: Data pin wait took %0.6fs, edge to wake-up %0.6fs" % (self.last_wait_time, self.last_edge_latency))
+        return status
+
+    def _read_packet(self):
+        # Read the packet from the LoRa module once the data pin has been seen
+        # Returns the packet, or zero bytes if there is no data to read
+        starttime = time.monotonic()
+        if self.pipelined:
+            reply = self._get_data_pipelined()
+            length = len(reply)
+        else:
+            reply = b''
+            length = self._get_data_length()
+            if length > 0:
+                reply = self._get_data_packet(length)
+        if len(reply) > 0:
+            data = self._strip_out_data(reply, length)
+            if data is not None:
+                self.last_receive_latency = time.monotonic() - starttime
+                self.receive_count = self.receive_count + 1
+                self.receive_latency_total = self.receive_latency_total + self.last_receive_latency
+                logging.info("[LCR]: Packet read in %0.6fs, average %0.6fs over %s packets (pipelined:%s)" %
+                             (self.last_receive_latency, self.receive_latency_total / self.receive_count, self.receive_count, self.pipelined))
+                return data
+        return b''
+
+    def _get_data_pipelined(self):
+        # Send the REC_LEN (AT+r) and RECC (AT+A) in one write, then parse both replies as they
+        # arrive, so there is only one UART round trip for the packet
+        # return the packet, or zero bytes on fail
+        packet = b''
+        starttime = time.perf_counter_ns()
+        if self._write_to_sp(REC_LEN + b'\r\n' + RECC) > 0:
+            # Expect to get 'xx\r\nOK00>' followed by 'message\r\nOK00>'
+            reply = self._read_response()
+            length = -1
+            if self._check_lora_response(reply):
+                try:
+                    length = int(reply.data, 16)
+                except ValueError:
+                    logging.warning("[LCR]: Unable to decode the length from the LoRa module:%s" % reply.data)
+            self.stats.record(CMD_LENGTH, length >= 0, starttime)
+            if length >= 0:
+                # With nothing to read this takes the reply to the AT+A, so it isn't left behind
+                # The AT+A latency is from the AT+r reply, as both were sent together
+                starttime = time.perf_counter_ns()
+                reply = self._read_response(data_len=length)
+                if length > 0 and self._check_lora_response(reply):
+                    packet = reply.data
+                if length > 0:
+                    self.stats.record(CMD_RECEIVE, len(packet) > 0, starttime)
+            else:
+                # The length is unknown, so discard the reply to the AT+A
+                self._flush_input()
+            logging.info("[LCR]: Sent %s and %s, expected message is %s bytes" % (REC_LEN, RECC, length))
+        self._log_packet("Received Data Packet", packet)
+        return packet
+
     def _get_data_length(self):
         # Send the REC_LEN (AT+r) and decode the response to get the length of the data
         # return the length, or zero on fail
         length = 0
+        starttime = time.perf_counter_ns()
         if self._write_to_sp(REC_LEN) > 0:
             # Expect to get 'xx\r\nOK00>' where xx is the length byte
-            reply = self._read_from_sp(9)
-            if self._check_lora_response(reply):
-                length = int(reply[0:2], 16)
+            reply = self._read_response()
+            status = self._check_lora_response(reply)
+            if status:
+                try:
+                    length = int(reply.data, 16)
+                except ValueError:
+                    logging.warning("[LCR]: Unable to decode the length from the LoRa module:%s" % reply.data)
+                    status = False
+            self.stats.record(CMD_LENGTH, status, starttime)
         logging.info("[LCR]: Sent %s, expected message is %s bytes" %(REC_LEN, length))
         return length
 
@@ -329,33 +749,44 @@ class LoRaComms:
         # The length is the length of the message, not including the \r\nOK00> - 7 bytes
         # return the length, or zero on fail
         packet = b''
+        starttime = time.perf_counter_ns()
         if self._write_to_sp(RECC) > 0:
             # Expect to get 'message\r\nOK00>' where message is the packet of length given
-            reply = self._read_from_sp(length + 7)        #was (length) in parameters
-            #MB: Added length validation to see if it improves performance
+            reply = self._read_response(data_len=length)
             if self._check_lora_response(reply):
-#                packet = (reply[0:length], 16)
-                packet = reply[0:length]
-        logging.info("[LCR]: Received Data Packet:%s" % packet)
+                packet = reply.data
+            else:
+                self._flush_input()
+            self.stats.record(CMD_RECEIVE, len(packet) > 0, starttime)
+        self._log_packet("Received Data Packet", packet)
         return packet
 
     def _strip_out_data(self, message, length):
         # given the message of data, strip out the data and return it
-        # Returns a dictionary of the True / False and the stripped out data
-        ans = b''
+        # The message is a memoryview onto the parser's buffer, so the data is too, no bytes are copied
+        # Returns the stripped out data, or None if the message is too short
 
         if len(message) < length:
             # The data returned is shorter than expected, return failed
             logging.warning("[LCR]: Reply shorter than expected from the LoRa module")
-            return {'success':False, 'reply':ans}
+            return None
 
-        # Populate the first part of the data (ans) with the data
-        ans = message[0:length]
-        logging.info("[LCR} - Data of length >%s< read from the Serial port: %a" % (length, ans))
-        return {'success':True, 'reply':ans}
+        # The first part of the message is the data, which is usually all of it
+        ans = message
+        if len(message) > length:
+            ans = message[0:length]
+        logging.info("[LCR]: Data of length >%s< read from the Serial port" % length)
+        return ans
+
+    def _log_packet(self, text, packet):
+        # Log the content of the packet, which is only copied out of the memoryview when debug logging is on
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("[LCR]: %s:%a" % (text, bytes(packet)))
+        return
 
     def _lora_module_wakeup(self):
         # This function sends data and gets the reply for the various configuration commands.
+        # Returns True once the module has responded
         logging.info("[LCR]: Waking up the LoRa module")
         command =b'\n'
         working = False
@@ -371,34 +802,37 @@ class LoRaComms:
 #            ans = self._write_to_sp(command)
 
             if ans > 0:
-                time.sleep(SRDELAY)
-                # No need to check the reply as it has already been validated
-                reply = self._read_from_sp()            #TODO: Work out the right length
-
-#BUG: Can't use this check response as the reply is <5 most of the time.
-                working = self._check_lora_response(reply)
+                # Any prompt back shows the module is awake, it doesn't always include the OK00
+                reply = self._read_response(timeout=WAKEUP_TIMEOUT)
+                working = reply.kind in (RESP_OK, RESP_PROMPT)
             else:
                 logging.warning("[LCR]: Failed to Send Config Command %s" % command)
                 self._led_error()
-        return
+        return working
 
     def _send_config_command(self, command):
         # This function sends data and gets the reply for the various configuration commands.
         # Tries for the RETRY_COUNT times before returning.
+        # Returns the last reply received
+        reply = LoRaResponse(RESP_TIMEOUT)
         tries = RETRY_COUNT
         while tries > 0: 
+            # Clear out anything left over, e.g. extra wake-up prompts, so the reply is for this command
+            self._clear_input()
+            starttime = time.perf_counter_ns()
             ans = self._write_to_sp(command)
             if ans > 0:
-                time.sleep(SRDELAY)
-                reply = self._read_from_sp()            #TODO: Need to understand length
-                if self._check_lora_response(reply):
+                reply = self._read_response()
+                status = self._check_lora_response(reply)
+                self.stats.record(CMD_CONFIG, status, starttime)
+                if status:
                     logging.debug("[LCR]: Sent Config Command successfully: %s" % command)
                     break
             else:
                 logging.warning("[LCR]: Failed to Send Config Command %s" % command)
                 self._led_error()
             tries = tries - 1
-        return
+        return reply
 
 
 # Only call the independent routine if the module is being called directly, else it is handled by the calling program
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+'''
+Benchmark of the LoRa module response parser in cls_LoRaResponse
+
+Uses canned transcripts of the replies from the LoRa module, so it doesn't need a Pi or a module.
+
+Two measurements are made
+- Parse rate    - responses per second when the transcript is fed in whole and a byte at a time
+- Round trip    - time for a config command exchange using the original readall() compared to
+                  reading until the > prompt, against a simulated serial port with the same
+                  timeout behaviour as pyserial
+
+For more info see www.CognIot.eu
+'''
+
+import time
+import threading
+
+from cls_LoRaResponse import LoRaResponseParser, RESP_DATA, RESP_OK, RESP_DOLLAR, RESP_ERROR
+
+# Matches the serial port timeout used in LoRaCommsReceiverV2
+LORA_TIMEOUT = 0.5
+
+# The delay before the simulated module starts sending its reply
+MODULE_DELAY = 0.002
+
+# Number of passes through the transcript for the parse rate
+PARSE_PASSES = 2000
+
+# Number of config command exchanges for the round trip
+ROUND_TRIPS = 4
+
+FRAME = b'ABCD\x00' + b'1234\x00' + b'7' + b'\x1d' + b'[[1, 42, "Lux", "2017-10-18 10:00:00.123"]]'
+
+# Each entry is the reply bytes, the data length expected (AT+A) or None, if $ is expected and the result
+TRANSCRIPT = [
+    [b'\r\nOK00>', None, False, RESP_OK],                                   # AT!!
+    [b'RF Module V1.2\r\nOK00>', None, False, RESP_OK],                     # AT*v
+    [b'\r\nOK00>', None, False, RESP_OK],                                   # sloramode 1
+    [b'Freq 868100000\r\nSF 7\r\nBW 125\r\nOK00>', None, False, RESP_OK],   # AT*q
+    [b'\r\n$', None, True, RESP_DOLLAR],                                    # AT+X
+    [b'\r\nOK00>', None, False, RESP_OK],                                   # payload sent
+    [format(len(FRAME), '02X').encode('utf-8') + b'\r\nOK00>', None, False, RESP_OK],   # AT+r
+    [FRAME + b'\r\nOK00>', len(FRAME), False, RESP_DATA],                   # AT+A
+    [b'\r\nER04>', None, True, RESP_ERROR],                                 # AT+X rejected
+    [b'\r\nER02>', 0, False, RESP_ERROR],                                  # AT+A with nothing to read, AT+r gave 0
+    ]
+
+
+class SimulatedSerial:
+    '''
+    Provides read, readall and in_waiting with the same timeout behaviour as pyserial.
+    The reply is made available MODULE_DELAY after write is called.
+    '''
+    def __init__(self, reply, timeout=LORA_TIMEOUT):
+        self.reply = reply
+        self.timeout = timeout
+        self.buffer = b''
+        self.ready = threading.Event()
+        return
+
+    def write(self, data):
+        self.ready.clear()
+        self.buffer = b''
+        timer = threading.Timer(MODULE_DELAY, self._arrive)
+        timer.start()
+        return len(data)
+
+    def _arrive(self):
+        self.buffer = self.reply
+        self.ready.set()
+        return
+
+    @property
+    def in_waiting(self):
+        return len(self.buffer)
+
+    def read(self, size=1):
+        # Returns as soon as size bytes are available, or after the timeout
+        if len(self.buffer) < size:
+            self.ready.wait(self.timeout)
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+    def readall(self):
+        # pyserial reads until the timeout expires with no further data
+        self.ready.wait(self.timeout)
+        time.sleep(self.timeout)
+        data = self.buffer
+        self.buffer = b''
+        return data
+
+
+def check_transcript():
+    # Confirm every reply is parsed to the expected response type, fed whole and a byte at a time
+    parser = LoRaResponseParser()
+    for reply, data_len, dollar, expected in TRANSCRIPT:
+        parser.feed(reply)
+        response = parser.next_response(data_len, dollar)
+        assert response is not None and response.kind == expected, (reply, response)
+        for byte in range(0, len(reply)):
+            parser.feed(reply[byte:byte + 1])
+            response = parser.next_response(data_len, dollar)
+            if response is not None:
+                break
+        # The response must only be complete once the last byte has arrived
+        assert byte == len(reply) - 1 and response.kind == expected, (reply, response)
+        assert parser.pending() == 0
+    return
+
+def parse_rate(byte_at_a_time):
+    # Return the number of responses parsed per second
+    parser = LoRaResponseParser()
+    count = 0
+    starttime = time.perf_counter()
+    for loop in range(0, PARSE_PASSES):
+        for reply, data_len, dollar, expected in TRANSCRIPT:
+            if byte_at_a_time:
+                for byte in range(0, len(reply)):
+                    parser.feed(reply[byte:byte + 1])
+            else:
+                parser.feed(reply)
+            parser.next_response(data_len, dollar)
+            count = count + 1
+    return count / (time.perf_counter() - starttime)
+
+def round_trip_readall():
+    # The original exchange, sleep for SRDELAY then readall
+    port = SimulatedSerial(TRANSCRIPT[0][0])
+    starttime = time.perf_counter()
+    for loop in range(0, ROUND_TRIPS):
+        port.write(b'AT!!\r\n')
+        time.sleep(0.01)
+        port.readall()
+    return (time.perf_counter() - starttime) / ROUND_TRIPS
+
+def round_trip_parser():
+    # Read whatever is waiting, or at least 1 byte, until the parser has the > prompt
+    port = SimulatedSerial(TRANSCRIPT[0][0])
+    parser = LoRaResponseParser()
+    starttime = time.perf_counter()
+    for loop in range(0, ROUND_TRIPS):
+        port.write(b'AT!!\r\n')
+        response = None
+        while response is None:
+            parser.feed(port.read(max(1, port.in_waiting)))
+            response = parser.next_response()
+    return (time.perf_counter() - starttime) / ROUND_TRIPS
+
+def main():
+    check_transcript()
+    print("Transcript of %s replies parsed correctly" % len(TRANSCRIPT))
+    print("Parse rate, whole replies      : %10.0f responses/s" % parse_rate(False))
+    print("Parse rate, 1 byte at a time   : %10.0f responses/s" % parse_rate(True))
+    old = round_trip_readall()
+    new = round_trip_parser()
+    print("Config round trip with readall : %10.1f ms" % (old * 1000))
+    print("Config round trip until prompt : %10.1f ms" % (new * 1000))
+    return
+
+
+if __name__ == '__main__':
+    main()
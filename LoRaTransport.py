@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Bostin Technology  (see www.CognIoT.eu)
+
+The connections between LoRaComms and the LoRa module, so LoRaComms can run against the module
+on the Pi UART or against VirtualLoRaModule on any Linux box.
+
+Transports, open() returns the port LoRaComms uses, which has the pyserial functions it needs
+(write, read, readall, in_waiting, flushInput, fileno, isOpen, close, timeout and port)
+    SerialTransport     - the Pi UART, /dev/serial0 or /dev/ttyAMA0
+    PtyTransport        - a pseudo terminal, e.g. the one created by VirtualLoRaModule
+    MemoryTransport     - one end of a socket pair, no terminal needed
+
+Data pins, the pin the module raises when it has a packet to read
+    GpioDataPin         - the Pi GPIO pin, using RPi.GPIO
+    VirtualDataPin      - a pin in memory, set by VirtualLoRaModule
+
+RPi.GPIO is only needed for GpioDataPin, so everything else can be used off the Pi.
+"""
+
+import fcntl
+import logging
+import select
+import socket
+import sys
+import termios
+import time
+import threading
+
+import serial
+
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    # Not running on a Pi, only the virtual data pin can be used
+    GPIO = None
+
+# The serial ports tried in turn for the Pi UART
+SERIAL_PORTS = ('/dev/serial0', '/dev/ttyAMA0')
+
+# The UART speed of the LoRa module
+BAUDRATE = 57600
+
+# The timeout for a read of the serial port if none is given
+READ_TIMEOUT = 0.5
+
+
+class SerialTransport:
+    """
+    The LoRa module connected to a serial port, the Pi UART unless other ports are given
+    """
+
+    def __init__(self, ports=SERIAL_PORTS, baudrate=BAUDRATE, timeout=READ_TIMEOUT):
+        self.ports = ports
+        self.baudrate = baudrate
+        self.timeout = timeout
+        return
+
+    def open(self):
+        # Open the first of the ports that is available and return it, or None if none are
+        for port in self.ports:
+            try:
+                ser = serial.Serial(port,
+                                    baudrate=self.baudrate,
+                                    parity=serial.PARITY_NONE,
+                                    stopbits=serial.STOPBITS_ONE,
+                                    bytesize=serial.EIGHTBITS,
+                                    timeout=self.timeout)
+                return ser
+            except (serial.SerialException, OSError, ValueError):
+                logging.critical("[LTP]: Unable to Setup communications on %s" % port)
+        return None
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, ", ".join(self.ports))
+
+
+class PtyTransport(SerialTransport):
+    """
+    The LoRa module connected to a pseudo terminal, given the path of the terminal
+    """
+
+    def __init__(self, path, timeout=READ_TIMEOUT):
+        SerialTransport.__init__(self, ports=(path,), timeout=timeout)
+        return
+
+
+class MemoryTransport:
+    """
+    The LoRa module connected to one end of a socket pair, given the socket for this end
+    """
+
+    def __init__(self, sock, timeout=READ_TIMEOUT):
+        self.sock = sock
+        self.timeout = timeout
+        return
+
+    def open(self):
+        return MemoryPort(self.sock, self.timeout)
+
+    def __repr__(self):
+        return "MemoryTransport(%s)" % self.sock.fileno()
+
+
+class MemoryPort:
+    """
+    The functions of a pyserial port used by LoRaComms, over a socket
+    """
+
+    def __init__(self, sock, timeout=READ_TIMEOUT):
+        self.sock = sock
+        self.timeout = timeout              # As pyserial, None to block, 0 not to wait
+        self.port = "memory:%s" % sock.fileno()
+        return
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def isOpen(self):
+        return self.sock.fileno() >= 0
+
+    def write(self, data):
+        self.sock.sendall(data)
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        # The number of bytes that can be read without waiting
+        waiting = bytearray(4)
+        fcntl.ioctl(self.sock.fileno(), termios.FIONREAD, waiting)
+        return int.from_bytes(waiting, sys.byteorder)
+
+    def read(self, size=1):
+        # Returns as soon as size bytes have been read, or when the timeout passes
+        data = b''
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.monotonic() + self.timeout
+        while len(data) < size:
+            wait = None
+            if deadline is not None:
+                wait = max(0, deadline - time.monotonic())
+            ready, _, _ = select.select([self.sock], [], [], wait)
+            if len(ready) == 0:
+                break
+            more = self.sock.recv(size - len(data))
+            if len(more) == 0:
+                break
+            data = data + more
+        return data
+
+    def readall(self):
+        # As pyserial, read until no more data arrives within the timeout
+        data = b''
+        while True:
+            ready, _, _ = select.select([self.sock], [], [], self.timeout)
+            if len(ready) == 0:
+                return data
+            more = self.sock.recv(4096)
+            if len(more) == 0:
+                return data
+            data = data + more
+
+    def flushInput(self):
+        # Throw away anything waiting to be read
+        while self.in_waiting > 0:
+            self.sock.recv(self.in_waiting)
+        return
+
+    def close(self):
+        self.sock.close()
+        return
+
+
+class GpioDataPin:
+    """
+    The data pin connected to the Pi GPIO, with the LED pin set as an output
+    """
+
+    def __init__(self, pin, led_pin):
+        self.pin = pin
+        self.led_pin = led_pin
+        return
+
+    def setup(self, edge_callback=None, settle=0.2):
+        # Setup the GPIO, calling edge_callback on each rising edge of the pin if given
+        # settle is the time to wait after setting the mode
+        # Returns True if the edge callback is in use, False if the pin has to be polled
+        if GPIO is None:
+            logging.critical("[LTP]: RPi.GPIO is not available, a VirtualDataPin is needed off the Pi")
+            sys.exit()
+        GPIO.setwarnings(False)
+        GPIO.setmode(GPIO.BCM)
+        time.sleep(settle)
+        GPIO.setup(self.pin, GPIO.IN)
+        GPIO.setup(self.led_pin, GPIO.OUT)
+        if edge_callback is None:
+            return False
+        try:
+            GPIO.add_event_detect(self.pin, GPIO.RISING, callback=edge_callback)
+        except RuntimeError:
+            logging.warning("[LTP]: Unable to add edge detection to the data pin, polling instead")
+            return False
+        return True
+
+    def add_callback(self, callback):
+        # Add a further callback for the rising edge, once setup has added the edge detection
+        GPIO.add_event_callback(self.pin, callback)
+        return
+
+    def input(self):
+        # Return the level of the pin, 1 when there is data to read
+        return GPIO.input(self.pin)
+
+    def cleanup(self):
+        GPIO.cleanup()
+        return
+
+
+class VirtualDataPin:
+    """
+    A data pin in memory, set by VirtualLoRaModule when it has a packet to read
+    The callbacks are made from the thread that sets the pin, as RPi.GPIO uses its own thread
+    """
+
+    def __init__(self, pin=0):
+        self.pin = pin                  # Passed to the callbacks as the channel
+        self.level = 0
+        self._callbacks = []
+        self._lock = threading.Lock()
+        return
+
+    def setup(self, edge_callback=None, settle=0):
+        # Nothing to set up, the callback is always available
+        if edge_callback is None:
+            return False
+        self.add_callback(edge_callback)
+        return True
+
+    def add_callback(self, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+        return
+
+    def input(self):
+        return self.level
+
+    def set(self, level):
+        # Set the level of the pin, calling the callbacks if it has gone from low to high
+        with self._lock:
+            rising = level == 1 and self.level == 0
+            self.level = level
+            callbacks = list(self._callbacks)
+        if rising:
+            for callback in callbacks:
+                callback(self.pin)
+        return
+
+    def cleanup(self):
+        with self._lock:
+            self._callbacks = []
+        return
+
+
+def memory_link(timeout=READ_TIMEOUT):
+    # Create a connected pair of sockets, returns the MemoryTransport for LoRaComms and the
+    # socket for the module end
+    comms_end, module_end = socket.socketpair()
+    return MemoryTransport(comms_end, timeout), module_end
@@ -21,6 +21,7 @@ The LoRaComms class can opoerate in test mode:
 This operates at the lowest level possible, without actual comms down the serial port.
 
 It is not implemented at this time - this version runs on a separate Pi.
+To run without a second Pi, use VirtualLoRaModule, which emulates the module in software.
 
 '''
 #TODO: Handle the LED
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+'''
+Benchmark of the binary record format against the JSON text records
+
+For records as written by TestFileGenerator, measures the size of each record, how many readings
+fit in one aggregate packet and the LoRa airtime for each reading, sending them as text and in
+the binary format of cls_RecordCodec. Also measures how many records per second the node can
+encode and the hub can decode.
+
+No radio is needed, the airtime is worked out with VirtualLoRaModule.lora_airtime.
+
+For more info see www.CognIot.eu
+'''
+
+import random
+import timeit
+from datetime import datetime
+from datetime import timedelta
+
+from cls_RecordCodec import encode_record, decode_record
+from cls_CognIoTCodec import pack_records, HEADER_LEN, MAX_LORA_PAYLOAD
+from VirtualLoRaModule import lora_airtime
+
+# Number of records compared
+RECORDS = 1000
+
+# Number of encodes and decodes timed
+OPERATIONS = 20000
+
+
+def generate_records(count):
+    # Records in the format written by TestFileGenerator, a reading every few seconds
+    records = []
+    moment = datetime(2026, 10, 18, 10, 0, 0, 123000)
+    for loop in range(0, count):
+        timestamp = str(moment)[:23]
+        records.append('[[1, %s, "Lux", "%s"]]' % (random.randint(0, 100), timestamp))
+        moment = moment + timedelta(milliseconds=random.randint(1000, 10000))
+    return records
+
+def airtime_per_reading(payloads):
+    # Pack the payloads into aggregate packets and return the readings per packet and airtime per reading
+    remaining = list(payloads)
+    packets = 0
+    airtime = 0
+    while len(remaining) > 0:
+        payload, count = pack_records(remaining, MAX_LORA_PAYLOAD)
+        packets = packets + 1
+        airtime = airtime + lora_airtime(HEADER_LEN + len(payload))
+        del remaining[:count]
+    return len(payloads) / packets, airtime * 1000 / len(payloads)
+
+def main():
+    records = generate_records(RECORDS)
+    text = [record.encode('utf-8') for record in records]
+    binary = [encode_record(record) for record in records]
+    assert all(decode_record(record) == original for record, original in zip(binary, records))
+
+    text_size = sum(len(record) for record in text) / len(text)
+    binary_size = sum(len(record) for record in binary) / len(binary)
+    text_readings, text_airtime = airtime_per_reading(text)
+    binary_readings, binary_airtime = airtime_per_reading(binary)
+
+    print("%s records, e.g. %s" % (RECORDS, records[0]))
+    print("Record size          text %6.1f bytes,  binary %6.1f bytes, %0.1fx smaller" %
+          (text_size, binary_size, text_size / binary_size))
+    print("Readings per packet  text %6.1f,        binary %6.1f,       %0.1fx more" %
+          (text_readings, binary_readings, binary_readings / text_readings))
+    print("Airtime per reading  text %6.1f ms,     binary %6.1f ms,    %0.1fx less" %
+          (text_airtime, binary_airtime, text_airtime / binary_airtime))
+
+    names = {'encode_record': encode_record, 'decode_record': decode_record,
+             'record': records[0], 'binary': binary[0]}
+    encode_rate = OPERATIONS / timeit.timeit("encode_record(record)", globals=names, number=OPERATIONS)
+    decode_rate = OPERATIONS / timeit.timeit("decode_record(binary)", globals=names, number=OPERATIONS)
+    print("Node encodes %0.0f records/s, hub decodes %0.0f records/s" % (encode_rate, decode_rate))
+    return
+
+
+if __name__ == '__main__':
+    main()
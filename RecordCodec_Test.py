@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+'''
+This program is used to test the binary records and delta blocks of cls_RecordCodec
+
+Each scenario is encoded and decoded again, and the text that comes back must be exactly the
+record given, or the encoding refused so the record is sent as text. The delta blocks are checked
+with runs of the same change longer than one run byte can hold, and the decoders are given bad
+input, which must be rejected rather than raise or return the wrong records.
+
+For more info see www.CognIot.eu
+'''
+
+import sys
+import logging
+from datetime import datetime
+from datetime import timedelta
+
+from cls_RecordCodec import encode_record, decode_record, DeltaEncoder, decode_delta_block
+from cls_RecordCodec import RECORD_FORMAT_BINARY, DELTA_FORMAT, MAX_RUN
+
+# The first timestamp of the generated records
+RT_START = datetime(2026, 10, 18, 10, 0, 0)
+
+# The size limit of the delta blocks, large enough that the runs aren't cut short
+RT_BLOCK_LIMIT = 4096
+
+
+def rt_record(test, text, binary=True):
+    # A record that is encoded and decoded back to the same text, or refused if binary is False
+    return [test, text, binary]
+
+def rt_readings(count, step_ms, change, fraction=True):
+    # Generate records of a single reading, each changed by the same amount from the one before
+    records = []
+    for loop in range(0, count):
+        moment = RT_START + timedelta(milliseconds=123 + step_ms * loop)
+        if fraction:
+            timestamp = str(moment)[:23]
+        else:
+            timestamp = str(moment.replace(microsecond=0))
+        records.append('[[1, %s, "Lux", "%s"]]' % (400 + change * loop, timestamp))
+    return records
+
+def rt_varint(number):
+    # Return the number as a zigzag varint, to build steps the encoder would never make
+    number = -2 * number - 1 if number < 0 else 2 * number
+    encoded = bytearray()
+    while number > 0x7f:
+        encoded.append((number & 0x7f) | 0x80)
+        number = number >> 7
+    encoded.append(number)
+    return bytes(encoded)
+
+def build_record_scenarios():
+    # Build the list of records to encode and decode
+    build = []
+    build.append(rt_record("Single reading", '[[1, 42, "Lux", "2017-10-18 10:00:00.123"]]'))
+    build.append(rt_record("Several readings", '[[1, 42, "Lux", "2017-10-18 10:00:00.123"], [2, 21.5, "C", "2017-10-18 10:00:00.456"]]'))
+    build.append(rt_record("No fraction of a second", '[[2, -3.25, "C", "2026-10-18 10:00:00"]]'))
+    build.append(rt_record("No units", '[[9, 0, "", "2020-02-29 23:59:59.999"]]'))
+    build.append(rt_record("Largest value", '[[1, 2147483647, "Lux", "2017-10-18 10:00:00.000"]]'))
+    build.append(rt_record("Smallest value", '[[1, -2147483648, "Lux", "2017-10-18 10:00:00.000"]]'))
+    build.append(rt_record("Value too large", '[[1, 2147483648, "Lux", "2017-10-18 10:00:00.000"]]', False))
+    build.append(rt_record("Too many decimal places", '[[2, 21.12345, "C", "2017-10-18 10:00:00.123"]]', False))
+    build.append(rt_record("Unknown units", '[[1, 42, "furlongs", "2017-10-18 10:00:00.123"]]', False))
+    build.append(rt_record("Before the epoch", '[[1, 42, "Lux", "2016-12-31 23:59:59.000"]]', False))
+    build.append(rt_record("Sensor type too large", '[[256, 42, "Lux", "2017-10-18 10:00:00.123"]]', False))
+    build.append(rt_record("Not JSON", 'Lux 42 at 10:00', False))
+    build.append(rt_record("Empty list", '[]', False))
+    build.append(rt_record("Not a list of readings", '{"Lux": 42}', False))
+    build.append(rt_record("Spacing not as written", '[[1,42,"Lux","2017-10-18 10:00:00.123"]]', False))
+    return build
+
+def build_delta_scenarios():
+    # Build the list of record streams to delta encode and decode, a stream has to be taken in
+    # full by the encoder unless the limit is given
+    build = []
+    build.append(["One record", rt_readings(1, 5000, 1)])
+    build.append(["Two records", rt_readings(2, 5000, 1)])
+    build.append(["Run of %s repeats" % (MAX_RUN - 1), rt_readings(MAX_RUN + 1, 5000, 1)])
+    build.append(["Run of %s repeats, one run byte full" % MAX_RUN, rt_readings(MAX_RUN + 2, 5000, 1)])
+    build.append(["Run of %s repeats, over 2 run bytes" % (MAX_RUN + 1), rt_readings(MAX_RUN + 3, 5000, 1)])
+    build.append(["Run of 300 repeats", rt_readings(302, 1000, 0)])
+    build.append(["Run of 300 negative changes", rt_readings(302, 250, -3)])
+    build.append(["Run without fractions", rt_readings(200, 60000, 2, False)])
+    mixed = rt_readings(140, 5000, 1) + rt_readings(140, 5000, 1)[::-1] + rt_readings(10, 5000, 7)
+    build.append(["Runs broken by other changes", mixed])
+    types = []
+    for loop in range(0, 260):
+        moment = str(RT_START + timedelta(seconds=loop))
+        if loop % 130 < 2:
+            types.append('[[2, 21.5, "C", "%s"]]' % moment)
+        else:
+            types.append('[[1, 400, "Lux", "%s"]]' % moment)
+    build.append(["Type and units changing in a run", types])
+    return build
+
+def rt_check_records(scenarios):
+    # Encode and decode each record, returns the number that failed
+    failed = 0
+    for test, text, binary in scenarios:
+        record = encode_record(text)
+        if binary:
+            status = record is not None and record[0] == RECORD_FORMAT_BINARY and decode_record(record) == text
+        else:
+            status = record is None
+        if status:
+            print(".", end="", flush=True)
+        else:
+            failed = failed + 1
+            print("\n%s Test FAILED!!!!!" % test)
+            print("Record:>%s<, binary expected >%s<" % (text, binary))
+            print("     Encoded: %s" % record)
+    return failed
+
+def rt_check_deltas(scenarios):
+    # Delta encode each stream and check the block decodes back to the same records
+    failed = 0
+    for test, records in scenarios:
+        encoder = DeltaEncoder(RT_BLOCK_LIMIT)
+        added = 0
+        for record in records:
+            if encoder.add(record) == False:
+                break
+            added = added + 1
+        block = encoder.block()
+        decoded = decode_delta_block(block)
+        if added == len(records) and encoder.count == len(records) and decoded == records:
+            print(".", end="", flush=True)
+        else:
+            failed = failed + 1
+            print("\n%s Test FAILED!!!!!" % test)
+            print("Records added >%s< of >%s<, block of %s bytes" % (added, len(records), len(block)))
+            if decoded is None:
+                print("     Block not decoded")
+            else:
+                for position, (sent, received) in enumerate(zip(records, decoded)):
+                    if sent != received:
+                        print("     Record %s: sent >%s<, received >%s<" % (position, sent, received))
+                        break
+                print("     Records decoded: %s" % len(decoded))
+    return failed
+
+def rt_check_limit():
+    # A block stops taking records at the limit, and the ones it took are decoded
+    failed = 0
+    records = rt_readings(50, 5000, 1) + rt_readings(50, 3000, 5)[::-1]
+    for limit in (0, 12, 13, 14, 20, 40):
+        encoder = DeltaEncoder(limit)
+        for record in records:
+            if encoder.add(record) == False:
+                break
+        block = encoder.block()
+        if encoder.count == 0:
+            status = len(block) == 0
+        else:
+            status = len(block) <= limit and decode_delta_block(block) == records[:encoder.count]
+        if status:
+            print(".", end="", flush=True)
+        else:
+            failed = failed + 1
+            print("\nDelta block limit of %s Test FAILED!!!!!" % limit)
+            print("Records added >%s<, block >%s<" % (encoder.count, block))
+    return failed
+
+def rt_check_bad_input():
+    # The decoders reject input that isn't a valid record or block
+    failed = 0
+    record = encode_record('[[1, 42, "Lux", "2017-10-18 10:00:00.123"]]')
+    encoder = DeltaEncoder(RT_BLOCK_LIMIT)
+    for text in rt_readings(3, 5000, 1) + rt_readings(2, 1000, 400):
+        encoder.add(text)
+    # The block ends with a step, the change in the time being 2 bytes
+    block = encoder.block()
+    bad = []
+    bad.append(["Empty record", decode_record, b''])
+    bad.append(["Record without the format byte", decode_record, record[1:]])
+    bad.append(["Record with a text format byte", decode_record, b'[' + record[1:]])
+    bad.append(["Record cut short", decode_record, record[:-1]])
+    bad.append(["Record with a byte added", decode_record, record + b'\x00'])
+    bad.append(["Record with unknown units", decode_record, record[:2] + b'\x1f' + record[3:]])
+    bad.append(["Empty block", decode_delta_block, b''])
+    bad.append(["Block with only the format byte", decode_delta_block, bytes((DELTA_FORMAT,))])
+    bad.append(["Block with the first reading cut short", decode_delta_block, block[:12]])
+    bad.append(["Block with a binary record format byte", decode_delta_block, bytes((RECORD_FORMAT_BINARY,)) + block[1:]])
+    bad.append(["Block cut in a varint", decode_delta_block, block[:-1]])
+    bad.append(["Block with a type step and no type", decode_delta_block, block[:13] + b'\x01'])
+    bad.append(["Block with a step taking the time before the epoch", decode_delta_block, block[:13] + b'\x00\x00' + rt_varint(-10 ** 12)])
+    for test, decoder, data in bad:
+        try:
+            result = decoder(data)
+        except Exception as e:
+            result = e
+        if result is None:
+            print(".", end="", flush=True)
+        else:
+            failed = failed + 1
+            print("\n%s Test FAILED!!!!!" % test)
+            print("Input:>%s<, expected >None<" % data)
+            print("     Result: %s" % result)
+    return failed
+
+def rt_main():
+    # The main program that calls all the necessary routines to test cls_RecordCodec.py
+    record_scenarios = build_record_scenarios()
+    delta_scenarios = build_delta_scenarios()
+    failed = rt_check_records(record_scenarios)
+    failed = failed + rt_check_deltas(delta_scenarios)
+    failed = failed + rt_check_limit()
+    failed = failed + rt_check_bad_input()
+    print("\nRecords:%s, Delta streams:%s, Failed:%s" % (len(record_scenarios), len(delta_scenarios), failed))
+    return failed
+
+
+
+# Only call the independent routine if the module is being called directly, else it is handled by the calling program
+if __name__ == "__main__":
+    logging.basicConfig(filename="RecordCodec_Test.txt", filemode="w", level=logging.DEBUG,
+                        format='%(asctime)s:%(levelname)s:%(message)s')
+
+    if rt_main() > 0:
+        sys.exit(1)
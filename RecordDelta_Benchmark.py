@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+'''
+Benchmark of the delta blocks against the JSON text records and the binary records
+
+For generated streams of records, as a node with a backlog would send them, measures the bytes
+for each record when aggregated into packets as text, as binary records and as delta blocks, the
+compression ratio and the number of records in each packet, and the time the node takes to encode
+and the hub to decode each record of a delta block.
+
+    steady      a reading every 5 seconds that rarely changes
+    jitter      a reading every few seconds that changes a little each time
+    noisy       a random reading at random times
+    mixed       a temperature and a humidity reading taken in turn
+
+No radio is needed, only cls_RecordCodec and the aggregation of cls_CognIoTCodec are used.
+
+For more info see www.CognIot.eu
+'''
+
+import random
+import time
+from datetime import datetime
+from datetime import timedelta
+
+from cls_RecordCodec import DeltaEncoder, decode_delta_block, encode_record
+from cls_CognIoTCodec import pack_records, MAX_LORA_PAYLOAD, MAX_PAYLOAD_LEN
+
+# Number of records in each stream
+RECORDS = 2000
+
+# The first timestamp of each stream
+START = datetime(2026, 10, 18, 10, 0, 0)
+
+
+def steady_stream(count):
+    # A light level every 5 seconds that changes now and then
+    records = []
+    level = 400
+    for loop in range(0, count):
+        if random.random() < 0.05:
+            level = level + random.choice((-1, 1))
+        timestamp = str(START + timedelta(seconds=5 * loop))
+        records.append('[[1, %s, "Lux", "%s"]]' % (level, timestamp))
+    return records
+
+def jitter_stream(count):
+    # A temperature every 4 to 6 seconds with a little noise on it
+    records = []
+    moment = START
+    for loop in range(0, count):
+        value = round(21 + random.uniform(-0.5, 0.5), 1)
+        records.append('[[2, %s, "C", "%s"]]' % (value, str(moment)[:23]))
+        moment = moment + timedelta(milliseconds=random.randint(4000, 6000))
+    return records
+
+def noisy_stream(count):
+    # A random reading at random times, the worst case for delta encoding
+    records = []
+    moment = START + timedelta(milliseconds=123)
+    for loop in range(0, count):
+        records.append('[[1, %s, "Lux", "%s"]]' % (random.randint(0, 100000), str(moment)[:23]))
+        moment = moment + timedelta(milliseconds=random.randint(1000, 600000))
+    return records
+
+def mixed_stream(count):
+    # A temperature and a humidity reading in turn, every 10 seconds
+    records = []
+    for loop in range(0, count):
+        timestamp = str(START + timedelta(seconds=10 * (loop // 2)))
+        if loop % 2 == 0:
+            records.append('[[2, %s, "C", "%s"]]' % (round(20 + loop / 1000, 1), timestamp))
+        else:
+            records.append('[[4, %s, "%%", "%s"]]' % (55 + (loop // 50) % 3, timestamp))
+    return records
+
+def aggregated(payloads):
+    # Pack the payloads into aggregate packets, returns the payload bytes and the number of packets
+    remaining = list(payloads)
+    size = 0
+    packets = 0
+    while len(remaining) > 0:
+        payload, count = pack_records(remaining, MAX_LORA_PAYLOAD)
+        size = size + len(payload)
+        packets = packets + 1
+        del remaining[:count]
+    return size, packets
+
+def delta_blocks(records):
+    # Encode the records into delta blocks as Node.queue_records does, returns the blocks
+    blocks = []
+    position = 0
+    while position < len(records):
+        encoder = DeltaEncoder(min(MAX_LORA_PAYLOAD, MAX_PAYLOAD_LEN + 1) - 1)
+        for record in records[position:]:
+            if encoder.add(record) == False:
+                break
+        blocks.append(encoder.block())
+        position = position + encoder.count
+    return blocks
+
+def measure(name, records):
+    text_size, text_packets = aggregated([record.encode('utf-8') for record in records])
+    binary_size, binary_packets = aggregated([encode_record(record) for record in records])
+
+    starttime = time.perf_counter()
+    blocks = delta_blocks(records)
+    encode_time = time.perf_counter() - starttime
+    starttime = time.perf_counter()
+    decoded = []
+    for block in blocks:
+        decoded.extend(decode_delta_block(block))
+    decode_time = time.perf_counter() - starttime
+    assert decoded == records, "delta blocks don't decode to the records"
+    # Each block is sent with its length byte
+    delta_size = sum(len(block) + 1 for block in blocks)
+
+    print("%-7s %6.1f %6.1f %6.1f   %5.1fx %5.1fx   %5.1f %5.1f %5.1f   %6.1f %6.1f" % (
+        name, text_size / len(records), binary_size / len(records), delta_size / len(records),
+        text_size / delta_size, binary_size / delta_size,
+        len(records) / text_packets, len(records) / binary_packets, len(records) / len(blocks),
+        encode_time * 1e6 / len(records), decode_time * 1e6 / len(records)))
+    return
+
+def main():
+    random.seed(1)
+    print("%s records in each stream, %s bytes of payload per packet" % (RECORDS, MAX_LORA_PAYLOAD))
+    print("         Bytes per record       Delta smaller    Records per packet   us per record")
+    print("stream    text binary  delta   v text v binary  text binary delta   encode decode")
+    for name, stream in (('steady', steady_stream), ('jitter', jitter_stream),
+                         ('noisy', noisy_stream), ('mixed', mixed_stream)):
+        measure(name, stream(RECORDS))
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+'''
+This program is used to test the outbox of cls_RecordOutbox across restarts of the node
+
+In each scenario records are written to an outbox, some are read and acknowledged, often out of
+order as the hub acknowledges a window, and the outbox is then closed and opened again as if the
+node had restarted. The records returned after the restart must be exactly those written and not
+acknowledged, in order, with none lost and none sent again.
+
+For more info see www.CognIot.eu
+'''
+
+import sys
+import os
+import logging
+import shutil
+import tempfile
+
+from cls_RecordOutbox import OutboxWriter, RecordOutbox, segment_numbers, segment_name, CURSOR_FILE
+
+# The segment size used, small so the records are spread over several segments
+OT_SEGMENT_SIZE = 64
+
+# The most records read from the outbox at a time
+OT_WINDOW = 1000
+
+
+def ot_records(count, start=0):
+    # Generate the records to write
+    return [('[[1, %s, "Lux", "2026-10-18 10:00:%02d.000"]]' % (start + loop, (start + loop) % 60)).encode('utf-8')
+            for loop in range(0, count)]
+
+def ot_write(directory, records, segment_size=OT_SEGMENT_SIZE):
+    # Append the records to the outbox, as the program producing them does
+    writer = OutboxWriter(directory, segment_size=segment_size)
+    for record in records:
+        writer.append(record)
+    writer.close()
+    return
+
+def ot_restart(outbox, directory):
+    # Close the outbox and open it again, as after the node restarts
+    outbox.close()
+    return RecordOutbox(directory)
+
+def ot_acknowledge(outbox, order):
+    # Read the records and acknowledge those at the given positions, in that order, one at a time
+    # as each Ack arrives, returns the records acknowledged
+    read = outbox.records(OT_WINDOW)
+    acked = []
+    for position in order:
+        tag, record = read[position]
+        outbox.acknowledge([tag])
+        acked.append(record)
+    return acked
+
+def ot_out_of_order(directory):
+    # Acks received out of order, with gaps, are kept over a restart
+    records = ot_records(10)
+    ot_write(directory, records)
+    outbox = RecordOutbox(directory)
+    acked = ot_acknowledge(outbox, [6, 2, 4, 9])
+    outbox = ot_restart(outbox, directory)
+    expected = [record for record in records if record not in acked]
+    result = [record for tag, record in outbox.records(OT_WINDOW)]
+    outbox.close()
+    return result, expected
+
+def ot_gap_filled(directory):
+    # Acks out of order, then the gap at the front filled, move the cursor past all of them
+    records = ot_records(10)
+    ot_write(directory, records)
+    outbox = RecordOutbox(directory)
+    ot_acknowledge(outbox, [3, 1, 2, 5])
+    outbox = ot_restart(outbox, directory)
+    ot_acknowledge(outbox, [0])
+    outbox = ot_restart(outbox, directory)
+    result = [record for tag, record in outbox.records(OT_WINDOW)]
+    outbox.close()
+    return result, records[4:5] + records[6:]
+
+def ot_segments_deleted(directory):
+    # The segments passed by the cursor are deleted, those with records still to send are kept
+    records = ot_records(30)
+    ot_write(directory, records)
+    first = segment_numbers(directory)
+    outbox = RecordOutbox(directory)
+    ot_acknowledge(outbox, list(range(14, -1, -1)) + [20, 22])
+    outbox = ot_restart(outbox, directory)
+    result = [record for tag, record in outbox.records(OT_WINDOW)]
+    expected = [record for position, record in enumerate(records) if position >= 15 and position not in (20, 22)]
+    outbox.close()
+    remaining = segment_numbers(directory)
+    if len(first) < 3 or len(remaining) == 0 or remaining[0] == first[0]:
+        return (result, first, remaining), (expected, "more than 2 segments", "the first deleted")
+    return result, expected
+
+def ot_restart_while_writing(directory):
+    # Records written after the restart follow on from those not yet acknowledged
+    records = ot_records(12)
+    ot_write(directory, records[:6])
+    outbox = RecordOutbox(directory)
+    ot_acknowledge(outbox, [5, 0, 3])
+    outbox = ot_restart(outbox, directory)
+    ot_write(directory, records[6:])
+    ot_acknowledge(outbox, [0])
+    outbox = ot_restart(outbox, directory)
+    result = [record for tag, record in outbox.records(OT_WINDOW)]
+    outbox.close()
+    return result, records[2:3] + records[4:5] + records[6:]
+
+def ot_read_not_acked(directory):
+    # Records read but not yet acknowledged when the node stops are sent again after the restart
+    records = ot_records(8)
+    ot_write(directory, records)
+    outbox = RecordOutbox(directory)
+    outbox.records(OT_WINDOW)
+    outbox = ot_restart(outbox, directory)
+    ot_acknowledge(outbox, [7, 6])
+    outbox = ot_restart(outbox, directory)
+    result = [record for tag, record in outbox.records(OT_WINDOW)]
+    outbox.close()
+    return result, records[:6]
+
+def ot_incomplete_record(directory):
+    # A writer that stopped part way through a record leaves it out, the next writer starts a new
+    # segment and the reader carries on in it
+    records = ot_records(6)
+    ot_write(directory, records[:3], segment_size=4096)
+    last = segment_numbers(directory)[-1]
+    with open(segment_name(directory, last), mode='ab') as f:
+        f.write(b'\x00\x00\x00\x40\x12\x34')
+    outbox = RecordOutbox(directory)
+    ot_acknowledge(outbox, [1])
+    outbox = ot_restart(outbox, directory)
+    ot_write(directory, records[3:], segment_size=4096)
+    result = [record for tag, record in outbox.records(OT_WINDOW)]
+    outbox.close()
+    return result, records[:1] + records[2:]
+
+def ot_lost_cursor(directory):
+    # Without the cursor file the outbox starts again from the oldest segment, the records already
+    # acknowledged in it are sent again, those in the segments deleted are not
+    records = ot_records(10)
+    ot_write(directory, records)
+    outbox = RecordOutbox(directory)
+    ot_acknowledge(outbox, [3, 1, 0])
+    outbox.close()
+    os.remove(os.path.join(directory, CURSOR_FILE))
+    outbox = RecordOutbox(directory)
+    result = [record for tag, record in outbox.records(OT_WINDOW)]
+    outbox.close()
+    oldest = len(records) - len(result)
+    if oldest == 0 or oldest > 2:
+        return result, "the first segment deleted and the records after it"
+    return result, records[oldest:]
+
+def ot_main():
+    # The main program that calls all the necessary routines to test cls_RecordOutbox.py
+    scenarios = []
+    scenarios.append(["Acks out of order over a restart", ot_out_of_order])
+    scenarios.append(["Gap in the acks filled after a restart", ot_gap_filled])
+    scenarios.append(["Segments deleted once sent", ot_segments_deleted])
+    scenarios.append(["Records written after a restart", ot_restart_while_writing])
+    scenarios.append(["Records read but not acked", ot_read_not_acked])
+    scenarios.append(["Incomplete record from a writer", ot_incomplete_record])
+    scenarios.append(["Cursor file lost", ot_lost_cursor])
+
+    failed = 0
+    for test, scenario in scenarios:
+        directory = tempfile.mkdtemp(prefix='outbox_test_')
+        try:
+            result, expected = scenario(directory)
+        except Exception as e:
+            logging.exception("[OBT]: %s raised an exception" % test)
+            result, expected = e, None
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        if result == expected:
+            print(".", end="", flush=True)
+        else:
+            failed = failed + 1
+            print("\n%s Test FAILED!!!!!" % test)
+            print("Expected:>%s<" % (expected,))
+            print("     Result: %s" % (result,))
+    print("\nScenarios:%s, Failed:%s" % (len(scenarios), failed))
+    return failed
+
+
+
+# Only call the independent routine if the module is being called directly, else it is handled by the calling program
+if __name__ == "__main__":
+    logging.basicConfig(filename="RecordOutbox_Test.txt", filemode="w", level=logging.DEBUG,
+                        format='%(asctime)s:%(levelname)s:%(message)s')
+
+    if ot_main() > 0:
+        sys.exit(1)
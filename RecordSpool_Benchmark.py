@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+'''
+Benchmark of the RecordSpool against listing and sorting the record directory for every record
+
+A directory of pending record files, as left by a node that couldn't reach its hub, is drained
+one record at a time, reading and removing each file as GetRecord and RemoveRecordFile do.
+
+    listdir     lists and sorts the whole directory for each record, as GetRecord used to, so
+                draining it is O(N^2 log N). Only the first SAMPLE records are drained and the
+                total is estimated from them, as the cost per record falls in line with the files
+                left, about half the cost at the start on average
+    spool       a RecordSpool, scanned once and then taking the next record from its queue, with a
+                new record file written every NEW_EVERY records to be picked up by inotify
+
+It reports the time to build the spool, as on a restart, the time per record and the time to drain
+the whole backlog, and checks the spool gives the records in order, including the new ones.
+
+Usage
+    python3 RecordSpool_Benchmark.py [files] [directory]
+
+For more info see www.CognIot.eu
+'''
+
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from cls_RecordSpool import RecordSpool
+
+# The default number of pending record files
+FILES = 100000
+
+# The number of records drained with listdir to estimate the total
+SAMPLE = 200
+
+# A new record file is written after this many records are drained from the spool
+NEW_EVERY = 1000
+
+# The record file name and contents, as written by TestFileGenerator
+RECORDFILE_NAME = "DATA_%012d.rec"
+RECORD = '[[1, %s, "Lux", "2026-10-18 10:00:00.000"]]'
+
+
+def write_files(directory, start, count):
+    # Write count record files numbered from start
+    for number in range(start, start + count):
+        with open(os.path.join(directory, RECORDFILE_NAME % number), mode='w') as f:
+            f.write(RECORD % number)
+    return
+
+def take(directory, name):
+    # Read and remove the record file, as GetRecord and RemoveRecordFile do
+    with open(os.path.join(directory, name), mode='r') as f:
+        record = f.read()
+    os.remove(os.path.join(directory, name))
+    return record
+
+def drain_listdir(directory, count):
+    # Drain count records, listing and sorting the directory for each, returns the time taken
+    starttime = time.perf_counter()
+    for loop in range(0, count):
+        list_of_files = os.listdir(path=directory + '/.')
+        list_of_files.sort()
+        for name in list_of_files:
+            if name.endswith('.rec'):
+                take(directory, name)
+                break
+    return time.perf_counter() - starttime
+
+def drain_spool(directory, files):
+    # Drain every record with a RecordSpool, writing new ones as it goes, returns the time to build
+    # the spool and to drain it, and the records drained
+    starttime = time.perf_counter()
+    spool = RecordSpool(directory)
+    build = time.perf_counter() - starttime
+    inotify = spool.inotify is not None
+
+    starttime = time.perf_counter()
+    drained = []
+    new = files
+    name = spool.next_record()
+    while name != '':
+        drained.append(take(directory, name))
+        spool.discard(name)
+        if len(drained) % NEW_EVERY == 0:
+            write_files(directory, new, 1)
+            new = new + 1
+        name = spool.next_record()
+    period = time.perf_counter() - starttime
+    spool.close()
+    assert drained == [RECORD % number for number in range(0, new)] or inotify == False, "records out of order or lost"
+    return build, period, len(drained), inotify
+
+def main():
+    files = FILES
+    directory = None
+    if len(sys.argv) > 1:
+        files = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        directory = sys.argv[2]
+
+    print("%s pending record files" % files)
+    with tempfile.TemporaryDirectory(dir=directory) as workdir:
+        write_files(workdir, 0, files)
+        sample = min(SAMPLE, files)
+        period = drain_listdir(workdir, sample)
+        per_record = period / sample
+        print("listdir : %9.3fms per record, about %9.1fs to drain (from %s records)" %
+              (per_record * 1000, per_record * files / 2, sample))
+
+    with tempfile.TemporaryDirectory(dir=directory) as workdir:
+        write_files(workdir, 0, files)
+        build, period, drained, inotify = drain_spool(workdir, files)
+        print("spool   : %9.3fms per record, %9.1fs to drain %s records, %0.3fs to build, inotify %s" %
+              (period * 1000 / drained, period, drained, build, inotify))
+    return
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.CRITICAL)
+    main()
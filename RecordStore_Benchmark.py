@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+'''
+Benchmark of storing the records at the hub in a segment log against a file for each record
+
+Stores a backlog of records, as the hub's store stage does, and reports the records per second and
+the number of times the card was flushed for
+
+    files           a file for each record, as WriteDataToDir
+    files+fsync     a file for each record, each flushed to the card before the next
+    segments        a SegmentLog with each group commit setting in COMMITS
+
+The directory the records are written to should be on the card being measured, e.g. the SD card of
+the hub, as a tmpfs or a disk with a write cache makes the flushes look much cheaper than they are.
+
+Usage
+    python3 RecordStore_Benchmark.py [records] [directory]
+
+For more info see www.CognIot.eu
+'''
+
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from cls_RecordStore import SegmentLog, segments, read_segment
+
+# The default number of records stored for each method
+RECORDS = 2000
+
+# A record as written by TestFileGenerator
+RECORD = '[[1, %s, "Lux", "2026-10-18 10:00:00.000"]]'
+NODE = b'1234'
+
+# The group commit settings compared, the records and milliseconds between flushes
+COMMITS = ((1, 0), (16, 0), (64, 0), (0, 10), (0, 100), (64, 1000))
+
+
+def per_file(records, directory, flush):
+    # Write each record to its own file, as WriteDataToDir does, returns the time taken
+    starttime = time.perf_counter()
+    for record in records:
+        file_time = datetime.now().strftime("%y%m%d%H%M%S-%f")
+        with open(os.path.join(directory, 'DATA_' + file_time + '.rec'), mode='wb') as f:
+            f.write(record)
+            if flush:
+                f.flush()
+                os.fsync(f.fileno())
+    return time.perf_counter() - starttime
+
+def segment_log(records, directory, commit_records, commit_ms):
+    # Append the records to a segment log, committing after each as the store stage does, returns
+    # the time taken and the number of flushes
+    log = SegmentLog(directory, commit_records=commit_records, commit_ms=commit_ms)
+    starttime = time.perf_counter()
+    for record in records:
+        log.append(record, NODE, time.time())
+        log.commit()
+    log.close()
+    period = time.perf_counter() - starttime
+    stored = [record for filename in segments(directory) for node, received, record in read_segment(filename)]
+    assert stored == records, "records lost or out of order"
+    return period, log.commits
+
+def main():
+    records = RECORDS
+    directory = None
+    if len(sys.argv) > 1:
+        records = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        directory = sys.argv[2]
+    backlog = [(RECORD % count).encode('utf-8') for count in range(0, records)]
+
+    print("%s records of %s bytes" % (records, len(backlog[0])))
+    with tempfile.TemporaryDirectory(dir=directory) as workdir:
+        for flush in (False, True):
+            with tempfile.TemporaryDirectory(dir=workdir) as storedir:
+                period = per_file(backlog, storedir, flush)
+            print("%-30s %9.0f records/s %6s flushes" %
+                  ('files+fsync' if flush else 'files', records / period, records if flush else 0))
+        for commit_records, commit_ms in COMMITS:
+            with tempfile.TemporaryDirectory(dir=workdir) as storedir:
+                period, commits = segment_log(backlog, storedir, commit_records, commit_ms)
+            print("%-30s %9.0f records/s %6s flushes" %
+                  ('segments %s records/%sms' % (commit_records, commit_ms), records / period, commits))
+    return
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.CRITICAL)
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+'''
+This program is used to test the recovery of the segment log of cls_RecordStore
+
+In each scenario records are appended to a SegmentLog, the hub then stops without completing the
+open segment, part way through writing a record, and a new SegmentLog is started in the same
+directory. The open segment must be completed with every record written in full and nothing of the
+partly written one, and the records appended afterwards must go into the next segment.
+
+For more info see www.CognIot.eu
+'''
+
+import sys
+import os
+import logging
+import shutil
+import struct
+import tempfile
+import zlib
+
+from cls_RecordStore import SegmentLog, segments, read_segment, RECORD_HEADER, SEGMENT_EXT, OPEN_EXT
+
+# The node the records come from
+ST_NODE = b'1234'
+
+# The time the first record was received, each is a second after the one before
+ST_RECEIVED = 1792317600.0
+
+
+def st_records(count, start=0):
+    # Generate the (node, time received, record) to append
+    return [(ST_NODE, ST_RECEIVED + start + loop, ('[[1, %s, "Lux", "2026-10-18 10:00:00.000"]]' % (start + loop)).encode('utf-8'))
+            for loop in range(0, count)]
+
+def st_entry(node, received, record):
+    # Build a record as it is written in a segment, so part of one can be left at the end
+    body = node + struct.pack('>Q', int(received * 1000)) + record
+    return struct.pack('>II', len(record), zlib.crc32(body)) + body
+
+def st_append(log, records):
+    # Append the records to the log
+    for node, received, record in records:
+        log.append(record, node, received)
+    return
+
+def st_stop(log, partial=b''):
+    # Stop as the hub does when it loses power, with the records flushed, the partial bytes written
+    # after them and the segment left open
+    log.commit(force=True)
+    filename = log.filename
+    log.file.close()
+    log.file = None
+    with open(filename, mode='ab') as f:
+        f.write(partial)
+    return filename
+
+def st_read_all(directory):
+    # Return the records in all the complete segments, in order
+    records = []
+    for filename in segments(directory):
+        records.extend(read_segment(filename))
+    return records
+
+def st_recover(directory, partial):
+    # Records appended, the hub stopped with the partial bytes at the end of the open segment, then
+    # more records appended after it starts again
+    written = st_records(5)
+    later = st_records(3, 5)
+    log = SegmentLog(directory, commit_records=1)
+    st_append(log, written)
+    filename = st_stop(log, partial)
+    log = SegmentLog(directory, commit_records=1)
+    opened = [name for name in os.listdir(directory) if name.endswith(OPEN_EXT)]
+    completed = filename[:-len(OPEN_EXT)] + SEGMENT_EXT
+    size = os.path.getsize(completed) if os.path.exists(completed) else None
+    st_append(log, later)
+    log.close()
+    result = (st_read_all(directory), opened, size, len(segments(directory)))
+    expected = (written + later, [], sum(len(st_entry(*entry)) for entry in written), 2)
+    return result, expected
+
+def st_partial_header(directory):
+    # Only part of the header of the last record was written
+    return st_recover(directory, st_entry(*st_records(1, 10)[0])[:RECORD_HEADER.size - 3])
+
+def st_partial_record(directory):
+    # The header was written but only part of the record after it
+    return st_recover(directory, st_entry(*st_records(1, 10)[0])[:-5])
+
+def st_corrupt_record(directory):
+    # The whole record was written, but some of its bytes didn't reach the card
+    entry = bytearray(st_entry(*st_records(1, 10)[0]))
+    entry[-10:] = bytes(10)
+    return st_recover(directory, bytes(entry))
+
+def st_length_too_long(directory):
+    # The length of the last record was written, but is larger than the rest of the segment
+    return st_recover(directory, struct.pack('>II', 0x7fffffff, 0) + ST_NODE)
+
+def st_single_byte(directory):
+    # A single byte of the next record was written
+    return st_recover(directory, b'\x00')
+
+def st_nothing_partial(directory):
+    # The hub stopped between records, so nothing has to be removed
+    return st_recover(directory, b'')
+
+def st_empty_segment(directory):
+    # The hub stopped with a segment opened and nothing written to it
+    written = st_records(4)
+    log = SegmentLog(directory, commit_records=1)
+    st_append(log, written)
+    log.close()
+    log = SegmentLog(directory, commit_records=1)
+    log.append(b'', ST_NODE, ST_RECEIVED)
+    filename = log.filename
+    log.file.close()
+    log.file = None
+    os.truncate(filename, 0)
+    later = st_records(2, 4)
+    log = SegmentLog(directory, commit_records=1)
+    st_append(log, later)
+    log.close()
+    return (st_read_all(directory), len(segments(directory))), (written + later, 3)
+
+def st_recovered_twice(directory):
+    # The hub stopped part way through a record again straight after it recovered
+    written = st_records(3)
+    log = SegmentLog(directory, commit_records=1)
+    st_append(log, written)
+    st_stop(log, st_entry(*st_records(1, 10)[0])[:9])
+    log = SegmentLog(directory, commit_records=1)
+    more = st_records(2, 3)
+    st_append(log, more)
+    st_stop(log, st_entry(*st_records(1, 11)[0])[:30])
+    log = SegmentLog(directory, commit_records=1)
+    log.close()
+    return st_read_all(directory), written + more
+
+def st_main():
+    # The main program that calls all the necessary routines to test cls_RecordStore.py
+    scenarios = []
+    scenarios.append(["Part of a record header", st_partial_header])
+    scenarios.append(["Part of a record", st_partial_record])
+    scenarios.append(["Record with bytes lost", st_corrupt_record])
+    scenarios.append(["Record length past the end", st_length_too_long])
+    scenarios.append(["Single byte of a record", st_single_byte])
+    scenarios.append(["Stopped between records", st_nothing_partial])
+    scenarios.append(["Empty segment left open", st_empty_segment])
+    scenarios.append(["Stopped again after recovering", st_recovered_twice])
+
+    failed = 0
+    for test, scenario in scenarios:
+        directory = tempfile.mkdtemp(prefix='segment_test_')
+        try:
+            result, expected = scenario(directory)
+        except Exception as e:
+            logging.exception("[RST]: %s raised an exception" % test)
+            result, expected = e, None
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        if result == expected:
+            print(".", end="", flush=True)
+        else:
+            failed = failed + 1
+            print("\n%s Test FAILED!!!!!" % test)
+            print("Expected:>%s<" % (expected,))
+            print("     Result: %s" % (result,))
+    print("\nScenarios:%s, Failed:%s" % (len(scenarios), failed))
+    return failed
+
+
+
+# Only call the independent routine if the module is being called directly, else it is handled by the calling program
+if __name__ == "__main__":
+    logging.basicConfig(filename="RecordStore_Test.txt", filemode="w", level=logging.DEBUG,
+                        format='%(asctime)s:%(levelname)s:%(message)s')
+
+    if st_main() > 0:
+        sys.exit(1)
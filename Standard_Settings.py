@@ -1,20 +1,43 @@
 # Customer file locations
 OPFILE_NAME = "custfile.txt"
 OPFILE_LOCATION = "."
+NODE_REGISTRY_FILE = "nodes.txt"    # The nodes the hub accepts, in OPFILE_LOCATION
+HUB_WAL_FILE = "hub_wal.log"        # The records the hub has Acked but not yet stored, in OPFILE_LOCATION
 
 #Recordfile locations
 RECORDFILE_LOCATION = "/home/pi/Projects/pineapple/PiApplication/DataFiles"           # Where to store the records file, program automatically added '/' at the end
 RECORDFILE_NAME = "DATA_"            # The Base name part of the file
 RECORDFILE_EXT = ".rec"             # The extension for the record files
 RECORDFILE_OLD = ".oldrec"          # The extension used when the record can't be written and is stored for future analysis
+NODE_OUTBOX = False                 # The node sends the records appended to the outbox queue files in RECORDFILE_LOCATION rather than a file each
+OUTBOX_SEGMENT_SIZE = 1024 * 1024   # The bytes in each outbox queue file before the next one is started
 RECORD_TRY_COUNT = 10               # How many times, when connected the Data Accessor will try and send a record
 EEPROM_READ_RETRY = 5               # How many times it will try and read data from the EEPROM
 RECORDFILE_MIN_SIZE = 1             # The minimum value when len(record) in the recordfile, to cater for '[[]]' empty files
 RECORDFILE_MAX_SIZE = 255           # The maximum value when len(record) in the recordfile
+RECORD_STORE = "files"              # How the hub stores the records, "files" for a file each, "segments" for a segment log or "database"
+RECORD_DATABASE = "records.db"      # The SQLite database of the records when RECORD_STORE is "database", in RECORDFILE_LOCATION
+RECORD_RETENTION = 0                # How long, in seconds, the records are kept in the database, 0 to keep them all
+SEGMENT_SIZE = 4 * 1024 * 1024      # The bytes in each segment of the log before the next one is started
+SEGMENT_AGE = 3600                  # How long, in seconds, a segment is written to before the next one is started
+COMMIT_RECORDS = 64                 # Records appended to the segment log or database before they are flushed to the card, 0 for no limit
+COMMIT_MS = 1000                    # How long, in milliseconds, a record waits to be flushed to the card, 0 for no limit
 
 #Comms general values
 REPLY_WAIT = 5                      # How long to wait for a response
 RETRIES = 5                         # How many attempts to take to communicate
+LORA_FAST_START = False             # Start the LoRa module by waiting for its replies rather than fixed delays, not yet confirmed on a real module
+LORA_PIPELINED = False              # Request the received length and the data in one exchange with the LoRa module, not yet confirmed on a real module
+TRANSFER_WINDOW = 1                 # Packets a node sends before waiting for the hub to acknowledge them, 1 is stop-and-wait, more needs a hub that supports it
+AGGREGATE_LIMIT = 0                 # The payload bytes a node fills with records in each packet, 0 for a record per packet, more needs a hub that supports it
+AGGREGATE_READ = 6                  # Records read for each packet in the window, about as many as fit in AGGREGATE_LIMIT (17 if binary, 30 if compressed, 60 if delta)
+BINARY_RECORDS = False              # Send the records in the compact binary format, the hub must support it
+DELTA_RECORDS = False               # Send the records as the change from the one before, needs AGGREGATE_LIMIT set and a hub that supports it
+HUB_RECEIVE_QUEUE = 16              # Packets the hub holds between receiving and decoding them
+HUB_STORE_QUEUE = 64                # Packets of records the hub holds between Acking and storing them
+HUB_STATS_INTERVAL = 300            # How often, in seconds, the hub logs the latency of each of its stages
+HUB_CHECK_INTERVAL = 1              # How often, in seconds, the hub checks its stages are still running
+PAYLOAD_COMPRESSION = False         # Offer the hub compression of the payloads, used if the hub agrees at association
 
 
 def test():
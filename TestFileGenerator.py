@@ -11,6 +11,8 @@ import Standard_Settings as SS
 import json
 import random
 
+from cls_RecordOutbox import OutboxWriter
+
 def write_data_to_file(data_to_write):
     """
     Takes the given data and creates a new file with the contents of it
@@ -54,9 +56,17 @@ def generate_data():
 
 def main():
     """
-    Generate data and write it
+    Generate data and write it, to a file each or appended to the outbox if SS.NODE_OUTBOX is set
     """
+    outbox = None
+    if SS.NODE_OUTBOX:
+        outbox = OutboxWriter(SS.RECORDFILE_LOCATION, segment_size=SS.OUTBOX_SEGMENT_SIZE)
     while True:
+        if outbox is not None:
+            outbox.append(json.dumps(generate_data()))
+            time.sleep(random.randint(0,100) /10)
+            continue
+
         #Repeatably write a file
         status = False
         file_time = datetime.now().strftime("%y%m%d%H%M%S-%f")
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+'''
+A software LoRa module, so the hub and node programs can be run and benchmarked on any Linux box
+without a Pi, a LoRa module or a second Pi running NodeSimulator.
+
+Each VirtualLoRaModule speaks the AT dialect of the module over a pseudo terminal or a socket
+pair, and raises its VirtualDataPin when it has a packet to read. Modules sharing a VirtualAir
+receive each other's transmissions after the LoRa airtime of the packet.
+
+    Wake-up (empty line)    \\r\\nOK00>
+    AT!!, AT*v, AT*q        reset, version and configuration, followed by OK00
+    sloramode 1             sets the LoRa mode
+    AT+X nn                 \\r\\n$, then nn bytes of data followed by \\r\\n, then OK00
+    AT+r                    the length of the next packet received in 2 char hex, 00 if none
+    AT+A                    the next packet received followed by OK00, ER02 if there isn't one
+
+The time taken by the module is made up of
+    module_latency          the time the module takes to act on each command
+    baudrate                the time to send each reply over the UART, None for no delay
+    airtime                 the time a packet takes over the air, worked out from the length and
+                            spreading factor if None, or a fixed time in seconds
+
+Usage
+    air = VirtualAir()
+    hub_module = VirtualLoRaModule(air)
+    hub = LoRaComms(fast_start=True, transport=hub_module.transport(), data_pin=hub_module.data_pin)
+
+Run directly, it sends packets between 2 LoRaComms over virtual modules and reports the rate.
+
+For more info see www.CognIot.eu
+'''
+
+import logging
+import math
+import os
+import random
+import select
+import tempfile
+import threading
+import time
+import tty
+
+from LoRaTransport import PtyTransport, VirtualDataPin, memory_link, BAUDRATE
+
+# Replies from the module
+OK_REPLY = b'\r\nOK00>'
+DOLLAR_REPLY = b'\r\n$'
+NO_DATA_REPLY = b'\r\nER02>'
+UNKNOWN_REPLY = b'\r\nER01>'
+
+VERSION_TEXT = b'RN2483 Virtual LoRa Module 1.0'
+
+# The default time the module takes to act on a command
+MODULE_LATENCY = 0.001
+
+# The number of packets the module holds before it drops new ones
+RX_QUEUE_SIZE = 8
+
+# LoRa radio settings used for the airtime
+SPREADING_FACTOR = 7
+BANDWIDTH = 125000
+CODING_RATE = 1             # 4/5
+PREAMBLE = 8
+
+# How often the module thread checks if it has been stopped
+STOP_CHECK = 0.1
+
+
+def lora_airtime(length, sf=SPREADING_FACTOR, bandwidth=BANDWIDTH, coding_rate=CODING_RATE, preamble=PREAMBLE):
+    # Return the time in seconds for a packet of length bytes to be sent over the air
+    # From the Semtech SX1276 datasheet, with an explicit header and CRC
+    symbol_time = (1 << sf) / bandwidth
+    low_rate = 1 if symbol_time > 0.016 else 0
+    symbols = math.ceil((8 * length - 4 * sf + 28 + 16) / (4 * (sf - 2 * low_rate)))
+    payload_symbols = 8 + max(symbols * (coding_rate + 4), 0)
+    return (preamble + 4.25 + payload_symbols) * symbol_time
+
+
+class VirtualAir:
+    '''
+    The radio channel shared by the virtual modules
+    Each packet is passed to every other module after its airtime, unless it is lost
+    '''
+
+    def __init__(self, loss=0.0):
+        self.loss = loss                # The chance of each packet being lost, 0 to 1
+        self.modules = []
+        self.sent = 0
+        self.lost = 0
+        self._lock = threading.Lock()
+        return
+
+    def join(self, module):
+        with self._lock:
+            self.modules.append(module)
+        return
+
+    def leave(self, module):
+        with self._lock:
+            if module in self.modules:
+                self.modules.remove(module)
+        return
+
+    def transmit(self, sender, frame, airtime):
+        # Send the frame to the other modules, arriving after the airtime
+        with self._lock:
+            receivers = [module for module in self.modules if module is not sender]
+            self.sent = self.sent + 1
+        for module in receivers:
+            if self.loss > 0 and random.random() < self.loss:
+                with self._lock:
+                    self.lost = self.lost + 1
+                logging.debug("[VLM]: Packet to %s lost" % module.name)
+                continue
+            timer = threading.Timer(airtime, module.air_receive, [frame])
+            timer.daemon = True
+            timer.start()
+        return
+
+
+class VirtualLoRaModule:
+    '''
+    A LoRa module emulated in a thread
+
+    air             the VirtualAir it transmits and receives on, or None for a module on its own
+    link            'pty' for a pseudo terminal opened with pyserial, 'memory' for a socket pair
+    '''
+
+    def __init__(self, air=None, name='module', link='pty', module_latency=MODULE_LATENCY,
+                 baudrate=BAUDRATE, airtime=None, sf=SPREADING_FACTOR, rx_queue_size=RX_QUEUE_SIZE):
+        self.air = air
+        self.name = name
+        self.link = link
+        self.module_latency = module_latency
+        self.baudrate = baudrate
+        self.airtime = airtime
+        self.sf = sf
+        self.rx_queue_size = rx_queue_size
+        self.lora_mode = '0'
+        self.data_pin = VirtualDataPin()
+        self.rx_queue = []                  # Packets received over the air, waiting for AT+A
+        self.dropped = 0                    # Packets received when the queue was full
+        self.tx_done = 0                    # time.monotonic() when the current transmission ends
+        self._rx_lock = threading.Lock()
+        self._running = False
+
+        if link == 'pty':
+            self._fd, slave = os.openpty()
+            tty.setraw(slave)
+            self.device = os.ttyname(slave)
+            self._slave = slave             # Kept open so the terminal stays in raw mode
+            self._transport = PtyTransport(self.device)
+        else:
+            self._transport, self._sock = memory_link()
+            self._fd = self._sock.fileno()
+            self.device = "memory"
+        self._thread = threading.Thread(target=self._run, name="VirtualLoRa-%s" % name, daemon=True)
+        self.start()
+        return
+
+    def transport(self):
+        # Return the transport for LoRaComms to connect to this module
+        return self._transport
+
+    def start(self):
+        if self._running == False:
+            self._running = True
+            if self.air is not None:
+                self.air.join(self)
+            self._thread.start()
+        return
+
+    def stop(self):
+        # Stop the module thread and leave the air
+        self._running = False
+        if self.air is not None:
+            self.air.leave(self)
+        self._thread.join()
+        return
+
+    def air_receive(self, frame):
+        # Called by VirtualAir when a packet arrives, raises the data pin
+        with self._rx_lock:
+            if len(self.rx_queue) >= self.rx_queue_size:
+                self.dropped = self.dropped + 1
+                logging.debug("[VLM]: %s receive queue full, packet dropped" % self.name)
+                return
+            self.rx_queue.append(frame)
+        self.data_pin.set(1)
+        return
+
+    def packet_airtime(self, length):
+        # Return the airtime for a packet of the given length
+        if self.airtime is None:
+            return lora_airtime(length, sf=self.sf)
+        return self.airtime
+
+#=======================================================================
+#
+#    P R I V A T E   F U N C T I O N S
+#
+#    Not to be Called Directly from outside class
+#
+#=======================================================================
+
+    def _run(self):
+        # Read the commands sent by LoRaComms and reply to them
+        buffer = bytearray()
+        expected = None                 # The length of data expected after the $ prompt
+        while self._running:
+            ready, _, _ = select.select([self._fd], [], [], STOP_CHECK)
+            if len(ready) == 0:
+                continue
+            try:
+                data = os.read(self._fd, 4096)
+            except OSError:
+                break
+            if len(data) == 0:
+                break
+            buffer += data
+            woken = False
+            while True:
+                if expected is not None:
+                    # Waiting for the data to send, followed by \r\n
+                    if len(buffer) < expected + 2:
+                        break
+                    frame = bytes(buffer[:expected])
+                    del buffer[:expected + 2]
+                    expected = None
+                    self._send_packet(frame)
+                    continue
+                end = buffer.find(b'\n')
+                if end < 0:
+                    break
+                line = bytes(buffer[:end]).strip(b'\r')
+                del buffer[:end + 1]
+                if len(line) == 0:
+                    # Wake-up, only answered once for each write however many are sent
+                    if woken == False:
+                        self._reply(OK_REPLY)
+                        woken = True
+                    continue
+                expected = self._command(line)
+        return
+
+    def _command(self, line):
+        # Act on the command, returns the length of data expected if it was AT+X, else None
+        logging.debug("[VLM]: %s command:%s" % (self.name, line))
+        if line.startswith(b'AT+X'):
+            try:
+                length = int(line[4:].strip(), 16)
+            except ValueError:
+                self._reply(UNKNOWN_REPLY)
+                return None
+            # The module can't start a new transmission until the last one has finished
+            wait = self.tx_done - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._reply(DOLLAR_REPLY)
+            return length
+        elif line == b'AT+r':
+            with self._rx_lock:
+                length = len(self.rx_queue[0]) if len(self.rx_queue) > 0 else 0
+            self._reply(format(length, '02X').encode('utf-8') + OK_REPLY)
+        elif line == b'AT+A':
+            with self._rx_lock:
+                frame = self.rx_queue.pop(0) if len(self.rx_queue) > 0 else None
+                empty = len(self.rx_queue) == 0
+            if empty:
+                self.data_pin.set(0)
+            if frame is None:
+                self._reply(NO_DATA_REPLY)
+            else:
+                self._reply(frame + OK_REPLY)
+        elif line == b'AT!!':
+            self.lora_mode = '0'
+            self._reply(OK_REPLY)
+        elif line == b'AT*v':
+            self._reply(VERSION_TEXT + OK_REPLY)
+        elif line == b'AT*q':
+            settings = "lora mode: %s\r\nsf: %s\r\nbw: %s" % (self.lora_mode, self.sf, BANDWIDTH)
+            self._reply(settings.encode('utf-8') + OK_REPLY)
+        elif line.startswith(b'sloramode'):
+            self.lora_mode = line[9:].strip().decode('utf-8', errors='replace')
+            self._reply(OK_REPLY)
+        else:
+            self._reply(UNKNOWN_REPLY)
+        return None
+
+    def _send_packet(self, frame):
+        # Reply to the data and put it on the air
+        airtime = self.packet_airtime(len(frame))
+        self.tx_done = time.monotonic() + self.module_latency + airtime
+        self._reply(OK_REPLY)
+        if self.air is not None:
+            self.air.transmit(self, frame, airtime)
+        return
+
+    def _reply(self, data):
+        # Send the reply after the module latency and the time the UART takes to send it
+        delay = self.module_latency
+        if self.baudrate is not None:
+            delay = delay + len(data) * 10 / self.baudrate
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            os.write(self._fd, data)
+        except OSError:
+            logging.warning("[VLM]: %s unable to send the reply" % self.name)
+        return
+
+
+def main():
+    # Send packets from a node to a hub over virtual modules and report the rate
+    from LoRaCommsReceiverV2 import LoRaComms
+
+    packets = 20
+    message = b'x' * 60
+    air = VirtualAir()
+    hub_module = VirtualLoRaModule(air, name='hub')
+    node_module = VirtualLoRaModule(air, name='node')
+    with tempfile.TemporaryDirectory() as configdir:
+        hub = LoRaComms(fast_start=True, pipelined=True, config_file=os.path.join(configdir, 'hub.json'),
+                        transport=hub_module.transport(), data_pin=hub_module.data_pin)
+        node = LoRaComms(fast_start=True, config_file=os.path.join(configdir, 'node.json'),
+                         transport=node_module.transport(), data_pin=node_module.data_pin)
+        print("Startup %s" % node.startup_timing)
+
+        received = 0
+        starttime = time.monotonic()
+        for count in range(0, packets):
+            node.transmit(message)
+            if bytes(hub.receivetimeout(2)) == message:
+                received = received + 1
+        period = time.monotonic() - starttime
+        print("%s of %s packets of %s bytes received in %0.2fs, %0.1f packets/s (airtime %0.1fms each)" %
+              (received, packets, len(message), period, received / period, lora_airtime(len(message)) * 1000))
+        print("Hub stats %s" % {command: hub.stats_snapshot()[command]['mean_us'] for command in ('AT+r', 'AT+A', 'gpio_wait')})
+        hub.exit_comms()
+        node.exit_comms()
+    hub_module.stop()
+    node_module.stop()
+    return
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Bostin Technology  (see www.CognIoT.eu)
+
+Encoding and decoding of the packets in the
+
+    CognIoT RF Specification V1.0
+
+shared by cls_CognIoTRF (Hub, SubHub and Node), HubDataDecoderV2 and Hub_Test
+
+    Bytes  - Meaning
+    ====== - =======
+    0 - 3  - Destination
+    4      - Destination Control
+    5 - 8  - Source
+    9      - Source Control
+    10     - Command Byte
+    11     - Payload Length
+    12 - n - Payload
+
+The source control byte of a data packet carries its sequence number, 1 to 255 and then back to 1,
+which the hub echoes in the destination control byte of the ACK. A sequence number of 0 is a node
+that doesn't number its packets.
+
+The payload of the Association Request is the window wanted, the mask of the payload codecs offered
+and the flags of what else the node wants, FLAG_SEQUENCES if it numbers its data packets. The hub
+replies with those it agrees, in the same order. A hub that doesn't support them replies without a
+payload, and the node then sends its data packets with a source control byte of 0, as such a hub
+rejects any other.
+
+In the windowed transfer mode, agreed at association, the destination control byte of a data packet
+from the node carries FLAG_ACK_REQUEST on the last packet of each window. The hub only replies to
+that packet, with a selective ACK whose payload lists the sequence numbers it has received.
+
+If the node and hub agreed payload compression at association, see cls_PayloadCodec, the
+destination control byte of a data or aggregate packet also carries the codec of its payload in the
+CODEC_MASK bits.
+
+An aggregate packet carries several records in one payload, each preceded by its length byte
+
+    Bytes  - Meaning
+    ====== - =======
+    12     - Length of record 1
+    13 - n - Record 1
+    n + 1  - Length of record 2 ...
+
+A message too long for one packet is split into fragment packets, each numbered like a data packet
+and carrying one part of the message after a fragment header
+
+    Bytes  - Meaning
+    ====== - =======
+    12     - Message number, the same in every fragment of the message
+    13     - Fragment number, 0 to count - 1
+    14     - Fragment count
+    15 - n - Part of the message
+
+The header is packed and unpacked with a precompiled struct, and decode() splits a packet into a
+Frame in a single pass. Packets between a pair of addresses are built by the PacketCodec for the
+pair, which keeps the header for each command ready made, and the replies the hub sends to a node
+are built once in its ResponseTable.
+"""
+
+import struct
+
+# The header, destination address, control, source address, control, command and payload length
+HEADER = struct.Struct('>4sB4sBBB')
+HEADER_LEN = HEADER.size
+
+# Command bytes that are used by protocol
+CMD_ASSOCIATION_REQUEST = 0x30
+CMD_ASSOCIATION_RESPONSE = 0x31
+CMD_PING = 0x32
+CMD_DATA_PACKET = 0x37
+CMD_AGGREGATE_PACKET = 0x38
+CMD_FRAGMENT_PACKET = 0x39
+
+# Response codes
+CMD_ACK = 0x22                  # all good and confirmed
+CMD_NACK = 0x99                 # General NACK response
+
+# Hubs before this codec sent the NACK as chr(0x99).encode('utf-8'), which put the 2 bytes 0xc2 0x99
+# where the command byte goes, so it decodes as this command with a payload length of CMD_NACK.
+# It is still accepted as a NACK, see is_nack(), for one release while those hubs are replaced
+CMD_LEGACY_NACK = 0xc2
+
+# The control byte when there is nothing in it
+CONTROL = 0x00
+
+# The sequence number of a packet that isn't numbered, and the highest sequence number
+NO_SEQUENCE = 0x00
+MAX_SEQUENCE = 0xff
+
+# The flag in the destination control byte of a data packet asking the hub for a selective ACK
+FLAG_ACK_REQUEST = 0x01
+
+# The flags in the third byte of the Association Request and Response payloads, those the node wants
+# and those the hub agrees
+FLAG_SEQUENCES = 0x01           # The data packets are numbered in the source control byte
+SUPPORTED_FLAGS = FLAG_SEQUENCES
+
+# The bits of the destination control byte of a data packet holding the codec of its payload
+CODEC_MASK = 0x0e
+CODEC_SHIFT = 1
+
+# The maximum payload length that fits in the length byte
+MAX_PAYLOAD_LEN = 255
+
+# The largest payload that fits in a LoRa packet of 255 bytes with the header
+MAX_LORA_PAYLOAD = 255 - HEADER_LEN
+
+# The fragment header, the message number, fragment number and fragment count
+FRAGMENT_HEADER = struct.Struct('>BBB')
+FRAGMENT_HEADER_LEN = FRAGMENT_HEADER.size
+
+# The most fragments in a message, and the longest message that can be sent in fragments
+MAX_FRAGMENTS = 255
+MAX_MESSAGE_LEN = 16384
+
+# A single byte object for each value, so the length byte isn't created for each packet
+_BYTE = tuple(bytes((value,)) for value in range(256))
+
+# The PacketCodec for each pair of addresses, see packet_codec()
+_codecs = {}
+
+
+class Frame:
+    """
+    A decoded packet, the payload is a slice of the packet, so a memoryview if the packet was one
+    """
+    __slots__ = ('dest', 'dest_control', 'src', 'src_control', 'command', 'payload_len', 'payload')
+
+    def __init__(self, dest, dest_control, src, src_control, command, payload_len, payload):
+        self.dest = dest                    # The destination address, as bytes
+        self.dest_control = dest_control    # The control bytes and command are ints
+        self.src = src
+        self.src_control = src_control
+        self.command = command
+        self.payload_len = payload_len      # The payload length byte, which may not match the payload
+        self.payload = payload
+        return
+
+    def __repr__(self):
+        return "Frame(dest=%s, src=%s, command=0x%02x, payload_len=%s, payload=%s)" % (
+            self.dest, self.src, self.command, self.payload_len, bytes(self.payload))
+
+
+class PacketCodec:
+    """
+    Builds the packets sent from the src address to the dest address, both 4 bytes
+    Use packet_codec() to get the one for a pair of addresses rather than creating it directly
+    """
+
+    def __init__(self, src, dest):
+        self.src = src
+        self.dest = dest
+        self._headers = {}          # The header up to the payload length for each command
+        return
+
+    def encode(self, command, payload=b'', dest_control=CONTROL, src_control=CONTROL):
+        # Return the packet for the command with the given payload
+        if dest_control == CONTROL and src_control == CONTROL:
+            header = self._headers.get(command)
+            if header is None:
+                header = HEADER.pack(self.dest, CONTROL, self.src, CONTROL, command, 0)[:-1]
+                self._headers[command] = header
+            return header + _BYTE[len(payload)] + payload
+        return HEADER.pack(self.dest, dest_control, self.src, src_control, command, len(payload)) + payload
+
+
+class ResponseTable:
+    """
+    The replies from the hub to a node that don't change, built once for each node
+    The codec isn't kept in the packet_codec() cache, as a hub can have thousands of nodes
+    """
+    __slots__ = ('hub', 'node', 'ack', 'nack', 'association_response')
+
+    def __init__(self, hub, node):
+        codec = PacketCodec(hub, node)
+        self.hub = hub
+        self.node = node
+        self.ack = codec.encode(CMD_ACK)
+        self.nack = codec.encode(CMD_NACK)
+        self.association_response = codec.encode(CMD_ASSOCIATION_RESPONSE)
+        return
+
+    def sequence_ack(self, sequence):
+        # The ACK for a numbered data packet, echoing its sequence number
+        if sequence == NO_SEQUENCE:
+            return self.ack
+        return HEADER.pack(self.node, sequence, self.hub, CONTROL, CMD_ACK, 0)
+
+    def selective_ack(self, sequence, received):
+        # The selective ACK for the data packet asking for it, received is the sequence numbers held
+        return HEADER.pack(self.node, sequence, self.hub, CONTROL, CMD_ACK, len(received)) + received
+
+    def window_association_response(self, window, codecs=0, flags=None):
+        # The Association Response agreeing the window size for the windowed transfer mode, the
+        # mask of the payload codecs if any were agreed, and the flags agreed if the node sent any
+        if flags is not None:
+            return (HEADER.pack(self.node, CONTROL, self.hub, CONTROL, CMD_ASSOCIATION_RESPONSE, 3) +
+                    _BYTE[window] + _BYTE[codecs] + _BYTE[flags])
+        if codecs != 0:
+            return (HEADER.pack(self.node, CONTROL, self.hub, CONTROL, CMD_ASSOCIATION_RESPONSE, 2) +
+                    _BYTE[window] + _BYTE[codecs])
+        if window <= 1:
+            return self.association_response
+        return HEADER.pack(self.node, CONTROL, self.hub, CONTROL, CMD_ASSOCIATION_RESPONSE, 1) + _BYTE[window]
+
+
+def packet_codec(src, dest):
+    # Return the PacketCodec for packets from src to dest, creating it the first time
+    codec = _codecs.get((src, dest))
+    if codec is None:
+        codec = PacketCodec(src, dest)
+        _codecs[(src, dest)] = codec
+    return codec
+
+def is_nack(command, payload_len):
+    # Return True if the command is a NACK, the single byte CMD_NACK or the 2 byte form of older hubs
+    return command == CMD_NACK or (command == CMD_LEGACY_NACK and payload_len == CMD_NACK)
+
+def next_sequence(sequence):
+    # Return the sequence number after the given one, skipping NO_SEQUENCE when it wraps
+    return sequence % MAX_SEQUENCE + 1
+
+def pack_records(records, limit=MAX_LORA_PAYLOAD):
+    # Pack as many of the records, in order, as fit in a payload of up to limit bytes
+    # Returns the payload and the number of records in it, 0 if the first record doesn't fit
+    parts = []
+    size = 0
+    for record in records:
+        length = len(record)
+        if length > MAX_PAYLOAD_LEN or size + length + 1 > limit:
+            break
+        parts.append(_BYTE[length])
+        parts.append(record)
+        size = size + length + 1
+    return b''.join(parts), len(parts) // 2
+
+def split_fragments(message, data, size):
+    # Split the data into the payloads of the fragments of message number message, each of up to
+    # size bytes including the fragment header
+    # Returns an empty list if it needs more than MAX_FRAGMENTS fragments
+    part = size - FRAGMENT_HEADER_LEN
+    if part <= 0:
+        return []
+    count = max(1, (len(data) + part - 1) // part)
+    if count > MAX_FRAGMENTS:
+        return []
+    return [FRAGMENT_HEADER.pack(message, index, count) + data[index * part:(index + 1) * part]
+            for index in range(0, count)]
+
+def unpack_records(payload):
+    # Split the payload of an aggregate packet into its records, slices of the payload
+    # Returns None if the lengths don't match the payload
+    records = []
+    position = 0
+    end = len(payload)
+    while position < end:
+        length = payload[position]
+        position = position + 1
+        if position + length > end:
+            return None
+        records.append(payload[position:position + length])
+        position = position + length
+    return records
+
+def decode(packet):
+    # Split the packet into a Frame, or return None if it is shorter than the header
+    # The packet can be bytes or a memoryview, the addresses are always returned as bytes
+    if len(packet) < HEADER_LEN:
+        return None
+    dest, dest_control, src, src_control, command, payload_len = HEADER.unpack_from(packet)
+    return Frame(dest, dest_control, src, src_control, command, payload_len, packet[HEADER_LEN:])
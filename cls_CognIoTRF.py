@@ -6,16 +6,32 @@ A collection of classes that provide the necessary functions to support
 
     CognIoT RF Specification V1.0
 
-File consists of 3 classes
+File consists of 6 classes
 - Common        - Contains all the common functions to be used, not called separately
                     Called by the 2 classes below
+- SubHub        - The state of a single node connected to the hub
+- Reassembly    - The fragments of the messages a node is part way through sending
+- NodeTable     - The SubHub for every node, looked up by the node address
 - Hub           - Handles the incoming message and generates the necessary responses
 - Node          - provides teh functions to run as a node
 
 """
 
 import logging
+import sys
 import time
+import zlib
+
+from cls_CognIoTCodec import (decode, packet_codec, next_sequence, split_fragments, pack_records, unpack_records,
+                              is_nack, ResponseTable, CONTROL, NO_SEQUENCE, FLAG_ACK_REQUEST, FLAG_SEQUENCES,
+                              SUPPORTED_FLAGS, CODEC_MASK, CODEC_SHIFT,
+                              FRAGMENT_HEADER, FRAGMENT_HEADER_LEN, MAX_LORA_PAYLOAD, MAX_MESSAGE_LEN,
+                              MAX_FRAGMENTS, MAX_SEQUENCE, CMD_ASSOCIATION_REQUEST, CMD_ASSOCIATION_RESPONSE,
+                              CMD_DATA_PACKET, CMD_AGGREGATE_PACKET, CMD_FRAGMENT_PACKET, CMD_PING, CMD_ACK,
+                              CMD_NACK)
+from cls_RecordCodec import encode_record, decode_record, is_binary_record, DeltaEncoder, decode_delta_block, is_delta_block
+from cls_PayloadCodec import (CodecStats, agree_codecs, compress, decompress, CODEC_NONE, SUPPORTED_CODECS,
+                              MAX_DECOMPRESSED_LEN)
 
 # Pointers to the position of the parts of the packet
 START_DEST_ADDR = 0         # Position in packet where hub address starts
@@ -30,15 +46,15 @@ PAYLOAD = 12                # Position in packet where the payload starts
 #TODO: Change all these to all capitals with underscores
 
 # Constants that will not change in program
-# Command bytes that are used by protocol
-ASSOCIATIONREQUEST = chr(0x30).encode('utf-8')
-ASSOCIATIONRESPONSE = chr(0x31).encode('utf-8')
-DATAPACKET = chr(0x37).encode('utf-8')
-PING = chr(0x32).encode('utf-8')
+# Command bytes that are used by protocol, the packets are built and decoded by cls_CognIoTCodec
+ASSOCIATIONREQUEST = bytes((CMD_ASSOCIATION_REQUEST,))
+ASSOCIATIONRESPONSE = bytes((CMD_ASSOCIATION_RESPONSE,))
+DATAPACKET = bytes((CMD_DATA_PACKET,))
+PING = bytes((CMD_PING,))
 
 # Response codes
-ACK = chr(0x22).encode('utf-8')                 # all good and confirmed
-NACK = chr(0x99).encode('utf-8')                # General NACK response
+ACK = bytes((CMD_ACK,))                 # all good and confirmed
+NACK = bytes((CMD_NACK,))               # General NACK response
 
 
 # initialise global variables for data packet. Defined here so that they are global
@@ -52,6 +68,21 @@ MIN_LENGTH = 12
 # The maximum payload length to be handled
 MAX_PAYLOAD_LEN = 255
 
+# The number of recent sequence numbers the hub remembers for each node to spot retransmissions
+SEQUENCE_WINDOW = 16
+
+# The largest window the hub agrees to in the windowed transfer mode. Kept to half the sequence
+# window, so the retransmissions of one window are still spotted while the next is being sent
+MAX_WINDOW = SEQUENCE_WINDOW // 2
+
+# How long, in seconds, the hub keeps the fragments of a message that isn't complete. It must be
+# longer than a node keeps retrying before it associates again, as the node then starts the message
+# again, but if the fragments are dropped while the node is still sending them the message is lost
+REASSEMBLY_TIMEOUT = 300
+
+# How often, in seconds, the hub checks for messages that have timed out
+REASSEMBLY_CHECK = 10
+
 #TODO: Convert 'utf-8' to a fixed variable
 
 class Common:
@@ -71,138 +102,349 @@ class SubHub:
     """
     Provides the individual functionality for each node connected to the hub
 
-    Not called directly, but from Hub
+    Not called directly, but from Hub through its NodeTable
+    Uses __slots__ and keeps only what is needed between packets, so the memory for each node is
+    small and the same for every node
+
+    Data packets with a sequence number are checked against the last SEQUENCE_WINDOW sequence
+    numbers received, a retransmission is ACKed again but not passed on as new data. Packets without
+    a sequence number, from older nodes, are checked against the CRC of the last data packet.
+
+    If the node asked for a window at association, it sends several data packets in turn and only
+    the last one, flagged with FLAG_ACK_REQUEST, is answered with a selective ACK. The node also asks
+    for FLAG_SEQUENCES at association before it numbers its packets, which is always agreed.
+
+    The payload codecs are agreed at association but not kept, the codec of each packet is in its
+    destination control byte.
+
+    The fragments of a long message are numbered data packets, Acked as they arrive and held in
+    reassembly, which is only created while the node is part way through sending a message.
     """
+    __slots__ = ('node', 'hub', 'associated', 'responses', 'last_incoming_crc', 'last_incoming_len',
+                 'recent_sequences', 'sequence_pos', 'window', 'reassembly')
+
+    log = logging.getLogger()       # Shared by all the nodes rather than a reference in each one
 
     def __init__(self, node, hub):
-        self.log = logging.getLogger()
-        self.log.info("[HDD] cls_CognIoT SubHub initialised")
         self.node = node            # Already been encoded by the Hub class
         self.hub = hub
         self.associated = False
-        self.response = b''
-        self.response_status = False
-        self.last_incoming_message = b''
-        self.log.info("[HDD]: SubHub class instantiated with node:%s, hub:%s" % (self.node, self.hub))
+        self.responses = ResponseTable(hub, node)   # The ACK, NACK and association response, built once
+        self.last_incoming_crc = 0          # The CRC and length of the last data packet, to spot duplicates
+        self.last_incoming_len = -1
+        self.recent_sequences = bytearray(SEQUENCE_WINDOW)  # The sequence numbers received, 0 is unused
+        self.sequence_pos = 0               # Where the next sequence number is put in recent_sequences
+        self.window = 1                     # The window agreed at association, 1 is stop-and-wait
+        self.reassembly = None              # The Reassembly of the messages being received in fragments
+        self.log.debug("[HDD]: SubHub class instantiated with node:%s, hub:%s" % (self.node, self.hub))
 
         return
 
-    def message_response(self, command, message):
+    def message_response(self, command, message, sequence=NO_SEQUENCE, flags=CONTROL):
         """
         Taking the given message, determine the response
+        The command is the command byte value, e.g. CMD_PING, the sequence is the source control byte
+        and the flags the destination control byte
+        Returns the response, its status, True if it is to be sent, and True if the message is new data
         """
-        self.command = command
+        response = b''
+        response_status = False
+        new_data = False
         if self.associated:
             # Possible commands are data packet and ping (if associated)
             self.log.info("[HDD]: HUB <==> NODE are associated")
-            if self.command == PING:
+            if command == CMD_PING:
                 # Send the Ping response
                 self.log.info("[HDD]: Ping Command Received")
 
                 #TODO: Need to include the ability to send data back in the ping response
-                self.response = self._generate_ack()
-                self.response_status = True
-            elif self.command == DATAPACKET:
+                response = self._generate_ack()
+                response_status = True
+            elif command == CMD_DATA_PACKET or command == CMD_AGGREGATE_PACKET or command == CMD_FRAGMENT_PACKET:
                 # Send an Acknowledge
                 self.log.info("[HDD]: Data Packet Command Received")
-                if message == self.last_incoming_message:
-                    self.log.info("[HDD]: Duplicate Data Packet Received")
+                if sequence != NO_SEQUENCE:
+                    if sequence in self.recent_sequences:
+                        self.log.info("[HDD]: Duplicate Data Packet Received, sequence:%s" % sequence)
+                    else:
+                        self.recent_sequences[self.sequence_pos] = sequence
+                        self.sequence_pos = (self.sequence_pos + 1) % SEQUENCE_WINDOW
+                        new_data = True
+                    # Always ACKed, so a node that missed the last ACK stops retransmitting
+                    if flags & FLAG_ACK_REQUEST:
+                        response = self._generate_selective_ack(sequence)
+                        response_status = True
+                    elif self.window == 1:
+                        response = self._generate_ack(sequence)
+                        response_status = True
                 else:
-                    self.last_incoming_message = message
-                    self.response = self._generate_ack()
-                    self.response_status = True
-            elif self.command == ASSOCIATIONREQUEST:
+                    # The message can be a view onto the receive buffer, so it is not kept, only its CRC
+                    crc = zlib.crc32(message)
+                    if crc == self.last_incoming_crc and len(message) == self.last_incoming_len:
+                        self.log.info("[HDD]: Duplicate Data Packet Received")
+                    else:
+                        self.last_incoming_crc = crc
+                        self.last_incoming_len = len(message)
+                        response = self._generate_ack()
+                        response_status = True
+                        new_data = True
+            elif command == CMD_ASSOCIATION_REQUEST:
                 # send Association Response again
+                # The node may have restarted its sequence numbers
                 self.log.info("[HDD]: Association Request Command Received")
-                self.response = self._association_response()
-                self.response_status = True
+                self._clear_sequences()
+                response = self._association_response(message)
+                response_status = True
             else:
                 self.log.info("[HDD]: Unknown Command Received")
-                self.response = self._generate_nack()
-                self.response_status = True
+                response = self._generate_nack()
+                response_status = True
         else:
             # Possible commands are association request
             self.log.info("[HDD]: HUB & NODE are NOT associated")
-            if self.command == ASSOCIATIONREQUEST:
+            if command == CMD_ASSOCIATION_REQUEST:
                 # send Association Response
                 self.log.info("[HDD]: Association Request Command Received")
-                self.response = self._association_response()
-                self.response_status = True
+                self._clear_sequences()
+                response = self._association_response(message)
+                response_status = True
                 # TODO: Need to do further checks before associated = True? maybe.
                 self.associated = True
-        return (self.response, self.response_status)
+        return (response, response_status, new_data)
 
-        
-    def _association_response(self):
-        # Create a generic generates an Ack for response to a number of messages
-        packet_to_send = b''
-        packet_to_send = packet_to_send + self.node + CONTROL_BYTE    # Receiver address & Control byte
-        packet_to_send = packet_to_send + self.hub + CONTROL_BYTE      # Sender address & Control byte
-        packet_to_send = packet_to_send + ASSOCIATIONRESPONSE                   # Association Response
-        packet_to_send = packet_to_send + ZeroPayload                           # add zero payload length
+    def memory(self):
+        # The bytes used by this node, including its responses but not the shared addresses
+        responses = self.responses
+        return (sys.getsizeof(self) + sys.getsizeof(responses) + sys.getsizeof(responses.ack) +
+                sys.getsizeof(responses.nack) + sys.getsizeof(responses.association_response) +
+                sys.getsizeof(self.last_incoming_crc) + sys.getsizeof(self.recent_sequences))
 
-        self.log.info("SEND: Association Response")
-        return packet_to_send
-    
-    def _generate_ack(self):
-        # Create a generic generates an Ack for response to a number of messages
-        packet_to_send = b''
-        packet_to_send = packet_to_send + self.node + CONTROL_BYTE    # Receiver address & Control byte
-        packet_to_send = packet_to_send + self.hub + CONTROL_BYTE      # Sender address & Control byte
-        packet_to_send = packet_to_send + ACK                                   # Acknowledge
-        packet_to_send = packet_to_send + ZeroPayload                           # add zero payload length
+    def _clear_sequences(self):
+        # Forget the sequence numbers received, and the fragments of any message being received
+        # as the node starts them again
+        self.recent_sequences[:] = bytes(SEQUENCE_WINDOW)
+        self.sequence_pos = 0
+        self.reassembly = None
+        return
 
+    def _association_response(self, message):
+        # The Association Response, agreeing the window, the payload codecs and the flags if the node
+        # asked for them in the payload, the window in the first byte, the mask of the codecs in the
+        # second and the flags in the third
+        # The message has already been validated
+        self.window = 1
+        codecs = 0
+        flags = None
+        if len(message) > MIN_LENGTH:
+            self.window = max(1, min(message[MIN_LENGTH], MAX_WINDOW))
+        if len(message) > MIN_LENGTH + 1:
+            codecs = agree_codecs(message[MIN_LENGTH + 1])
+        if len(message) > MIN_LENGTH + 2:
+            flags = message[MIN_LENGTH + 2] & SUPPORTED_FLAGS
+        self.log.info("SEND: Association Response, window:%s, codecs:0x%02x, flags:%s" % (self.window, codecs, flags))
+        return self.responses.window_association_response(self.window, codecs, flags)
+
+    def _generate_ack(self, sequence=NO_SEQUENCE):
+        # Create a generic generates an Ack for response to a number of messages
+        # A numbered data packet has its sequence number echoed in the Ack
         self.log.info("SEND: Acknowledge")
-        return packet_to_send
-    
+        return self.responses.sequence_ack(sequence)
+
+    def _generate_selective_ack(self, sequence):
+        # The Ack for the packet that asked for it, listing all the sequence numbers held
+        received = bytes(self.recent_sequences).replace(b'\x00', b'')
+        self.log.info("SEND: Selective Acknowledge, received:%s" % list(received))
+        return self.responses.selective_ack(sequence, received)
+
     def _generate_nack(self):
         # Create a generic Nack for response to a number of messages
         # No additional decoding of Nack is completed.
-        packet_to_send = b''
-        packet_to_send = packet_to_send + self.node + CONTROL_BYTE    # Receiver address & Control byte
-        packet_to_send = packet_to_send + self.hub + CONTROL_BYTE      # Sender address & Control byte
-        packet_to_send = packet_to_send + NACK                                  # Acknowledge
-        packet_to_send = packet_to_send + ZeroPayload                           # add zero payload length
-
         self.log.info("SEND: Negative Response")
-        return packet_to_send
+        return self.responses.nack
+
+
+class Reassembly:
+    """
+    The fragments of the messages a node is part way through sending, created by the Hub for the
+    node's SubHub when the first fragment arrives and dropped when there are none left
+
+    The fragments held are limited to MAX_MESSAGE_LEN bytes, the oldest message being dropped to
+    make room, so a node can't use up the memory of the hub.
+
+    add(message, index, count, data, now, stats)    adds the fragment, returns the whole message
+                                                    when it is the last one needed
+    expire(before, stats)                           drops the messages started before the time
+    """
+    __slots__ = ('messages', 'held')
 
+    log = logging.getLogger()
+
+    def __init__(self):
+        self.messages = {}          # For each message number, [started, count, received, fragments], oldest first
+        self.held = 0               # The bytes in all the fragments held
+        return
+
+    def add(self, message, index, count, data, now, stats):
+        # Add the fragment of the message, data being bytes, stats the Hub's fragment_stats
+        # Returns the whole message when this fragment completes it, else None
+        entry = self.messages.get(message)
+        if entry is not None and entry[1] != count:
+            # The message number has been reused for a new message
+            self._drop(message)
+            entry = None
+        if entry is None:
+            entry = [now, count, 0, [None] * count]
+            self.messages[message] = entry
+        if entry[3][index] is None:
+            entry[3][index] = data
+            entry[2] = entry[2] + 1
+            self.held = self.held + len(data)
+            stats['max_held_bytes'] = max(stats['max_held_bytes'], self.held)
+        if entry[2] == count:
+            self._drop(message)
+            completion = now - entry[0]
+            stats['completed'] += 1
+            stats['completion_s'] += completion
+            stats['max_completion_s'] = max(stats['max_completion_s'], completion)
+            return b''.join(entry[3])
+        while self.held > MAX_MESSAGE_LEN:
+            oldest = next(iter(self.messages))
+            self.log.info("[HDD]: Reassembly full, message %s dropped" % oldest)
+            self._drop(oldest)
+            stats['dropped'] += 1
+        return None
+
+    def expire(self, before, stats):
+        # Drop the messages started before the given time, returns the number dropped
+        expired = [message for message, entry in self.messages.items() if entry[0] < before]
+        for message in expired:
+            self.log.info("[HDD]: Reassembly timed out, message %s dropped" % message)
+            self._drop(message)
+        stats['expired'] += len(expired)
+        return len(expired)
+
+    def memory(self):
+        # The bytes used by the fragments held and the lists holding them
+        total = sys.getsizeof(self) + sys.getsizeof(self.messages)
+        for entry in self.messages.values():
+            total = total + sys.getsizeof(entry) + sys.getsizeof(entry[3])
+            for fragment in entry[3]:
+                if fragment is not None:
+                    total = total + sys.getsizeof(fragment)
+        return total
+
+    def _drop(self, message):
+        # Forget the message and the fragments held for it
+        entry = self.messages.pop(message)
+        self.held = self.held - sum(len(fragment) for fragment in entry[3] if fragment is not None)
+        return
+
+
+class NodeTable:
+    """
+    The state of every node the hub serves, looked up by the 4 byte node address
+
+    The SubHub for each node is created when it is added, rather than on its first packet, so
+    the memory for the table is known up front and doesn't grow as the nodes start talking
+    """
+    __slots__ = ('hub', '_nodes')
+
+    def __init__(self, hub, nodes=()):
+        self.hub = hub              # The hub address, shared by all the SubHubs
+        self._nodes = {}
+        for node in nodes:
+            self.add(node)
+        return
+
+    def add(self, node):
+        # Add the node, given as bytes, returning its SubHub, the existing one if already added
+        subhub = self._nodes.get(node)
+        if subhub is None:
+            subhub = SubHub(node, self.hub)
+            self._nodes[node] = subhub
+        return subhub
+
+    def remove(self, node):
+        # Remove the node, returns False if it wasn't in the table
+        return self._nodes.pop(node, None) is not None
+
+    def get(self, node):
+        # Return the SubHub for the node, or None if it isn't in the table
+        return self._nodes.get(node)
+
+    def memory(self):
+        # The bytes used by the table, the index and every node with its address
+        total = sys.getsizeof(self) + sys.getsizeof(self._nodes)
+        for node, subhub in self._nodes.items():
+            total = total + sys.getsizeof(node) + subhub.memory()
+        return total
+
+    def __contains__(self, node):
+        return node in self._nodes
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __iter__(self):
+        return iter(self._nodes)
+
+    def __repr__(self):
+        return "NodeTable(%s nodes)" % len(self._nodes)
 
 
 class Hub:
     """
     Provides the methods for Hub operation
     """
-    def __init__(self, hub, nodes):
+    def __init__(self, hub, nodes, registry=None):
         # node and hub are normal strings passed in that are converted to binary mode
+        # registry is an optional cls_NodeRegistry.NodeRegistry, its nodes are supported as well as
+        # those given and it is checked for changes as the hub runs
         self.log = logging.getLogger()
         self.log.debug("[HDD] cls_CognIoTRF HUB initialised")
-        self.nodes = {}
-        for i in nodes:
-            self.nodes[i.encode('utf-8')] = ''       # A dictionary of the Nodes that the instance supports
         self.hub = hub.encode('utf-8')          # The Hub address in use
-        self.log.info("[HDD]: HUB class instantiated with node:%s, hub:%s" % (self.nodes, self.hub))
+        self.fixed_nodes = set(node.encode('utf-8') for node in nodes)     # The nodes given, not in the registry
+        self.registry = registry
+        # The Nodes that the instance supports
+        self.nodes = NodeTable(self.hub, self.fixed_nodes)
+        self.compression_stats = CodecStats()      # The payloads received with each codec
+        self.reassembling = set()           # The nodes with a Reassembly, part way through sending a message
+        self.fragment_stats = {'completed': 0, 'expired': 0, 'dropped': 0, 'completion_s': 0, 'max_completion_s': 0,
+                               'max_held_bytes': 0}
+        self._next_expiry = 0
+        if self.registry is not None:
+            self._sync_nodes()
+        self.log.info("[HDD]: HUB class instantiated with %s nodes, hub:%s" % (len(self.nodes), self.hub))
         self._reset_values()
         return
         
     def decode_and_respond(self, message):
         # This method is for HUBS only
         # Taken the given message and process it.
+        # The message can be bytes or a memoryview, e.g. onto the LoRaComms receive buffer, the payload
+        # returned by reply_payload is then a view onto the same buffer rather than a copy
         # Return the message to send
         # These are from the contents of the message, clear them all when processing the message 
         self._reset_values()
-                
-        self.log.info("[HDD]: Message received for processing:%s" % message)
+
+        if self.registry is not None and self.registry.refresh():
+            self._sync_nodes()
+
+        if len(self.reassembling) > 0 and time.monotonic() >= self._next_expiry:
+            self._expire_fragments()
+
+        self.log.info("[HDD]: Message received for processing, length:%s" % len(message))
 
         if self._split_message(message):
             self.time_packet_received = time.time()
             if self._validated():
                 self.log.info("[HDD]: Message is valid ")
-                if self.nodes[self.src_addr] == '':
-                    self.nodes[self.src_addr] = SubHub(self.src_addr, self.dest_addr)
-                    # If the node has not already been communicated with, create instance
-                (self.response, self.response_status) = self.nodes[self.src_addr].message_response(self.command, message)
-                #TODO: Need to call the SubHub class instance here
+                subhub = self.nodes.get(self.frame.src)
+                (self.response, self.response_status, self.new_data) = subhub.message_response(
+                    self.frame.command, message, self.frame.src_control, self.frame.dest_control)
+                if self.new_data and self.frame.command == CMD_FRAGMENT_PACKET:
+                    # Only new data once the last fragment of the message has arrived
+                    self.new_data = self._reassemble(subhub)
             else:
                 # Data is not valid
                 self.log.info("[HDD]: Message received is invalid")
@@ -221,14 +463,104 @@ class Hub:
         # If True, a reply is to be sent
         return self.response_status
 
+    def reply_new_data(self):
+        # If True, the payload is new data to be stored, False if there is none or it is a retransmission
+        return self.new_data
+
+    def reply_records(self):
+        # The records in the payload, several for an aggregate packet, else the payload on its own
+        # Binary records are turned back into their text, and a delta block into the text of each of
+        # its records, the others are returned as received
+        records = []
+        for record in self.records:
+            if is_delta_block(record):
+                texts = decode_delta_block(record)
+                if texts is not None:
+                    records.extend(text.encode('utf-8') for text in texts)
+                    continue
+                self.log.info("[HDD]: Invalid delta block, stored as received")
+            elif is_binary_record(record):
+                text = decode_record(record)
+                if text is not None:
+                    record = text.encode('utf-8')
+                else:
+                    self.log.info("[HDD]: Invalid binary record, stored as received")
+            records.append(record)
+        return records
+
     def reply_payload_len(self):
         # The length of the data in the payload
-        return self.payload_len
+        if self.frame is None:
+            return 0
+        return self.frame.payload_len
         
     def reply_payload(self):
-        # The data that has been sent
-        return self.payload
-        
+        # The data that has been sent, a memoryview if the message given was one
+        if self.frame is None:
+            return b''
+        return self.frame.payload
+
+    def add_node(self, node, metadata=None):
+        # Add the node, given as a string, so the hub accepts its packets straight away
+        # If there is a registry the node is saved in it, returns False if it can't be saved
+        # The registry takes in any nodes added to the file by another program before saving, so
+        # the node table is brought up to date with it
+        node = node.encode('utf-8')
+        if self.registry is not None:
+            if self.registry.add(node, metadata) == False:
+                return False
+            self._sync_nodes()
+        else:
+            self.fixed_nodes.add(node)
+            self.nodes.add(node)
+        self.log.info("[HDD]: Node added:%s" % node)
+        return True
+
+    def remove_node(self, node):
+        # Remove the node, given as a string, from the hub and the registry
+        # Returns False if the hub didn't have the node
+        node = node.encode('utf-8')
+        self.fixed_nodes.discard(node)
+        status = self.nodes.remove(node)
+        if self.registry is not None:
+            self.registry.remove(node)
+            self._sync_nodes()
+        self.log.info("[HDD]: Node removed:%s" % node)
+        return status
+
+    def memory_per_node(self):
+        # Report the memory used by the hub and its node table, in total and for each node
+        total = sys.getsizeof(self) + sys.getsizeof(self.__dict__) + sys.getsizeof(self.hub) + self.nodes.memory()
+        count = len(self.nodes)
+        return {'nodes': count,
+                'total_bytes': total,
+                'bytes_per_node': total / count if count > 0 else 0}
+
+    def reassembly_stats(self):
+        # Report the messages being received in fragments and the memory they use, the most held for
+        # one node, and the number completed, timed out and dropped to make room, with the time taken
+        # from the first fragment arriving to the message being complete
+        messages = 0
+        held = 0
+        memory = 0
+        for node in self.reassembling:
+            subhub = self.nodes.get(node)
+            if subhub is not None and subhub.reassembly is not None:
+                messages = messages + len(subhub.reassembly.messages)
+                held = held + subhub.reassembly.held
+                memory = memory + subhub.reassembly.memory()
+        stats = self.fragment_stats
+        return {'nodes': len(self.reassembling),
+                'messages': messages,
+                'held_bytes': held,
+                'memory_bytes': memory,
+                'max_held_bytes': stats['max_held_bytes'],
+                'completed': stats['completed'],
+                'expired': stats['expired'],
+                'dropped': stats['dropped'],
+                'mean_completion_ms': stats['completion_s'] * 1000 / stats['completed'] if stats['completed'] > 0 else 0,
+                'max_completion_ms': stats['max_completion_s'] * 1000}
+
     def exit(self):
         # This routine is called to clean up any items on exit of the main program
         print("Bye!")
@@ -245,59 +577,125 @@ class Hub:
 
     def _validated(self):
         # Routine to check the incoming packet TO the HUB is valid from the node
-        if self.hub != self.dest_addr:
+        frame = self.frame
+        if self.hub != frame.dest:
             self.log.info("[HDD]: Message Validation: Incorrect Destination Address, doesn't match hub")
             return False
-        elif self.src_addr not in self.nodes:
+        elif frame.src not in self.nodes:
             # If the source address is not in the list of nodes
             self.log.info("[HDD]: Message Validation: Incorrect Source Address, doesn't match node")
             return False
-        elif self.src_control != CONTROL_BYTE or self.dest_control != CONTROL_BYTE:
+        elif frame.dest_control & ~(FLAG_ACK_REQUEST | CODEC_MASK) != CONTROL:
+            # The source control byte is the sequence number, the destination control byte the flags
+            # and the payload codec
             self.log.info("[HDD]: Message Validation: Incorrect Control Byte")
             return False
-        elif len(self.payload) != self.payload_len:
+        elif len(frame.payload) != frame.payload_len:
             self.log.info("[HDD]: Message Validation: Incorrect Payload length byte doesn't match payload length")
             return False
+        if frame.command == CMD_DATA_PACKET or frame.command == CMD_AGGREGATE_PACKET:
+            payload = decompress((frame.dest_control & CODEC_MASK) >> CODEC_SHIFT, frame.payload,
+                                 self.compression_stats)
+            if payload is None:
+                self.log.info("[HDD]: Message Validation: Unable to decompress the payload")
+                return False
+            # The payload and its length are now those of the data as the node gave it
+            frame.payload = payload
+            frame.payload_len = len(payload)
+        if frame.command == CMD_FRAGMENT_PACKET:
+            if frame.src_control == NO_SEQUENCE or len(frame.payload) <= FRAGMENT_HEADER_LEN:
+                self.log.info("[HDD]: Message Validation: Fragment without a sequence number or data")
+                return False
+            message, index, count = FRAGMENT_HEADER.unpack_from(frame.payload)
+            if index >= count:
+                self.log.info("[HDD]: Message Validation: Fragment number %s of %s" % (index, count))
+                return False
+        elif frame.command == CMD_AGGREGATE_PACKET:
+            records = unpack_records(frame.payload)
+            if records is None:
+                self.log.info("[HDD]: Message Validation: Record lengths don't match the aggregate payload")
+                return False
+            self.records = records
+        elif frame.command == CMD_DATA_PACKET:
+            self.records = [frame.payload]
         return True
     
+    def _reassemble(self, subhub):
+        # Add the fragment to the node's Reassembly, returns True if it completed the message, which
+        # then becomes the payload and record as if it had been sent in a data packet
+        frame = self.frame
+        message, index, count = FRAGMENT_HEADER.unpack_from(frame.payload)
+        if subhub.reassembly is None:
+            subhub.reassembly = Reassembly()
+            self.reassembling.add(frame.src)
+        data = subhub.reassembly.add(message, index, count, bytes(frame.payload[FRAGMENT_HEADER_LEN:]),
+                                     time.monotonic(), self.fragment_stats)
+        if len(subhub.reassembly.messages) == 0:
+            subhub.reassembly = None
+            self.reassembling.discard(frame.src)
+        if data is None:
+            return False
+        # The codec is that of the whole message, the same in each fragment
+        payload = decompress((frame.dest_control & CODEC_MASK) >> CODEC_SHIFT, data, self.compression_stats)
+        if payload is None:
+            self.log.info("[HDD]: Unable to decompress the reassembled message %s" % message)
+            return False
+        self.log.info("[HDD]: Message %s reassembled from %s fragments, length:%s" % (message, count, len(payload)))
+        frame.payload = payload
+        frame.payload_len = len(payload)
+        self.records = [payload]
+        return True
+
+    def _expire_fragments(self):
+        # Drop the messages that have been part way through for longer than REASSEMBLY_TIMEOUT
+        now = time.monotonic()
+        self._next_expiry = now + REASSEMBLY_CHECK
+        for node in list(self.reassembling):
+            subhub = self.nodes.get(node)
+            if subhub is not None and subhub.reassembly is not None:
+                subhub.reassembly.expire(now - REASSEMBLY_TIMEOUT, self.fragment_stats)
+                if len(subhub.reassembly.messages) > 0:
+                    continue
+                subhub.reassembly = None
+            self.reassembling.discard(node)
+        return
+
+    def _sync_nodes(self):
+        # Make the node table match the registry, keeping the state of the nodes already in it
+        for node in self.registry:
+            self.nodes.add(node)
+        for node in list(self.nodes):
+            if node not in self.registry and node not in self.fixed_nodes:
+                self.nodes.remove(node)
+        self.log.info("[HDD]: Nodes updated from the registry, %s nodes" % len(self.nodes))
+        return
+
     def _reset_values(self):
         # These are from the contents of the message, clear them all when processing the message 
-        self.dest_addr = b''        # The address of the hub in the message
-        self.dest_control = b''     # The Control byte of the Hub in the message (future use)
-        self.src_addr = b''         # The address of the node in the message
-        self.src_control = b''      # The Control byte of the node in the message (future use)
-        self.command = b''          # The command in the message
-        self.payload_len = 0      # The length byte in the message
-        self.payload = b''          # The payload in the message (optional)
-                
+        self.frame = None           # The decoded message, see cls_CognIoTCodec.Frame
         self.response = b''         # The message to be returned
         self.response_status = False    # The status of the responding message (True = Valid message)
+        self.new_data = False       # True if the payload is new data, not a retransmission
+        self.records = []           # The records in the payload of a data or aggregate packet
 
         return
 
     def _split_message(self, packet):
         # This routine takes the packet and splits it into its constituent parts
         # Returns True if successful, False if fails
-        status = False
-        if len(packet) >= MIN_LENGTH:
-            self.dest_addr = packet[START_DEST_ADDR:DEST_CONTROL_BYTE]
-            self.dest_control = chr(packet[DEST_CONTROL_BYTE]).encode('utf-8')
-            self.src_addr = packet[START_SRC_ADDR:SRC_CONTROL_BYTE]
-            self.src_control = chr(packet[SRC_CONTROL_BYTE]).encode('utf-8')
-            self.command = chr(packet[COMMAND]).encode('utf-8')
-            self.payload_len = packet[PAYLOAD_LEN]
-            if len(packet) > PAYLOAD:
-                # Onlyadd the payload if the length is longer than then minimum length
-                self.payload = packet[PAYLOAD:]
-            status = True
-            self.log.debug("[HDD]: Destination Address  :%s" % self.dest_addr)
-            self.log.debug("[HDD]: Source Address       :%s" % self.src_addr)
-            self.log.debug("[HDD]: Command byte         :%s" % self.command)
-            self.log.debug("[HDD]: Payload Length       :%s" % self.payload_len)
-            self.log.debug("[HDD]: Payload              :%s" % self.payload)
-        else:
+        # The packet can be a memoryview, the addresses are decoded as bytes as they are used as keys
+        # but the payload is left as a slice of the packet so it is not copied
+        self.frame = decode(packet)
+        if self.frame is None:
             self.log.debug("[HDD]: Unable to split message")
-        return status
+            return False
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug("[HDD]: Destination Address  :%s" % self.frame.dest)
+            self.log.debug("[HDD]: Source Address       :%s" % self.frame.src)
+            self.log.debug("[HDD]: Command byte         :%s" % self.frame.command)
+            self.log.debug("[HDD]: Payload Length       :%s" % self.frame.payload_len)
+            self.log.debug("[HDD]: Payload              :%s" % bytes(self.frame.payload))
+        return True
 
 
 class Node:
@@ -314,18 +712,81 @@ class Node:
         10     - Command Byte
         11     - Payload Length
         12 - n - Payload
+
+    Sequence numbers
+        The node asks the hub at association to number its data packets, in the source control byte,
+        so the hub can spot a retransmission. A hub that doesn't agree, as hubs before the
+        numbering don't, is sent every packet with a source control byte of 0, and only a window of
+        1 is used with it.
+
+    Windowed transfer mode
+        If a window greater than 1 is given, the node asks for it at association and the hub agrees
+        the window it will use, 1 if the hub doesn't support it. Data is then added with queue_data
+        while window_space() is more than 0, window_messages() gives the packets to send in turn and
+        check_window_response() returns the tags of the data the hub has received.
+        queue_records adds as many records as fit in one aggregate packet of up to aggregate_limit
+        bytes of payload, so each record doesn't need its own packet.
+
+    Binary records
+        If binary_records is True, each record is sent in the binary format of cls_RecordCodec when
+        it can be, the hub turns it back into the same text.
+
+    Delta records
+        If delta_records is True, queue_records sends a backlog of records of one reading each as a
+        delta block, each reading after the first being the change from the one before. Each block
+        starts from a full reading, so the hub needs nothing from earlier packets to decode it.
+
+    Payload compression
+        If compression is True, the node offers the codecs of cls_PayloadCodec at association and
+        compresses each payload with the smallest of those the hub agrees. queue_records then fills
+        each aggregate packet with as many records as fit once compressed. compression_stats counts
+        the bytes saved and the CPU time taken.
+
+    Fragmentation
+        Data longer than mtu bytes, once compressed, is split into numbered fragments of up to mtu
+        bytes, so a large sensor dump isn't cropped. In the windowed transfer mode the fragments wait
+        in fragment_queue until there is room in the window, and only those the hub hasn't received
+        are sent again. The tag of the data is returned by check_window_response once every fragment
+        has been received. With set_data_to_be_sent, message_to_send sends each fragment in turn and
+        read_data_sent_status is only True once the last one has been sent.
     
     """
     
-    def __init__(self, node, hub):
+    def __init__(self, node, hub, window=1, aggregate_limit=MAX_LORA_PAYLOAD, binary_records=False,
+                 delta_records=False, compression=False, mtu=MAX_LORA_PAYLOAD):
         # node and hub are normal strings passed in that are converted to binary mode
+        # window is the number of data packets to have outstanding in the windowed transfer mode
+        # aggregate_limit is the largest payload queue_records builds, lower for shorter packets
+        # binary_records sends the records in the binary format rather than as text
+        # delta_records sends the records queue_records aggregates as a delta block
+        # compression offers the payload codecs to the hub at association
+        # mtu is the largest payload in one packet, longer data is sent in fragments
         self.log = logging.getLogger()
         self.log.debug("[HDD] cls_CognIoTRF NODE initialised")
 
         self.node = node.encode('utf-8')        # The Node address that the instance supports
         self.hub = hub.encode('utf-8')          # The Hub address in use
+        self.codec = packet_codec(self.node, self.hub)     # Builds the packets sent to the hub
         self.log.info("[HDD]: NODE class instantiated with node:%s, hub:%s" % (self.node, self.hub))
         self.associated = False                # Associated is used to determine if the unit is already associated
+        self.sequence = NO_SEQUENCE            # The sequence number of the latest data given to send
+        self.pending_data = None               # The latest data given to send, until it is acknowledged
+        self.pending_payload = None            # The (codecs, codec, payload) of pending_data sent in one packet
+        self.sent_sequence = NO_SEQUENCE       # The sequence number of the last packet sent, to check the Ack
+        self.sequences = False                 # True if the hub agreed at association to numbered packets
+        self.requested_window = max(1, min(window, MAX_WINDOW))
+        self.window = 1                        # The window agreed at association
+        self.aggregate_limit = aggregate_limit
+        self.binary_records = binary_records
+        self.delta_records = delta_records
+        self.compression = compression
+        self.codecs = 0                        # The mask of the payload codecs agreed at association
+        self.compression_stats = CodecStats()  # The payloads sent with each codec
+        self.mtu = min(mtu, MAX_LORA_PAYLOAD)
+        self.message_number = 0                # The message number of the last data sent in fragments
+        self.pending_fragments = []            # The [sequence, payload, codec] of the fragments of pending_data not yet acknowledged
+        self.outstanding = []                  # The [sequence, payload, tags, command, codec] not yet acknowledged, in order
+        self.fragment_queue = []               # The fragments waiting for room in the window, as in outstanding
         self._reset_values()
         #TODO: Track the time it is received
         return
@@ -333,11 +794,23 @@ class Node:
     def set_data_to_be_sent(self, data):
         # Pass in data to be sent when required
         # This doesn't send the data, use message_to_send for that
-        if len(data) > MAX_PAYLOAD_LEN:
-            self.log.info("[HDD] message received is longer than allowed, length:%s, message cropped" % len(data))
-            self.data_to_send = data.encode('utf-8')[:MAX_PAYLOAD_LEN]
-        else:
-            self.data_to_send = data.encode('utf-8')
+        # Data that is the same as the data not yet acknowledged is a retransmission, so keeps its
+        # sequence number, anything else gets the next one, or one for each fragment if it is too
+        # long for one packet
+        self.data_to_send = self._encode_data(data)
+        if len(self.data_to_send) > 0 and self.data_to_send != self.pending_data:
+            self.pending_data = self.data_to_send
+            self.pending_fragments = []
+            self.pending_payload = None
+            codec, parts = self._split(self.data_to_send)
+            if len(parts) > 1:
+                for part in parts:
+                    self.sequence = next_sequence(self.sequence)
+                    self.pending_fragments.append([self.sequence, part, codec])
+            else:
+                self.sequence = next_sequence(self.sequence)
+                # Kept so the data is sent, and sent again, without compressing it again
+                self.pending_payload = (self.codecs, codec, parts[0])
         
         self.data_sent = False
         return
@@ -348,21 +821,135 @@ class Node:
 
     def force_reassociation(self):
         # This will force the message to re-assocaite
-        self.assocaited = False
+        self.associated = False
         return
+
+    def window_space(self):
+        # The number of data packets that can be added with queue_data, 0 if not associated or the
+        # window is full, including the fragments waiting for room in it
+        if self.associated == False:
+            return 0
+        return max(0, self.window - len(self.outstanding) - len(self.fragment_queue))
+
+    def queued_tags(self):
+        # Return the tags of all the data in the window or waiting for room in it
+        return [tag for entry in self.outstanding + self.fragment_queue for tag in entry[2]]
+
+    def queue_data(self, data, tag=None):
+        # Add the data to the window with the next sequence number, the tag is returned by
+        # check_window_response when the hub has received it, e.g. the name of the record file
+        # Data too long for one packet is queued as fragments, the last one holding the tag
+        # Returns the sequence number given to the data, or the last fragment that fits in the window
+        codec, parts = self._split(self._encode_data(data))
+        if len(parts) == 1:
+            self.sequence = next_sequence(self.sequence)
+            self.outstanding.append([self.sequence, parts[0], [tag], CMD_DATA_PACKET, codec])
+            return self.sequence
+        for part in parts[:-1]:
+            self.fragment_queue.append([NO_SEQUENCE, part, [], CMD_FRAGMENT_PACKET, codec])
+        self.fragment_queue.append([NO_SEQUENCE, parts[-1], [tag], CMD_FRAGMENT_PACKET, codec])
+        self.log.info("[HDD]: Message %s queued in %s fragments" % (self.message_number, len(parts)))
+        self._fill_window()
+        return self.sequence
+
+    def queue_records(self, records):
+        # Add as many of the records, a list of (data, tag), as fit in one packet to the window
+        # Returns the number of records added, the rest are for later packets
+        if len(records) == 0:
+            return 0
+        if self.delta_records:
+            count = self._queue_delta_records(records)
+            if count > 1:
+                return count
+        elif self.codecs != 0:
+            count = self._queue_compressed_records(records)
+            if count > 1:
+                return count
+        # Only the records up to the first that doesn't fit are encoded
+        encoded = (self._encode_data(data) for data, tag in records)
+        payload, count = pack_records(encoded, self.aggregate_limit)
+        if count <= 1:
+            # A record on its own is sent as a data packet, without the length byte
+            self.queue_data(records[0][0], records[0][1])
+            return 1
+        codec, payload = compress(payload, self.codecs, self.compression_stats)
+        self.sequence = next_sequence(self.sequence)
+        self.outstanding.append([self.sequence, payload, [tag for data, tag in records[:count]],
+                                 CMD_AGGREGATE_PACKET, codec])
+        self.log.info("[HDD]: %s records aggregated into %s bytes" % (count, len(payload)))
+        return count
+
+    def window_messages(self):
+        # Return the packets for all the data not yet acknowledged, to be sent in turn
+        # The last packet asks the hub for a selective Ack, unless the window is 1 when every packet is Acked
+        messages = []
+        last = len(self.outstanding) - 1
+        for position, (sequence, payload, tags, command, codec) in enumerate(self.outstanding):
+            flags = codec << CODEC_SHIFT
+            if position == last and self.window > 1:
+                flags = flags | FLAG_ACK_REQUEST
+            messages.append(self.codec.encode(command, payload, dest_control=flags,
+                                              src_control=self._numbered(sequence)))
+        self.sent_sequence = NO_SEQUENCE
+        if len(self.outstanding) > 0:
+            self.sent_sequence = self.outstanding[-1][0]
+        return messages
+
+    def check_window_response(self, message):
+        # Check the Ack to the last window sent and return the tags of the data it acknowledges
+        # The acknowledged data is removed from the window, anything else is sent again
+        acknowledged = []
+        if self.check_response(message) == False:
+            return acknowledged
+        if self.payload_len > 0:
+            received = bytes(self.payload)
+        elif self.sequences:
+            received = bytes((self.dest_control,))
+        else:
+            # Without sequence numbers the window is 1, so the Ack is for the packet sent
+            received = bytes((self.sent_sequence,))
+        remaining = []
+        received_entries = []
+        for entry in self.outstanding:
+            if entry[0] in received:
+                received_entries.append(entry)
+            else:
+                remaining.append(entry)
+        self.outstanding = remaining
+        for entry in received_entries:
+            if entry[3] == CMD_FRAGMENT_PACKET and len(entry[2]) > 0:
+                # The tag of fragmented data is passed on to a fragment not yet received, if any
+                sibling = self._unreceived_fragment(entry[1][0])
+                if sibling is not None:
+                    sibling[2].extend(entry[2])
+                    continue
+            acknowledged.extend(entry[2])
+        self._fill_window()
+        self.log.info("[HDD]: Window acknowledged:%s, outstanding:%s" % (len(acknowledged), len(remaining)))
+        return acknowledged
         
 #TODO: Need to tie this method with check_response
     def message_to_send(self):
         # Decide what message to send and return it
         # If no message to send, return an empty packet
         message = b''
+        self.sent_sequence = NO_SEQUENCE
         if self.associated == False:
             message = self._association_request()
             self.data_sent = False
         else:
-            if len(self.data_to_send) > 0:
+            if len(self.data_to_send) > 0 and len(self.pending_fragments) > 0:
+                # Send the next fragment, the data has only been sent with the last one
+                sequence, payload, codec = self.pending_fragments[0]
+                message = self.codec.encode(CMD_FRAGMENT_PACKET, payload, dest_control=codec << CODEC_SHIFT,
+                                            src_control=self._numbered(sequence))
+                self.sent_sequence = sequence
+                self.data_to_send = b''
+                self.data_sent = len(self.pending_fragments) == 1
+            elif len(self.data_to_send) > 0:
                 # If there is data to send, send it
-                message = self._data_packet(self.data_to_send)
+                message = self._data_packet(self.data_to_send, self._numbered(self.sequence))
+                self.sent_sequence = self.sequence
                 self.data_to_send = b''
                 self.data_sent = True
             else:
@@ -382,11 +969,21 @@ class Node:
                 if self.associated:
                     # Possible commands are data packet and ping (if associated)
                     self.log.info("[HDD]: HUB <==> NODE are associated")
-                    if self.command == ACK:
+                    if self.command == CMD_ACK and self.dest_control != self._numbered(self.sent_sequence):
+                        # An Acknowledge for an earlier packet, e.g. a delayed one
+                        self.log.info("[HDD]: Acknowledge received for sequence:%s, expected:%s" %
+                                      (self.dest_control, self._numbered(self.sent_sequence)))
+                        self.response_status = False
+                    elif self.command == CMD_ACK:
                         # Received an Acknowledge
                         self.log.info("[HDD]: General Acknowledge received")
+                        if self.sent_sequence != NO_SEQUENCE:
+                            if len(self.pending_fragments) > 0 and self.pending_fragments[0][0] == self.sent_sequence:
+                                self.pending_fragments.pop(0)
+                            if len(self.pending_fragments) == 0:
+                                self.pending_data = None
                         self.response_status = True
-                    elif self.command == NACK:
+                    elif is_nack(self.command, self.payload_len):
                         # Received a Not Acknowledged
                         self.log.info("[HDD]: Not Acknowledged Command Received")
                         self.response_status = False
@@ -396,9 +993,20 @@ class Node:
                 else:
                     # Possible commands are association request
                     self.log.info("[HDD]: HUB & NODE are NOT associated")
-                    if self.command == ASSOCIATIONRESPONSE:
-                        # Received an Associated Response
-                        self.log.info("[HDD]: Assocation Response Command Received")
+                    if self.command == CMD_ASSOCIATION_RESPONSE:
+                        # Received an Associated Response, with the window, codecs and flags agreed
+                        # if they were asked for
+                        self.window = 1
+                        self.codecs = 0
+                        self.sequences = self.payload_len >= 3 and (self.payload[2] & FLAG_SEQUENCES) != 0
+                        if self.sequences and self.requested_window > 1 and self.payload_len >= 1:
+                            # The windowed transfer mode needs the packets numbered
+                            self.window = max(1, min(self.payload[0], self.requested_window))
+                        if self.compression and self.payload_len >= 2:
+                            self.codecs = agree_codecs(self.payload[1])
+                        self.log.info("[HDD]: Assocation Response Command Received, window:%s, codecs:0x%02x, sequences:%s" %
+                                      (self.window, self.codecs, self.sequences))
+                        self._restart_fragments()
                         self.associated = True
                         self.response_status = True
                     else:
@@ -434,11 +1042,113 @@ class Node:
         elif self.hub != self.src_addr:
             self.log.info("[HDD]: Message Validation: Incorrect Source Address, doesn't match Hub")
             return False
-        elif self.dest_control != CONTROL_BYTE or self.src_control != CONTROL_BYTE:
+        elif self.src_control != CONTROL:
+            # The destination control byte is the sequence number being acknowledged
             self.log.info("[HDD]: Message Validation: Incorrect Control Byte")
             return False
         return True
 
+    def _queue_delta_records(self, records):
+        # Add as many of the records as fit in a delta block to the window, as the only record of an
+        # aggregate packet, returns the number added, 0 if fewer than 2 records fit and none are added
+        encoder = DeltaEncoder(min(self.aggregate_limit, MAX_PAYLOAD_LEN + 1) - 1)
+        for data, tag in records:
+            if encoder.add(data) == False:
+                break
+        if encoder.count <= 1:
+            return 0
+        payload, count = pack_records([encoder.block()], self.aggregate_limit)
+        codec, payload = compress(payload, self.codecs, self.compression_stats)
+        self.sequence = next_sequence(self.sequence)
+        self.outstanding.append([self.sequence, payload, [tag for data, tag in records[:encoder.count]],
+                                 CMD_AGGREGATE_PACKET, codec])
+        self.log.info("[HDD]: %s records delta encoded into %s bytes" % (encoder.count, len(payload)))
+        return encoder.count
+
+    def _queue_compressed_records(self, records):
+        # Add as many of the records as fit in one packet once compressed to the window, returns the
+        # number added, 0 if fewer than 2 records fit and none are added
+        # The records are packed up to the most the hub will decompress, then fewer are packed, in
+        # proportion to how far over the limit the compressed payload is, until it fits
+        payload, count = pack_records((self._encode_data(data) for data, tag in records), MAX_DECOMPRESSED_LEN)
+        encoded = unpack_records(payload)
+        starttime = time.thread_time_ns()
+        while count > 1:
+            codec, compressed = compress(payload, self.codecs)
+            if len(compressed) <= self.aggregate_limit:
+                break
+            count = min(count - 1, count * self.aggregate_limit // len(compressed))
+            payload, count = pack_records(encoded[:count], MAX_DECOMPRESSED_LEN)
+        if count <= 1:
+            return 0
+        self.compression_stats.record(codec, len(payload), len(compressed), time.thread_time_ns() - starttime)
+        self.sequence = next_sequence(self.sequence)
+        self.outstanding.append([self.sequence, compressed, [tag for data, tag in records[:count]],
+                                 CMD_AGGREGATE_PACKET, codec])
+        self.log.info("[HDD]: %s records aggregated into %s bytes, %s compressed" % (count, len(payload), len(compressed)))
+        return count
+
+    def _encode_data(self, data):
+        # Return the data as the payload to send, in the binary format if it is being used and the
+        # record fits it, else as text cropped to the longest message that can be sent in fragments
+        if self.binary_records and len(data) > 0:
+            record = encode_record(data)
+            if record is not None:
+                return record
+        data = data.encode('utf-8')
+        if len(data) > MAX_MESSAGE_LEN:
+            self.log.info("[HDD] message received is longer than allowed, length:%s, message cropped" % len(data))
+            data = data[:MAX_MESSAGE_LEN]
+        return data
+
+    def _split(self, data):
+        # Compress the data with the agreed codecs and split it into fragments if it doesn't fit in
+        # one packet, returns the codec and the parts, a single part if it fits
+        # Data longer than the hub will decompress is sent as it is
+        codec = CODEC_NONE
+        payload = data
+        if len(data) <= MAX_DECOMPRESSED_LEN:
+            codec, payload = compress(data, self.codecs, self.compression_stats)
+        if len(payload) <= self.mtu:
+            return codec, [payload]
+        limit = MAX_FRAGMENTS * (self.mtu - FRAGMENT_HEADER_LEN)
+        if len(payload) > limit:
+            self.log.info("[HDD] message is too long for %s fragments, length:%s, message cropped" %
+                          (MAX_FRAGMENTS, len(payload)))
+            codec = CODEC_NONE
+            payload = data[:limit]
+        self.message_number = (self.message_number + 1) % (MAX_SEQUENCE + 1)
+        return codec, split_fragments(self.message_number, payload, self.mtu)
+
+    def _fill_window(self):
+        # Move the fragments waiting for room in the window into it, giving each its sequence number
+        while len(self.fragment_queue) > 0 and len(self.outstanding) < self.window:
+            entry = self.fragment_queue.pop(0)
+            self.sequence = next_sequence(self.sequence)
+            entry[0] = self.sequence
+            self.outstanding.append(entry)
+        return
+
+    def _unreceived_fragment(self, message):
+        # Return the first fragment of the message not yet received by the hub, or None
+        for entry in self.outstanding + self.fragment_queue:
+            if entry[3] == CMD_FRAGMENT_PACKET and entry[1][0] == message:
+                return entry
+        return None
+
+    def _restart_fragments(self):
+        # The hub drops the fragments it holds when the node associates, so any data part way
+        # through being sent in fragments is dropped here too, to be given again and sent in full
+        if len(self.pending_fragments) > 0:
+            self.pending_fragments = []
+            self.pending_data = None
+        fragments = [entry for entry in self.outstanding + self.fragment_queue if entry[3] == CMD_FRAGMENT_PACKET]
+        if len(fragments) > 0:
+            self.log.info("[HDD]: %s fragments dropped on association, to be sent again" % len(fragments))
+            self.outstanding = [entry for entry in self.outstanding if entry[3] != CMD_FRAGMENT_PACKET]
+            self.fragment_queue = []
+        return
+
     def _split_message(self, packet):
         # This routine takes the incoming packet and splits it into its constituent parts
         # Returns True if successful, False if fails
@@ -452,31 +1162,31 @@ class Node:
         12 - n - Payload
         """
         status = False
-        if len(packet) >= MIN_LENGTH:
-            self.dest_addr = packet[START_DEST_ADDR:DEST_CONTROL_BYTE]
-            self.dest_control = chr(packet[DEST_CONTROL_BYTE]).encode('utf-8')
-            self.src_addr = packet[START_SRC_ADDR:SRC_CONTROL_BYTE]
-            self.src_control = chr(packet[SRC_CONTROL_BYTE]).encode('utf-8')
-            self.command = chr(packet[COMMAND]).encode('utf-8')
-            self.payload_len = packet[PAYLOAD_LEN]
-            if len(packet) > PAYLOAD:
-                # Onlyadd the payload if the length is longer than then minimum length
-                self.payload = packet[PAYLOAD:]
+        frame = decode(packet)
+        if frame is not None:
+            self.dest_addr = frame.dest
+            self.dest_control = frame.dest_control
+            self.src_addr = frame.src
+            self.src_control = frame.src_control
+            self.command = frame.command
+            self.payload_len = frame.payload_len
+            self.payload = frame.payload
             status = True
-        self.log.debug("[HDD]: Destination Address  :%s" % self.dest_addr)
-        self.log.debug("[HDD]: Source Address       :%s" % self.src_addr)
-        self.log.debug("[HDD]: Command byte         :%s" % self.command)
-        self.log.debug("[HDD]: Payload Length       :%s" % self.payload_len)
-        self.log.debug("[HDD]: Payload              :%s" % self.payload)
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug("[HDD]: Destination Address  :%s" % self.dest_addr)
+            self.log.debug("[HDD]: Source Address       :%s" % self.src_addr)
+            self.log.debug("[HDD]: Command byte         :%s" % self.command)
+            self.log.debug("[HDD]: Payload Length       :%s" % self.payload_len)
+            self.log.debug("[HDD]: Payload              :%s" % bytes(self.payload))
         return status
         
     def _reset_values(self):
         # These are from the contents of the message, clear them all when processing the message 
         self.dest_addr = b''            # The address of the hub in the message
-        self.dest_control = b''         # The Control byte of the Hub in the message (future use)
+        self.dest_control = 0           # The Control byte of the Hub in the message (future use)
         self.src_addr = b''             # The address of the node in the message
-        self.src_control = b''          # The Control byte of the node in the message (future use)
-        self.command = b''              # The command in the message
+        self.src_control = 0            # The Control byte of the node in the message (future use)
+        self.command = 0                # The command byte in the message
         self.payload_len = 0            # The length byte in the message
         self.payload = b''              # The payload in the message (optional)
         self.data_to_send = b''         # The data to be managed and sent
@@ -489,39 +1199,43 @@ class Node:
     def _association_request(self):
         # Prepare an Associate message to send
         # return the message to be sent
-
-        packet_to_send = b''
-        packet_to_send = packet_to_send + self.hub + CONTROL_BYTE      # Sender address & Control byte
-        packet_to_send = packet_to_send + self.node + CONTROL_BYTE    # Receiver address & Control byte
-        packet_to_send = packet_to_send + ASSOCIATIONREQUEST
-        packet_to_send = packet_to_send + ZeroPayload
+        # The payload is the window wanted, the mask of the payload codecs if compression is wanted
+        # and the flags, asking for the data packets to be numbered
+        codecs = 0
+        if self.compression:
+            codecs = SUPPORTED_CODECS
+        payload = bytes((self.requested_window, codecs, FLAG_SEQUENCES))
+        packet_to_send = self.codec.encode(CMD_ASSOCIATION_REQUEST, payload)
         self.log.debug("[HDD] Assocation Request Message:%s" % packet_to_send)
         return packet_to_send
 
-    def _data_packet(self, data):
+    def _numbered(self, sequence):
+        # The sequence number to send in the source control byte, NO_SEQUENCE if the hub didn't agree
+        # to numbered packets at association
+        if self.sequences:
+            return sequence
+        return NO_SEQUENCE
+
+    def _data_packet(self, data, sequence=NO_SEQUENCE):
         # Prepare a Data Packet message with the included data supplied
-        # Data is supplied as a string
+        # Data is supplied in binary format, the sequence number is sent in the source control byte
+        # and the codec of the payload, if it is compressed, in the destination control byte
+        # The payload compressed by set_data_to_be_sent is used, unless the codecs agreed have
+        # changed since, e.g. on association
         # return the message to be sent
-
-        packet_to_send = b''
-        packet_to_send = packet_to_send + self.hub + CONTROL_BYTE      # Sender address & Control byte
-        packet_to_send = packet_to_send + self.node + CONTROL_BYTE    # Receiver address & Control byte
-        packet_to_send = packet_to_send + DATAPACKET
-        packet_to_send = packet_to_send + len(data).to_bytes(1, byteorder='big', signed=False)      # old was 'str(len(data)).encode('utf-8')'
-        packet_to_send = packet_to_send + data
+        if self.pending_payload is None or self.pending_payload[0] != self.codecs:
+            codec, payload = compress(data, self.codecs, self.compression_stats)
+            self.pending_payload = (self.codecs, codec, payload)
+        codecs, codec, payload = self.pending_payload
+        packet_to_send = self.codec.encode(CMD_DATA_PACKET, payload, dest_control=codec << CODEC_SHIFT,
+                                           src_control=sequence)
         self.log.debug("[HDD] Data Packet Message:%s" % packet_to_send)
         return packet_to_send
 
     def _ping(self):
         # Prepare a Data Packet message to send the ping
         # return the message to be sent
-
-        packet_to_send = b''
-        packet_to_send = packet_to_send + self.hub + CONTROL_BYTE      # Sender address & Control byte
-        packet_to_send = packet_to_send + self.node + CONTROL_BYTE    # Receiver address & Control byte
-        packet_to_send = packet_to_send + PING
-        packet_to_send = packet_to_send + ZeroPayload
+        packet_to_send = self.codec.encode(CMD_PING)
         self.log.debug("[HDD] Ping Message:%s" % packet_to_send)
-        packet_to_send       # contains the message to be sent back
         return packet_to_send
 
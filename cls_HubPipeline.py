@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+"""
+Bostin Technology  (see www.CognIoT.eu)
+
+The hub run as a pipeline of stages, each in its own thread, so a slow write to the SD card doesn't
+hold up the Ack to the node
+
+    radio       receives each packet from the LoRa module and queues a copy for decoding
+    decode      decodes the packet with the Hub, appends any new records to the write-ahead log and
+                sends the reply as soon as they are safely in it, then queues them for storing
+    store       stores each record, e.g. with WriteDataToDir or cls_RecordStore.SegmentLog, and
+                marks them as stored in the log
+
+The queues between the stages are bounded. If the store falls behind, its queue fills and the
+decode stage waits, then the receive queue fills and the radio stage waits, so the hub stops
+Acking and the nodes keep their records until it catches up.
+
+The write-ahead log is a file of entries, each the records of one packet
+
+    Bytes   - Meaning
+    ======  - =======
+    0 - 3   - Length of the rest of the entry
+    4 - 7   - CRC32 of the rest of the entry
+    8 - 11  - The node the packet came from
+    12 - 19 - The time the packet was received, as from time.time()
+    20 - n  - Each record preceded by its 2 byte length
+
+Each entry is written and flushed to the card before the Ack is sent. The position up to which the
+records have been stored is kept in the checkpoint file, the log file name with CHECKPOINT_EXT,
+and when everything in the log has been stored and it has grown past WAL_RESET_SIZE it is emptied.
+When the hub starts, the records after the checkpoint are stored again, so none are lost if it
+stops part way through, although the last few may be stored twice.
+
+The time each packet spends in each stage, and the depth of each queue, are in snapshot().
+"""
+
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+from cls_LoRaStats import LoRaStats
+
+# The default write-ahead log file
+HUB_WAL_FILE = "hub_wal.log"
+
+# The extension added to the log file name for the checkpoint file
+CHECKPOINT_EXT = ".done"
+
+# The header of each entry in the log, the node and time received, and the length before each record
+ENTRY_HEADER = struct.Struct('>II')
+PACKET_INFO = struct.Struct('>4sd')
+RECORD_LEN = struct.Struct('>H')
+
+# The checkpoint, the position in the log up to which the records have been stored
+CHECKPOINT = struct.Struct('>Q')
+
+# The log is emptied when it has all been stored and is longer than this
+WAL_RESET_SIZE = 1024 * 1024
+
+# The checkpoint is written after this many entries are stored, or when the store has caught up
+CHECKPOINT_ENTRIES = 32
+
+# The default depth of the queues between the stages
+RECEIVE_QUEUE_SIZE = 16
+STORE_QUEUE_SIZE = 64
+
+# How long, in seconds, the radio stage waits for a packet, and the stages wait on their queues,
+# before checking if the pipeline is being stopped
+POLL_TIME = 0.2
+
+# How long, in seconds, the store stage waits before trying a record again if it can't be stored
+STORE_RETRY_WAIT = 5
+
+# The stages the latency is recorded for
+STAGE_RECEIVE_QUEUE = 'receive_queue'   # The wait in the receive queue
+STAGE_DECODE = 'decode'                 # Hub.decode_and_respond
+STAGE_WAL = 'wal'                       # Appending the records to the log and flushing it
+STAGE_ACK = 'ack'                       # From the packet being received to the reply being sent
+STAGE_STORE_QUEUE = 'store_queue'       # The wait in the store queue
+STAGE_STORE = 'store'                   # Storing the records of a packet
+STAGES = (STAGE_RECEIVE_QUEUE, STAGE_DECODE, STAGE_WAL, STAGE_ACK, STAGE_STORE_QUEUE, STAGE_STORE)
+
+# The event counters
+EVT_RECEIVE_FULL = 'receive_full'       # The radio stage waited for room in the receive queue
+EVT_STORE_FULL = 'store_full'           # The decode stage waited for room in the store queue
+EVT_REPLAYED = 'replayed'               # Records stored again from the log when starting
+EVT_STORE_FAILED = 'store_failed'       # A record that couldn't be stored, it is tried again
+EVT_WAL_FAILED = 'wal_failed'           # The log couldn't be written, the records were stored before the Ack
+EVT_DECODE_FAILED = 'decode_failed'     # A packet that raised an exception in the decode stage
+EVENTS = (EVT_RECEIVE_FULL, EVT_STORE_FULL, EVT_REPLAYED, EVT_STORE_FAILED, EVT_WAL_FAILED, EVT_DECODE_FAILED)
+
+
+def sync_directory(directory):
+    # Flush the directory to the card, so the files created in it are there as well as their contents
+    # Raises OSError if it can't
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return
+
+
+class WriteAheadLog:
+    """
+    The records Acked but not yet stored, in a file that is flushed to the card as each entry is
+    added
+
+    recover()                       opens the log, returns the (position, node, received, records)
+                                    not yet stored
+    append(records, node, received) adds the records, returns their position once on the card, None
+                                    if it fails
+    stored(position)    marks the records up to the position as stored
+    pending()           returns the bytes in the log not yet stored
+    close()             writes the checkpoint and closes the log
+
+    append is called by one thread and stored by another, the position and the emptying of the log
+    are under a lock
+    """
+
+    def __init__(self, filename=HUB_WAL_FILE):
+        self.log = logging.getLogger()
+        self.filename = filename
+        self.checkpoint_file = filename + CHECKPOINT_EXT
+        self.lock = threading.Lock()
+        self.fd = None
+        self.end = 0                    # The position after the last entry
+        self.stored_position = 0        # The position up to which the records have been stored
+        self.checkpoint = 0             # The stored position in the checkpoint file
+        self.unsaved = 0                # The entries stored since the checkpoint was written
+        return
+
+    def recover(self):
+        # Open the log and return the (position, node, received, records) of each entry after the checkpoint
+        # An entry that wasn't completely written, when the hub stopped, is removed as it wasn't Acked
+        # If the log can't be opened, append returns None for every entry
+        self.checkpoint = self._read_checkpoint()
+        entries = []
+        try:
+            self.fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+            with open(self.filename, mode='rb') as f:
+                data = f.read()
+        except OSError:
+            self.log.warning("[HPL]: Unable to open the write-ahead log:%s" % self.filename)
+            return entries
+        if self.checkpoint > len(data):
+            # The log was emptied but the checkpoint not yet written
+            self.checkpoint = 0
+        position = self.checkpoint
+        while position + ENTRY_HEADER.size <= len(data):
+            length, crc = ENTRY_HEADER.unpack_from(data, position)
+            start = position + ENTRY_HEADER.size
+            body = data[start:start + length]
+            if len(body) != length or length < PACKET_INFO.size or zlib.crc32(body) != crc:
+                break
+            position = start + length
+            node, received = PACKET_INFO.unpack_from(body)
+            entries.append((position, node, received, self._unpack(body[PACKET_INFO.size:])))
+        if position < len(data):
+            self.log.warning("[HPL]: Incomplete entry at the end of the write-ahead log removed, %s bytes" %
+                             (len(data) - position))
+            os.ftruncate(self.fd, position)
+            os.fsync(self.fd)
+        self.end = position
+        self.stored_position = self.checkpoint
+        os.lseek(self.fd, self.end, os.SEEK_SET)
+        self.log.info("[HPL]: Write-ahead log opened, %s entries not yet stored" % len(entries))
+        return entries
+
+    def append(self, records, node, received):
+        # Add the records, from the node at the time received, to the log and flush it to the card
+        # Returns the position after them, or None if the log can't be written
+        data = PACKET_INFO.pack(node, received) + b''.join(RECORD_LEN.pack(len(record)) + record for record in records)
+        entry = ENTRY_HEADER.pack(len(data), zlib.crc32(data)) + data
+        with self.lock:
+            if self.fd is None:
+                return None
+            try:
+                os.write(self.fd, entry)
+                os.fsync(self.fd)
+            except OSError:
+                self.log.warning("[HPL]: Unable to write to the write-ahead log:%s" % self.filename)
+                return None
+            self.end = self.end + len(entry)
+            return self.end
+
+    def stored(self, position):
+        # Mark the records up to the position as stored
+        # The checkpoint is written every CHECKPOINT_ENTRIES entries, or when everything is stored
+        # and the log is then emptied if it has grown past WAL_RESET_SIZE
+        self.stored_position = max(self.stored_position, position)
+        self.unsaved = self.unsaved + 1
+        with self.lock:
+            caught_up = self.stored_position == self.end
+            if caught_up == False and self.unsaved < CHECKPOINT_ENTRIES:
+                return
+            if caught_up and self.end > WAL_RESET_SIZE:
+                self._reset()
+                return
+        self._write_checkpoint(self.stored_position)
+        return
+
+    def pending(self):
+        # The bytes in the log whose records haven't been stored yet
+        return self.end - self.stored_position
+
+    def close(self):
+        # Write the checkpoint and close the log
+        if self.fd is not None:
+            self._write_checkpoint(self.stored_position)
+            os.close(self.fd)
+            self.fd = None
+        return
+
+#=======================================================================
+#
+#    P R I V A T E   F U N C T I O N S
+#
+#    Not to be Called Directly from outside class
+#
+#=======================================================================
+
+    def _unpack(self, data):
+        # Split the records of an entry
+        records = []
+        position = 0
+        while position < len(data):
+            (length,) = RECORD_LEN.unpack_from(data, position)
+            position = position + RECORD_LEN.size
+            records.append(data[position:position + length])
+            position = position + length
+        return records
+
+    def _reset(self):
+        # Empty the log, everything in it has been stored, called holding the lock
+        try:
+            os.ftruncate(self.fd, 0)
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            os.fsync(self.fd)
+        except OSError:
+            self.log.warning("[HPL]: Unable to empty the write-ahead log:%s" % self.filename)
+            return
+        self.end = 0
+        self.stored_position = 0
+        self._write_checkpoint(0)
+        self.log.info("[HPL]: Write-ahead log emptied")
+        return
+
+    def _read_checkpoint(self):
+        # Return the position in the checkpoint file, 0 if there isn't one
+        try:
+            with open(self.checkpoint_file, mode='rb') as f:
+                data = f.read(CHECKPOINT.size)
+        except OSError:
+            return 0
+        if len(data) != CHECKPOINT.size:
+            return 0
+        return CHECKPOINT.unpack(data)[0]
+
+    def _write_checkpoint(self, position):
+        # Write the stored position to the checkpoint file, the stored records are already on the
+        # card as the store commits them before they are marked as stored
+        self.unsaved = 0
+        if position == self.checkpoint:
+            return
+        try:
+            with open(self.checkpoint_file, mode='wb') as f:
+                f.write(CHECKPOINT.pack(position))
+                f.flush()
+                os.fsync(f.fileno())
+            sync_directory(os.path.dirname(os.path.abspath(self.checkpoint_file)))
+        except OSError:
+            self.log.warning("[HPL]: Unable to write the checkpoint file:%s" % self.checkpoint_file)
+            return
+        self.checkpoint = position
+        return
+
+
+class HubPipeline:
+    """
+    Runs the Hub with the radio, decode and store stages in their own threads
+
+    start()         stores anything left in the log and starts the stages
+    stop()          stops the stages, letting the store stage finish what is queued
+    snapshot()      returns the latency of each stage and the depth of each queue
+    stopped_stages() returns the names of the stages that have stopped while the pipeline is running
+
+    comms is the LoRaComms, hub the cls_CognIoTRF.Hub and store a function called with each
+    record, as bytes, the node address and the time it was received, to store it. If it can't, it
+    returns False or raises an exception, e.g. OSError, and the record is tried again.
+    store_commit, if given, is for a store that groups its writes to the card, e.g. SegmentLog.commit.
+    It is called with force after each packet of records is stored, and whenever the store stage has
+    nothing to do, and returns True once everything stored so far is on the card. Until then the
+    records are not marked as stored in the log, so they are stored again if the hub stops.
+    """
+
+    def __init__(self, comms, hub, store, wal_file=HUB_WAL_FILE, receive_queue_size=RECEIVE_QUEUE_SIZE,
+                 store_queue_size=STORE_QUEUE_SIZE, store_commit=None):
+        self.log = logging.getLogger()
+        self.comms = comms
+        self.hub = hub
+        self.store = store
+        self.store_commit = store_commit
+        self.wal = WriteAheadLog(wal_file)
+        self.stats = LoRaStats(STAGES, EVENTS)
+        self.receive_queue = queue.Queue(receive_queue_size)    # The (packet, time received, perf_counter_ns) to decode
+        self.store_queue = queue.Queue(store_queue_size)        # The (position, node, time received, records, time queued) to store
+        self.max_receive_depth = 0
+        self.max_store_depth = 0
+        self.running = threading.Event()
+        self.decode_done = threading.Event()     # Set when the decode stage has stopped
+        self.store_done = threading.Event()      # Set when the store stage has stopped
+        self.threads = []
+        self.replay = []                # The entries in the log when started, to be stored first
+        self.uncommitted = None         # The position in the log of the records stored but not yet committed
+        return
+
+    def start(self):
+        # Open the log and start the stages, the store stage first stores anything left in the log
+        self.replay = self.wal.recover()
+        self.decode_done.clear()
+        self.store_done.clear()
+        self.running.set()
+        for name, target in (('radio', self._radio_stage), ('decode', self._decode_stage),
+                             ('store', self._store_stage)):
+            thread = threading.Thread(target=target, name='hub_' + name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        self.log.info("[HPL]: Hub pipeline started")
+        return
+
+    def stop(self):
+        # Stop receiving, decode what has been received and store what has been queued
+        self.running.clear()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self.wal.close()
+        self.log.info("[HPL]: Hub pipeline stopped")
+        return
+
+    def stopped_stages(self):
+        # Return the names of the stage threads that are no longer running, e.g. after an exception
+        return [thread.name for thread in self.threads if thread.is_alive() == False]
+
+    def snapshot(self):
+        # Return the latency of each stage and the events, as LoRaStats.snapshot, with the current
+        # and largest depth of each queue and the bytes in the log not yet stored
+        snapshot = self.stats.snapshot()
+        snapshot['queues'] = {'receive': self.receive_queue.qsize(),
+                              'receive_max': self.max_receive_depth,
+                              'store': self.store_queue.qsize(),
+                              'store_max': self.max_store_depth,
+                              'wal_pending_bytes': self.wal.pending()}
+        return snapshot
+
+#=======================================================================
+#
+#    P R I V A T E   F U N C T I O N S
+#
+#    Not to be Called Directly from outside class
+#
+#=======================================================================
+
+    def _radio_stage(self):
+        # Receive each packet and queue a copy, as the message is a view onto the receive buffer
+        while self.running.is_set():
+            message = self.comms.receivetimeout(POLL_TIME)
+            if len(message) == 0:
+                continue
+            item = (bytes(message), time.time(), time.perf_counter_ns())
+            if self._put(self.receive_queue, item, EVT_RECEIVE_FULL, self._decode_stopped) == False:
+                break
+            self.max_receive_depth = max(self.max_receive_depth, self.receive_queue.qsize())
+        return
+
+    def _decode_stage(self):
+        # Decode each packet, log any new records and send the reply, then queue the records
+        # Carries on until the radio stage has stopped and the receive queue is empty
+        try:
+            self._decode_packets()
+        finally:
+            self.decode_done.set()
+        return
+
+    def _decode_packets(self):
+        while self.running.is_set() or self.receive_queue.qsize() > 0:
+            try:
+                message, received_time, received = self.receive_queue.get(timeout=POLL_TIME)
+            except queue.Empty:
+                continue
+            self.stats.record(STAGE_RECEIVE_QUEUE, True, received)
+
+            entry = None
+            try:
+                starttime = time.perf_counter_ns()
+                self.hub.decode_and_respond(message)
+                self.stats.record(STAGE_DECODE, True, starttime)
+
+                if self.hub.reply_new_data() and self.hub.reply_payload_len() > 0:
+                    records = [bytes(record) for record in self.hub.reply_records()]
+                    node = self.hub.frame.src
+                    starttime = time.perf_counter_ns()
+                    position = self.wal.append(records, node, received_time)
+                    self.stats.record(STAGE_WAL, position is not None, starttime)
+                    if position is None:
+                        # Without the log, the records are stored before the Ack, as the hub used to
+                        self.stats.count(EVT_WAL_FAILED)
+                        self._store_records(records, node, received_time)
+                    else:
+                        entry = (position, node, received_time, records)
+
+                if self.hub.reply_status():
+                    status = self.comms.transmit(self.hub.reply())
+                    self.stats.record(STAGE_ACK, status != False, received)
+            except Exception:
+                # The packet is dropped, any records already in the log are still queued to be stored
+                self.log.exception("[HPL]: Unable to handle a packet, it is dropped")
+                self.stats.count(EVT_DECODE_FAILED)
+
+            if entry is not None:
+                # Waits for room if the store has fallen behind, while it is still running
+                self._put(self.store_queue, entry + (time.perf_counter_ns(),), EVT_STORE_FULL, self.store_done.is_set)
+                self.max_store_depth = max(self.max_store_depth, self.store_queue.qsize())
+        return
+
+    def _store_stage(self):
+        # Store the records left in the log, then each entry queued, until the decode stage has
+        # stopped and the store queue is empty
+        try:
+            self._store_entries()
+        finally:
+            self.store_done.set()
+        return
+
+    def _store_entries(self):
+        for position, node, received_time, records in self.replay:
+            self.stats.count(EVT_REPLAYED)
+            if self._store_records(records, node, received_time) == False:
+                return
+            self._stored(position)
+        self.replay = []
+        while self.decode_done.is_set() == False or self.store_queue.qsize() > 0:
+            try:
+                position, node, received_time, records, queued = self.store_queue.get(timeout=POLL_TIME)
+            except queue.Empty:
+                self._stored(None)
+                continue
+            self.stats.record(STAGE_STORE_QUEUE, True, queued)
+            starttime = time.perf_counter_ns()
+            if self._store_records(records, node, received_time) == False:
+                # Stopped before they could be stored, they are still in the log
+                return
+            self.stats.record(STAGE_STORE, True, starttime)
+            self._stored(position)
+        self._stored(None, force=True)
+        return
+
+    def _stored(self, position, force=False):
+        # Mark the records up to the position in the log as stored, once the store has committed them
+        # With no position, any records waiting to be committed are checked again
+        if position is not None:
+            self.uncommitted = position
+        if self.uncommitted is None:
+            return
+        if self.store_commit is None or self.store_commit(force):
+            self.wal.stored(self.uncommitted)
+            self.uncommitted = None
+        return
+
+    def _store_records(self, records, node, received_time):
+        # Store each record, trying again until it is stored, returns False if the pipeline was
+        # stopped before they could all be stored
+        for record in records:
+            while True:
+                try:
+                    if self.store(record, node, received_time) != False:
+                        break
+                    self.log.warning("[HPL]: Unable to store a record, trying again")
+                except Exception:
+                    self.log.exception("[HPL]: Unable to store a record, trying again")
+                self.stats.count(EVT_STORE_FAILED)
+                if self.running.is_set() == False:
+                    return False
+                time.sleep(STORE_RETRY_WAIT)
+        return True
+
+    def _put(self, to_queue, item, event, give_up):
+        # Put the item in the queue, counting the event if it has to wait for room
+        # Gives up waiting if give_up() returns True, e.g. the next stage has stopped, returns False if so
+        try:
+            to_queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.stats.count(event)
+        while True:
+            try:
+                to_queue.put(item, timeout=POLL_TIME)
+                return True
+            except queue.Full:
+                if give_up():
+                    return False
+
+    def _decode_stopped(self):
+        # True if the pipeline is being stopped or the decode stage has stopped
+        return self.running.is_set() == False or self.decode_done.is_set()
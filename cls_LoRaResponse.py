@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Bostin Technology  (see www.CognIoT.eu)
+
+Streaming parser for the replies sent back by the LoRa module over the UART
+
+Every reply from the module ends with the '>' prompt, apart from the '$' prompt that asks
+for the data after an AT+X command. Replies look like
+    \r\nOK00>               - Command accepted
+    \r\nERxx>               - Command failed with an error code
+    1A\r\nOK00>             - Text (e.g. the AT+r length) followed by the status
+    \r\n$                   - Ready for the data to be sent
+    <n bytes>\r\nOK00>      - A data frame from AT+A, where n is given by AT+r
+
+Bytes are fed in as they arrive and complete responses are taken out, any bytes after
+the end of a response are kept for the next one. Data frames are returned as a memoryview
+onto the receive buffer, so the frame is not copied on its way to the caller.
+"""
+
+import logging
+
+# The types of response returned by the parser
+RESP_OK = 'OK'              # Status of OK00 before the > prompt
+RESP_ERROR = 'ERROR'        # Any other status code before the > prompt
+RESP_DOLLAR = 'DOLLAR'      # The $ prompt, asking for the data to send
+RESP_DATA = 'DATA'          # A data frame of known length followed by OK00
+RESP_PROMPT = 'PROMPT'      # A > prompt without a status code, e.g. the wake-up reply
+RESP_TIMEOUT = 'TIMEOUT'    # Not created by the parser, used when the reply doesn't arrive in time
+
+PROMPT = b'>'
+DOLLAR = b'$'
+OK_CODE = b'OK00'
+STATUS_LEN = 4              # The length of the status code before the > prompt
+LINE_END = b'\r\n'
+OK_REPLY = LINE_END + OK_CODE + PROMPT      # The status after a data frame when all is well
+
+# The size of the receive buffer, room for several of the largest replies (255 bytes of data
+# plus the status) so a data frame returned is not overwritten before the next receive
+RX_BUFFER_SIZE = 4096
+
+# The value of a byte, used to check the status code is 2 letters followed by 2 digits
+_LETTERS = frozenset(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+_DIGITS = frozenset(b'0123456789')
+
+
+class LoRaResponse:
+    """
+    A single reply from the LoRa module
+
+    kind    - one of the RESP_ types
+    code    - the status code, e.g. b'OK00', or b'' if there isn't one
+    data    - the text before the status, or the data frame for RESP_DATA
+    raw     - all the bytes that made up the reply
+    """
+
+    def __init__(self, kind, code=b'', data=b'', raw=b''):
+        self.kind = kind
+        self.code = code
+        self.data = data
+        self.raw = raw
+        return
+
+    def __repr__(self):
+        return "LoRaResponse(%s, code=%s, data=%s)" % (self.kind, self.code, bytes(self.data))
+
+
+class LoRaResponseParser:
+    """
+    Collects the bytes read from the LoRa module and splits them into LoRaResponse objects
+
+    The bytes are held in a buffer allocated once, used as a ring. Bytes are either read straight
+    into it using read_space() and commit(), or copied in using feed(). The data frame in a
+    RESP_DATA response is a memoryview onto the buffer rather than a copy, so it is only valid
+    until the buffer wraps round, which is never before the next receive. Use bytes() on it if it
+    needs to be kept.
+
+    feed(data)                  adds the bytes read from the serial port
+    read_space(size)            returns a memoryview of the free space to read into
+    commit(count)               adds the count bytes read into the read_space
+    next_response(...)          returns the next complete response, or None if more bytes are needed
+    clear()                     throws away any bytes held, e.g. after a timeout
+    """
+
+    def __init__(self, size=RX_BUFFER_SIZE):
+        self.log = logging.getLogger()
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._start = 0                     # The first byte not yet returned in a response
+        self._end = 0                       # The byte after the last one read in
+        return
+
+    def feed(self, data):
+        # Copy the bytes read from the serial port into the buffer
+        size = len(data)
+        space = self.read_space(size)
+        if size > len(space):
+            self.log.warning("[LRP]: %s bytes is more than the receive buffer can hold, dropped" % size)
+            return
+        space[:size] = data
+        self.commit(size)
+        return
+
+    def read_space(self, size=1):
+        # Return a memoryview of the free space at the end of the buffer to read into
+        # When there is less than size bytes free, the bytes held are moved to the start
+        if len(self._buffer) - self._end < size:
+            self._compact()
+        return self._view[self._end:]
+
+    def commit(self, count):
+        # Mark count bytes read into the space from read_space as held
+        self._end = self._end + count
+        return
+
+    def pending(self):
+        # The number of bytes held that have not been returned in a response
+        return self._end - self._start
+
+    def clear(self):
+        # Throw away anything held, returning it so it can be logged
+        leftover = bytes(self._view[self._start:self._end])
+        self._start = self._end
+        return leftover
+
+    def next_response(self, data_len=None, dollar=False):
+        # Return the next complete response from the buffer, or None if it isn't all there yet
+        # data_len is the length of the data frame expected before the status (AT+A)
+        # dollar is set when the $ prompt is expected (AT+X)
+        if data_len is not None:
+            return self._data_response(data_len)
+
+        buf = self._buffer
+        end = buf.find(PROMPT, self._start, self._end)
+        if dollar:
+            posn = buf.find(DOLLAR, self._start, self._end)
+            if posn >= 0 and (end < 0 or posn < end):
+                raw = self._take(posn + 1)
+                return LoRaResponse(RESP_DOLLAR, raw=bytes(raw))
+        if end < 0:
+            self._check_full()
+            return None
+
+        raw = bytes(self._take(end + 1))
+        return self._status_response(raw, raw[:-1])
+
+#=======================================================================
+#
+#    P R I V A T E   F U N C T I O N S
+#
+#    Not to be Called Directly from outside class
+#
+#=======================================================================
+
+    def _take(self, end):
+        # Return a memoryview of the held bytes up to end, which are then no longer held
+        taken = self._view[self._start:end]
+        self._start = end
+        return taken
+
+    def _compact(self):
+        # Move the bytes held to the start of the buffer, so there is room to read in more
+        # They are copied out first as the old and new positions can overlap
+        held = bytes(self._view[self._start:self._end])
+        self._view[0:len(held)] = held
+        self._start = 0
+        self._end = len(held)
+        return
+
+    def _check_full(self):
+        # If the buffer is full without a complete response, it is never going to complete
+        if self._start == 0 and self._end == len(self._buffer):
+            self.log.warning("[LRP]: Receive buffer full without a response, cleared")
+            self.clear()
+        return
+
+    def _data_response(self, data_len):
+        # A data frame can contain any byte value, including > and $, so the first data_len
+        # bytes are taken as the frame and only then is the status searched for, even if the frame
+        # starts like an error reply. An error instead of the frame is left to the receive timeout
+        start = self._start
+        if self._end - start < data_len:
+            self._check_full()
+            return None
+        if self._buffer.startswith(OK_REPLY, start + data_len, self._end):
+            # The usual case, the frame is followed by OK00 so only the frame needs a view
+            data = self._view[start:start + data_len]
+            self._start = start + data_len + len(OK_REPLY)
+            return LoRaResponse(RESP_DATA, code=OK_CODE, data=data, raw=data)
+        end = self._buffer.find(PROMPT, start + data_len, self._end)
+        if end < 0:
+            self._check_full()
+            return None
+
+        raw = self._take(end + 1)
+        response = self._status_response(raw, bytes(raw[data_len:-1]))
+        if response.kind == RESP_OK:
+            response.kind = RESP_DATA
+            response.data = raw[:data_len]
+        return response
+
+    def _status_response(self, raw, text):
+        # Split the text before the > prompt into the status code and anything before it
+        text = text.strip(LINE_END)
+        code = text[-STATUS_LEN:]
+        if len(code) < STATUS_LEN or not self._is_status(code):
+            return LoRaResponse(RESP_PROMPT, data=text, raw=raw)
+        data = text[:-STATUS_LEN].strip(LINE_END)
+        if code == OK_CODE:
+            return LoRaResponse(RESP_OK, code=code, data=data, raw=raw)
+        self.log.debug("[LRP]: Error code %s received from the LoRa module" % code)
+        return LoRaResponse(RESP_ERROR, code=code, data=data, raw=raw)
+
+    def _is_status(self, code):
+        # A status code is 2 capital letters followed by 2 digits, e.g. OK00
+        return code[0] in _LETTERS and code[1] in _LETTERS and code[2] in _DIGITS and code[3] in _DIGITS
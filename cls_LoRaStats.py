@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Bostin Technology  (see www.CognIoT.eu)
+
+Running statistics for the exchanges with the LoRa module, so a slow hub can be traced to the
+UART, the module or the code without parsing the logs.
+
+For each command type there is a count of successes and failures and a latency histogram. The
+histogram buckets are powers of 2 nanoseconds, bucket n holding the latencies from 2^(n-1) up to
+2^n ns, so recording is a bit_length and a list index with no search or allocation.
+
+There are also simple counters for events, e.g. the serial port being flushed.
+
+Recording is not locked, LoRaComms only records while holding its uart_lock, apart from the data
+pin wait which is only made by the receiving thread.
+
+LoRaStats can be given other command types and events, cls_HubPipeline uses it for the latency of
+each stage of the hub, each stage being recorded only by its own thread.
+"""
+
+import time
+
+# The command types that latencies are recorded for
+CMD_SEND = 'AT+X'               # AT+X up to the $ prompt
+CMD_PAYLOAD = 'payload'         # The payload write up to the OK00
+CMD_LENGTH = 'AT+r'             # AT+r up to the length reply
+CMD_RECEIVE = 'AT+A'            # AT+A up to the end of the data frame
+CMD_CONFIG = 'config'           # Any of the configuration commands, each try
+CMD_GPIO_WAIT = 'gpio_wait'     # The wait for the data pin
+
+# The event counters
+EVT_FLUSH = 'flush'                     # The serial port and parser buffer were cleared of unexpected data
+EVT_SHORT_REPLY = 'short_reply'         # A reply that was incomplete or timed out
+EVT_NEGATIVE_REPLY = 'negative_reply'   # A reply with an error status, e.g. ER02
+
+# The command types and events recorded for LoRaComms
+COMMANDS = (CMD_SEND, CMD_PAYLOAD, CMD_LENGTH, CMD_RECEIVE, CMD_CONFIG, CMD_GPIO_WAIT)
+EVENTS = (EVT_FLUSH, EVT_SHORT_REPLY, EVT_NEGATIVE_REPLY)
+
+# Number of histogram buckets, the last one holds everything from 2^(HISTOGRAM_BUCKETS-2) ns
+# upwards, 2^36 ns is just over 68s which is longer than any wait
+HISTOGRAM_BUCKETS = 37
+
+
+class CommandStats:
+    """
+    The counts and latency histogram for a single command type, recorded by LoRaStats.record
+    """
+    __slots__ = ('counts', 'total_ns', 'max_ns', 'buckets')
+
+    def __init__(self):
+        self.counts = [0, 0]                # Failed, ok, indexed by the status
+        self.total_ns = 0
+        self.max_ns = 0
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        return
+
+    def snapshot(self):
+        # Return the figures as a dictionary, latencies are in microseconds
+        # buckets is a dictionary of the upper limit of each bucket in use to its count
+        failed, ok = self.counts
+        count = ok + failed
+        buckets = {}
+        for bucket, hits in enumerate(self.buckets):
+            if hits > 0:
+                buckets[(1 << bucket) / 1000] = hits
+        return {'ok': ok,
+                'failed': failed,
+                'count': count,
+                'mean_us': self.total_ns / count / 1000 if count > 0 else 0,
+                'max_us': self.max_ns / 1000,
+                'p50_us': self._percentile(count, 0.5),
+                'p99_us': self._percentile(count, 0.99),
+                'buckets': buckets}
+
+    def _percentile(self, count, fraction):
+        # Return the upper limit of the bucket holding the given fraction of the latencies, no more
+        # than the longest latency as that is in the last bucket used
+        if count == 0:
+            return 0
+        wanted = count * fraction
+        seen = 0
+        for bucket, hits in enumerate(self.buckets):
+            seen = seen + hits
+            if seen >= wanted:
+                return min(1 << bucket, self.max_ns) / 1000
+        return self.max_ns / 1000
+
+
+class LoRaStats:
+    """
+    The statistics for all the commands and events
+
+    record(command, status, starttime)  records the command from starttime (time.perf_counter_ns)
+    count(event)                        adds one to the event counter
+    snapshot()                          returns all the figures as a dictionary
+    reset()                             clears all the figures
+
+    The command types and events default to those of LoRaComms
+    """
+
+    def __init__(self, commands=COMMANDS, events=EVENTS):
+        self.command_types = commands
+        self.event_types = events
+        self.reset()
+        return
+
+    def reset(self):
+        # Start all the figures again from zero
+        self.commands = {}
+        for command in self.command_types:
+            self.commands[command] = CommandStats()
+        self.events = {}
+        for event in self.event_types:
+            self.events[event] = 0
+        self.started = time.monotonic()
+        return
+
+    def record(self, command, status, starttime):
+        # Record the command, started at starttime from time.perf_counter_ns(), as finished now
+        # status is True if it succeeded. This is in the path of every exchange, so is kept short
+        latency = time.perf_counter_ns() - starttime
+        stats = self.commands[command]
+        stats.counts[status] += 1
+        stats.total_ns += latency
+        bucket = latency.bit_length()
+        if bucket >= HISTOGRAM_BUCKETS:
+            bucket = HISTOGRAM_BUCKETS - 1
+        stats.buckets[bucket] += 1
+        if latency > stats.max_ns:
+            stats.max_ns = latency
+        return
+
+    def count(self, event):
+        # Add one to the event counter
+        self.events[event] += 1
+        return
+
+    def snapshot(self):
+        # Return all the figures, copied so they don't change as further exchanges are made
+        snapshot = {'period': time.monotonic() - self.started,
+                    'events': dict(self.events)}
+        for command, stats in self.commands.items():
+            snapshot[command] = stats.snapshot()
+        return snapshot
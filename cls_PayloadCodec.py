@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Bostin Technology  (see www.CognIoT.eu)
+
+Compression of the payload of data and aggregate packets, agreed by the node and hub at association.
+
+The node sends the codecs it supports as a mask, bit n set for codec n, in the second byte of the
+association request, after the window, and the hub replies with the codecs both support in the
+second byte of the association response. The node then compresses each payload with whichever of
+the agreed codecs gives the smallest result, and sends the codec number in the CODEC_MASK bits of
+the destination control byte so the hub knows how to decompress it.
+
+    CODEC_NONE          The payload as it is, always supported and used for tiny payloads
+    CODEC_ZLIB_RECORDS  Raw deflate, without the zlib header and checksum as LoRa has its own CRC,
+                        using RECORD_DICTIONARY so even a single record compresses
+
+The dictionary is part of the codec, so if it is ever changed it must be given a new codec number,
+otherwise a hub and node with different dictionaries can't read each other's packets.
+
+A CodecStats at each end counts the packets, bytes and CPU time for each codec, so the time the
+compression takes can be weighed against the airtime it saves.
+"""
+
+import logging
+import time
+import zlib
+
+# The codec numbers, sent in the destination control byte of each packet
+CODEC_NONE = 0
+CODEC_ZLIB_RECORDS = 1
+
+# The names of the codecs, used in the statistics
+CODEC_NAMES = {CODEC_NONE: 'none', CODEC_ZLIB_RECORDS: 'zlib_records'}
+
+# The mask of the codecs supported by this version, CODEC_NONE isn't in the mask as it always is
+SUPPORTED_CODECS = 1 << CODEC_ZLIB_RECORDS
+
+# Payloads shorter than this are always sent as they are
+MIN_COMPRESS_LEN = 8
+
+# The largest payload the hub will decompress, so a bad packet can't use up its memory
+MAX_DECOMPRESSED_LEN = 4096
+
+# Raw deflate with the largest window, and the compression level
+ZLIB_WBITS = -15
+ZLIB_LEVEL = 9
+
+# Records as written by TestFileGenerator and the other sensors, with the most common ones last as
+# deflate finds the nearest match first
+RECORD_DICTIONARY = (
+    b'[[15, 100, "count", "2026-10-18 10:00:00"]][[12, 1000, "rpm", "2026-10-18 10:00:00"]]'
+    b'[[9, 45.5, "dB", "2026-10-18 10:00:00"]][[8, 20, "mA", "2026-10-18 10:00:00"]]'
+    b'[[6, 400, "ppm", "2026-10-18 10:00:00"]][[5, 1013.2, "hPa", "2026-10-18 10:00:00"]]'
+    b'[[7, 3.3, "V", "2026-10-18 10:00:00"]][[3, 70.5, "F", "2026-10-18 10:00:00"]]'
+    b'[[4, 55, "%", "2026-10-18 10:00:00.000"]]'
+    b'[[2, 21.5, "C", "2026-10-18 10:00:00.000"]]'
+    b'[[1, 50, "Lux", "2026-10-18 10:00:00.000"]]'
+    b'[[1, 42, "Lux", "2026-10-18 10:00:00.123"]]')
+
+_log = logging.getLogger()
+
+
+class CodecStats:
+    """
+    The packets, bytes and CPU time for each codec
+
+    record(codec, original, sent, cpu_ns)   records a payload of original bytes sent as sent bytes
+    snapshot()                              returns the figures for each codec as a dictionary
+    reset()                                 clears all the figures
+
+    On the node the CPU time of a codec includes the payloads where it was tried but not used, on
+    the hub it is the time taken to decompress.
+    """
+
+    def __init__(self):
+        self.reset()
+        return
+
+    def reset(self):
+        # Start all the figures again from zero
+        # For each codec, the packets, original bytes, bytes sent and CPU time in ns
+        self.codecs = {}
+        for codec in CODEC_NAMES:
+            self.codecs[codec] = [0, 0, 0, 0]
+        self.started = time.monotonic()
+        return
+
+    def record(self, codec, original, sent, cpu_ns=0):
+        # Record a payload of original bytes that was sent as sent bytes with the codec
+        counts = self.codecs[codec]
+        counts[0] += 1
+        counts[1] += original
+        counts[2] += sent
+        counts[3] += cpu_ns
+        return
+
+    def snapshot(self):
+        # Return the figures for each codec, by name
+        snapshot = {'period': time.monotonic() - self.started}
+        for codec, (packets, original, sent, cpu_ns) in self.codecs.items():
+            snapshot[CODEC_NAMES[codec]] = {'packets': packets,
+                                            'original_bytes': original,
+                                            'sent_bytes': sent,
+                                            'saved_bytes': original - sent,
+                                            'cpu_ms': cpu_ns / 1000000}
+        return snapshot
+
+
+def agree_codecs(codecs):
+    # Return the mask of the codecs in the given mask that are also supported here
+    return codecs & SUPPORTED_CODECS
+
+def compress(payload, codecs, stats=None):
+    # Return the codec and the payload compressed with whichever of the codecs in the mask gives the
+    # smallest result, CODEC_NONE and the payload if none of them make it smaller
+    best_codec = CODEC_NONE
+    best = payload
+    if len(payload) >= MIN_COMPRESS_LEN and codecs & (1 << CODEC_ZLIB_RECORDS):
+        starttime = time.thread_time_ns()
+        compressor = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, ZLIB_WBITS, zdict=RECORD_DICTIONARY)
+        compressed = compressor.compress(payload) + compressor.flush()
+        if stats is not None:
+            # The time is counted whether or not the result is used
+            stats.codecs[CODEC_ZLIB_RECORDS][3] += time.thread_time_ns() - starttime
+        if len(compressed) < len(best):
+            best_codec = CODEC_ZLIB_RECORDS
+            best = compressed
+    if stats is not None:
+        stats.record(best_codec, len(payload), len(best))
+    return best_codec, best
+
+def decompress(codec, payload, stats=None):
+    # Return the payload sent with the codec, or None if the codec isn't supported or the payload
+    # isn't valid for it
+    if codec == CODEC_NONE:
+        if stats is not None:
+            stats.record(CODEC_NONE, len(payload), len(payload))
+        return payload
+    if codec != CODEC_ZLIB_RECORDS:
+        _log.info("[PLC]: Unsupported codec:%s" % codec)
+        return None
+    starttime = time.thread_time_ns()
+    decompressor = zlib.decompressobj(ZLIB_WBITS, zdict=RECORD_DICTIONARY)
+    try:
+        data = decompressor.decompress(payload, MAX_DECOMPRESSED_LEN)
+    except zlib.error:
+        _log.info("[PLC]: Unable to decompress the payload")
+        return None
+    if decompressor.eof == False or len(decompressor.unconsumed_tail) > 0:
+        _log.info("[PLC]: Compressed payload is incomplete or too long")
+        return None
+    if stats is not None:
+        stats.record(codec, len(data), len(payload), time.thread_time_ns() - starttime)
+    return data
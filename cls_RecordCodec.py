@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Bostin Technology  (see www.CognIoT.eu)
+
+A compact binary encoding of the sensor records sent from a node to the hub
+
+The records are written by the sensors as JSON text, a list of readings
+    [[type, value, units, timestamp], [type, value, units, timestamp]]
+    e.g. [[1, 42, "Lux", "2017-10-18 10:00:00.123"]]
+
+In the binary format the record is a format byte followed by 12 bytes for each reading
+
+    Bytes  - Meaning
+    ====== - =======
+    0      - Sensor type id
+    1      - Unit code from UNIT_CODES, with VALUE_FLOAT set and the number of decimal places
+             if the value is a float
+    2 - 5  - Value, signed 32 bit integer, multiplied by 10 to the decimal places for a float
+    6 - 9  - Timestamp, seconds since RECORD_EPOCH
+    10 - 11 - Milliseconds, NO_FRACTION if the timestamp had none
+
+encode_record only returns the binary record if decode_record gives back exactly the same text,
+otherwise it returns None and the record is sent as text. The format byte is never the start of
+JSON text, so the hub can tell the two apart.
+
+A delta block holds a run of records of one reading each, as sent by a node with a backlog. The
+first reading is in full, each of the others is the change from the one before
+
+    Bytes  - Meaning
+    ====== - =======
+    0      - DELTA_FORMAT
+    1 - 12 - The first reading, as in a binary record
+    13 - n - A step for each of the other readings, either
+             a step byte with DELTA_RUN clear, followed by the sensor type if STEP_TYPE is set, the
+             unit byte if STEP_UNIT is set, then the change in the value and the change in the
+             time in milliseconds, each as a zigzag varint, or
+             a step byte with DELTA_RUN set, the last change repeated (low 7 bits + 1) times
+
+STEP_NO_FRACTION in the step byte is set if the timestamp has no fraction of a second. The block
+doesn't depend on any other packet, so nothing is lost if a packet is dropped or the hub restarts,
+the encoder starts again from a full reading in each packet.
+"""
+
+import json
+import logging
+import struct
+from datetime import datetime
+from datetime import timedelta
+
+# The first byte of a binary record
+RECORD_FORMAT_BINARY = 0xb1
+
+# A single reading
+READING = struct.Struct('>BBiIH')
+
+# Timestamps are held as the offset from this time
+RECORD_EPOCH = datetime(2017, 1, 1)
+
+# The format of the timestamps in the records, as written by str(datetime.now())[:23]
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# The milliseconds for a timestamp with no fraction of a second
+NO_FRACTION = 0xffff
+
+# The unit byte, the unit code and for a float value the flag and the decimal places
+VALUE_FLOAT = 0x80
+DECIMALS_SHIFT = 5
+MAX_DECIMALS = 3
+UNIT_MASK = 0x1f
+
+# The units that can be sent, code 0 is no units
+UNIT_CODES = {'': 0,
+              'Lux': 1,
+              'C': 2,
+              'F': 3,
+              '%': 4,
+              'hPa': 5,
+              'ppm': 6,
+              'V': 7,
+              'mA': 8,
+              'dB': 9,
+              'm': 10,
+              'g': 11,
+              'rpm': 12,
+              'Pa': 13,
+              'W': 14,
+              'count': 15}
+UNIT_NAMES = {code: name for name, code in UNIT_CODES.items()}
+
+# The first byte of a delta block
+DELTA_FORMAT = 0xd1
+
+# The step byte of a delta block
+DELTA_RUN = 0x80
+STEP_TYPE = 0x01
+STEP_UNIT = 0x02
+STEP_NO_FRACTION = 0x04
+MAX_RUN = 0x80
+
+# The range of the seconds and the value
+MAX_SECONDS = 0xffffffff
+MIN_VALUE = -0x80000000
+MAX_VALUE = 0x7fffffff
+
+_log = logging.getLogger()
+
+
+def is_binary_record(payload):
+    # True if the payload is a binary record rather than text
+    return len(payload) > 0 and payload[0] == RECORD_FORMAT_BINARY
+
+def encode_record(text):
+    # Return the binary record for the JSON text, or None if it can't be encoded without changing it
+    try:
+        readings = json.loads(text)
+    except ValueError:
+        return None
+    if isinstance(readings, list) == False or len(readings) == 0:
+        return None
+    parts = [bytes((RECORD_FORMAT_BINARY,))]
+    for reading in readings:
+        packed = _pack_reading(reading)
+        if packed is None:
+            return None
+        parts.append(packed)
+    record = b''.join(parts)
+    # Only use the binary record if the hub will get back exactly the same text
+    if decode_record(record) != text:
+        _log.debug("[RCD]: Record can't be encoded without changing it, sent as text")
+        return None
+    return record
+
+def decode_record(record):
+    # Return the JSON text of the binary record, or None if it isn't a valid binary record
+    if is_binary_record(record) == False or (len(record) - 1) % READING.size != 0:
+        return None
+    readings = []
+    for fields in READING.iter_unpack(record[1:]):
+        reading = _unpack_reading(*fields)
+        if reading is None:
+            return None
+        readings.append(reading)
+    return json.dumps(readings)
+
+def is_delta_block(payload):
+    # True if the payload is a delta block
+    return len(payload) > 0 and payload[0] == DELTA_FORMAT
+
+def decode_delta_block(block):
+    # Return the JSON text of each record in the delta block, or None if it isn't valid
+    if is_delta_block(block) == False or len(block) < READING.size + 1:
+        return None
+    block = bytes(block)
+    sensor_type, unit, value, seconds, milliseconds = READING.unpack_from(block, 1)
+    no_fraction = milliseconds == NO_FRACTION
+    time_ms = seconds * 1000 + (0 if no_fraction else milliseconds)
+    value_change = 0
+    time_change = 0
+    fields = [(sensor_type, unit, value, time_ms, no_fraction)]
+    position = READING.size + 1
+    try:
+        while position < len(block):
+            step = block[position]
+            position = position + 1
+            if step & DELTA_RUN:
+                repeats = (step & ~DELTA_RUN) + 1
+            else:
+                if step & STEP_TYPE:
+                    sensor_type = block[position]
+                    position = position + 1
+                if step & STEP_UNIT:
+                    unit = block[position]
+                    position = position + 1
+                no_fraction = bool(step & STEP_NO_FRACTION)
+                value_change, position = _read_varint(block, position)
+                time_change, position = _read_varint(block, position)
+                repeats = 1
+            for repeat in range(0, repeats):
+                value = value + value_change
+                time_ms = time_ms + time_change
+                fields.append((sensor_type, unit, value, time_ms, no_fraction))
+    except IndexError:
+        return None
+    records = []
+    for sensor_type, unit, value, time_ms, no_fraction in fields:
+        seconds, milliseconds = divmod(time_ms, 1000)
+        if no_fraction:
+            milliseconds = NO_FRACTION
+        reading = _unpack_reading(sensor_type, unit, value, seconds, milliseconds)
+        if reading is None:
+            return None
+        records.append(json.dumps([reading]))
+    return records
+
+
+class DeltaEncoder:
+    """
+    Builds a delta block from records of one reading each, up to a limit on the size of the block
+
+    add(text)       adds the record, returns False if it can't be added, e.g. the block is full
+    block()         returns the delta block
+    count           the number of records in the block
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.parts = bytearray()
+        self.count = 0
+        self._last = None               # The type, unit, value, time and no fraction of the last reading
+        self._change = None             # The last change in the value and time
+        self._run_at = None             # The position of the step byte of the current run
+        return
+
+    def add(self, text):
+        # Add the record to the block if it can be encoded and fits
+        record = encode_record(text)
+        if record is None or len(record) != READING.size + 1:
+            return False
+        sensor_type, unit, value, seconds, milliseconds = READING.unpack_from(record, 1)
+        no_fraction = milliseconds == NO_FRACTION
+        time_ms = seconds * 1000 + (0 if no_fraction else milliseconds)
+        if self._last is None:
+            if len(record) > self.limit:
+                return False
+            self.parts = bytearray((DELTA_FORMAT,)) + record[1:]
+        else:
+            last_type, last_unit, last_value, last_time, last_no_fraction = self._last
+            change = (value - last_value, time_ms - last_time)
+            if (change == self._change and sensor_type == last_type and unit == last_unit and
+                    no_fraction == last_no_fraction and self._run_at is not None and
+                    self.parts[self._run_at] < DELTA_RUN + MAX_RUN - 1):
+                # Another repeat of the current run
+                self.parts[self._run_at] = self.parts[self._run_at] + 1
+            elif (change == self._change and sensor_type == last_type and unit == last_unit and
+                    no_fraction == last_no_fraction):
+                # Start a run repeating the last change
+                if len(self.parts) + 1 > self.limit:
+                    return False
+                self._run_at = len(self.parts)
+                self.parts.append(DELTA_RUN)
+            else:
+                step = bytearray(1)
+                if sensor_type != last_type:
+                    step[0] = step[0] | STEP_TYPE
+                    step.append(sensor_type)
+                if unit != last_unit:
+                    step[0] = step[0] | STEP_UNIT
+                    step.append(unit)
+                if no_fraction:
+                    step[0] = step[0] | STEP_NO_FRACTION
+                step += _varint(change[0]) + _varint(change[1])
+                if len(self.parts) + len(step) > self.limit:
+                    return False
+                self.parts += step
+                self._change = change
+                self._run_at = None
+        self._last = (sensor_type, unit, value, time_ms, no_fraction)
+        self.count = self.count + 1
+        return True
+
+    def block(self):
+        return bytes(self.parts)
+
+
+def _unpack_reading(sensor_type, unit, value, seconds, milliseconds):
+    # Return the reading for the fields of a binary reading, or None if they aren't valid
+    if unit & VALUE_FLOAT:
+        value = value / 10 ** ((unit >> DECIMALS_SHIFT) & MAX_DECIMALS)
+    units = UNIT_NAMES.get(unit & UNIT_MASK)
+    if units is None or seconds < 0 or seconds > MAX_SECONDS:
+        return None
+    timestamp = (RECORD_EPOCH + timedelta(seconds=seconds)).strftime(TIMESTAMP_FORMAT)
+    if milliseconds != NO_FRACTION:
+        timestamp = "%s.%03d" % (timestamp, milliseconds)
+    return [sensor_type, value, units, timestamp]
+
+def _varint(number):
+    # Return the number as a zigzag varint, 7 bits in each byte with the top bit set if more follow
+    number = (number << 1) ^ (number >> 63) if number < 0 else number << 1
+    encoded = bytearray()
+    while number > 0x7f:
+        encoded.append((number & 0x7f) | 0x80)
+        number = number >> 7
+    encoded.append(number)
+    return encoded
+
+def _read_varint(data, position):
+    # Return the zigzag varint at the position and the position after it
+    number = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position = position + 1
+        number = number | ((byte & 0x7f) << shift)
+        shift = shift + 7
+        if byte & 0x80 == 0:
+            break
+    return (number >> 1) ^ -(number & 1), position
+
+def _pack_reading(reading):
+    # Return the 12 bytes for the reading, or None if it doesn't fit the binary format
+    if isinstance(reading, list) == False or len(reading) != 4:
+        return None
+    sensor_type, value, units, timestamp = reading
+    if isinstance(sensor_type, int) == False or sensor_type < 0 or sensor_type > 0xff:
+        return None
+    unit = UNIT_CODES.get(units) if isinstance(units, str) else None
+    if unit is None:
+        return None
+    if isinstance(value, bool):
+        return None
+    elif isinstance(value, float):
+        # Held as a whole number with the fewest decimal places that give the value back
+        for decimals in range(0, MAX_DECIMALS + 1):
+            scaled = value * 10 ** decimals
+            if scaled != scaled or abs(scaled) > MAX_VALUE:
+                return None
+            if round(scaled) / 10 ** decimals == value:
+                break
+        else:
+            return None
+        value = round(scaled)
+        unit = unit | VALUE_FLOAT | (decimals << DECIMALS_SHIFT)
+    elif isinstance(value, int) == False:
+        return None
+    if value < MIN_VALUE or value > MAX_VALUE:
+        return None
+    stamp = _timestamp_offset(timestamp)
+    if stamp is None:
+        return None
+    return READING.pack(sensor_type, unit, value, stamp[0], stamp[1])
+
+def _timestamp_offset(timestamp):
+    # Return the seconds since RECORD_EPOCH and the milliseconds of the timestamp, or None
+    if isinstance(timestamp, str) == False:
+        return None
+    whole, dot, fraction = timestamp.partition('.')
+    try:
+        moment = datetime.strptime(whole, TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+    milliseconds = NO_FRACTION
+    if dot:
+        if len(fraction) != 3 or fraction.isdigit() == False:
+            return None
+        milliseconds = int(fraction)
+    delta = moment - RECORD_EPOCH
+    seconds = delta.days * 86400 + delta.seconds
+    if seconds < 0 or seconds > MAX_SECONDS:
+        return None
+    return (seconds, milliseconds)
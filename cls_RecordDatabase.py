@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Bostin Technology  (see www.CognIoT.eu)
+
+The records received by the hub kept in an SQLite database, so they can be read by node and time
+without walking RECORDFILE_LOCATION and opening every file.
+
+    CREATE TABLE records (id INTEGER PRIMARY KEY, node BLOB, received INTEGER, record BLOB)
+    CREATE INDEX records_node_received ON records (node, received)
+
+node is the 4 byte address as bytes, received the time in milliseconds since the epoch and record
+the record as received. A query for one node over a time range, e.g. the last hour, is a single
+range scan of the index however many rows there are.
+
+The database is in WAL journal mode, so other programs can read it while the hub writes, and with
+synchronous FULL so each commit is on the card. Records are inserted in a transaction that is
+committed in groups by commit(), once commit_records have been inserted or the oldest of them was
+inserted commit_ms ago, the same as cls_RecordStore.SegmentLog, so append() and commit() can be
+given to HubPipeline as the store and store_commit.
+
+expire(before) deletes the records received before the time. As the rows are inserted in the order
+received, the expired ones are the rows at the start of the table, and are deleted as a range of
+the primary key in batches of EXPIRE_BATCH rows, each in its own transaction, so the hub is only
+held up for one batch at a time.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+
+# The default database file
+RECORD_DATABASE = "records.db"
+
+# The default number of records, or milliseconds, after which the transaction is committed
+COMMIT_RECORDS = 64
+COMMIT_MS = 1000
+
+# The most rows deleted in each transaction by expire()
+EXPIRE_BATCH = 10000
+
+# The length of a node address
+ADDRESS_LEN = 4
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS records (id INTEGER PRIMARY KEY, node BLOB NOT NULL, "
+    "received INTEGER NOT NULL, record BLOB NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS records_node_received ON records (node, received)")
+
+
+class RecordDatabase:
+    """
+    The records in the SQLite database, added in transactions committed in groups
+
+    append(record, node, received)  adds the record, returns True, or False if it can't be
+    commit(force)                   commits the records if they are due, or if force is True,
+                                    returns True if every record appended is committed
+    records(node, start, end)       returns the (time received, record) for the node between the times
+    expire(before)                  deletes the records received before the time, returns how many
+    close()                         commits the records and closes the database
+
+    Times are as from time.time(), nodes are given as strings or bytes. The methods can be called
+    from different threads, e.g. the HubPipeline store stage and the Hub_Loop.
+    """
+
+    def __init__(self, filename=RECORD_DATABASE, commit_records=COMMIT_RECORDS, commit_ms=COMMIT_MS):
+        self.log = logging.getLogger()
+        self.filename = filename
+        self.commit_records = commit_records
+        self.commit_ms = commit_ms
+        self.lock = threading.Lock()
+        self.uncommitted = 0            # The records inserted but not yet committed
+        self.first_uncommitted = 0      # When the first of them was inserted, as time.monotonic()
+        self.commits = 0                # The number of transactions committed
+        self.connection = None
+        try:
+            # Transactions are started and committed here rather than by the sqlite3 module
+            self.connection = sqlite3.connect(filename, isolation_level=None, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=FULL")
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+        except sqlite3.Error:
+            self.log.exception("[RDB]: Unable to open the record database:%s" % filename)
+            self.connection = None
+        return
+
+    def append(self, record, node, received=None):
+        # Add the record from the node, received at the time from time.time() or now if not given
+        # Returns True once it is inserted, but not necessarily committed, or False if it can't be
+        if self.connection is None:
+            return False
+        if received is None:
+            received = time.time()
+        with self.lock:
+            try:
+                if self.uncommitted == 0:
+                    self.connection.execute("BEGIN")
+                    self.first_uncommitted = time.monotonic()
+                self.connection.execute("INSERT INTO records (node, received, record) VALUES (?, ?, ?)",
+                                        (_node_key(node), int(received * 1000), bytes(record)))
+            except sqlite3.Error:
+                self.log.warning("[RDB]: Unable to insert a record into:%s" % self.filename)
+                if self.uncommitted == 0 and self.connection.in_transaction:
+                    self.connection.rollback()
+                return False
+            self.uncommitted = self.uncommitted + 1
+        return True
+
+    def commit(self, force=False):
+        # Commit the records if enough have been inserted or the oldest has waited long enough, or
+        # whatever if force is True. Returns True if there are none left to commit
+        with self.lock:
+            return self._commit(force)
+
+    def records(self, node, start=0, end=None):
+        # Return a list of the (time received, record) for the node received from start up to end,
+        # oldest first, or None if the database can't be read
+        if self.connection is None:
+            return None
+        end_ms = int(time.time() * 1000) + 1 if end is None else int(end * 1000)
+        with self.lock:
+            try:
+                rows = self.connection.execute(
+                    "SELECT received, record FROM records WHERE node = ? AND received >= ? AND received < ? "
+                    "ORDER BY received", (_node_key(node), int(start * 1000), end_ms)).fetchall()
+            except sqlite3.Error:
+                self.log.warning("[RDB]: Unable to read the records from:%s" % self.filename)
+                return None
+        return [(received / 1000, record) for received, record in rows]
+
+    def expire(self, before, batch=EXPIRE_BATCH):
+        # Delete the records received before the time, in batches of rows, returns the number deleted
+        deleted = 0
+        before_ms = int(before * 1000)
+        while True:
+            with self.lock:
+                if self.connection is None or self._commit(force=True) == False:
+                    break
+                try:
+                    # The rows at the start of the table up to the first one received since
+                    row = self.connection.execute(
+                        "SELECT min(id), max(id) FROM (SELECT id, received FROM records ORDER BY id LIMIT ?) "
+                        "WHERE received < ?", (batch, before_ms)).fetchone()
+                    if row[0] is None:
+                        break
+                    cursor = self.connection.execute("DELETE FROM records WHERE id BETWEEN ? AND ? AND received < ?",
+                                                     (row[0], row[1], before_ms))
+                except sqlite3.Error:
+                    self.log.warning("[RDB]: Unable to delete the expired records from:%s" % self.filename)
+                    break
+                deleted = deleted + cursor.rowcount
+                if cursor.rowcount < batch:
+                    break
+        if deleted > 0:
+            self.log.info("[RDB]: Deleted %s records received before:%s" % (deleted, before))
+        return deleted
+
+    def close(self):
+        # Commit the records and close the database
+        with self.lock:
+            if self.connection is not None:
+                self._commit(force=True)
+                self.connection.close()
+                self.connection = None
+        return
+
+#=======================================================================
+#
+#    P R I V A T E   F U N C T I O N S
+#
+#    Not to be Called Directly from outside class
+#
+#=======================================================================
+
+    def _commit(self, force):
+        # Commit the transaction if it is due, with the lock held
+        if self.uncommitted == 0:
+            return True
+        if force == False and self._commit_due() == False:
+            return False
+        try:
+            self.connection.execute("COMMIT")
+        except sqlite3.Error:
+            self.log.warning("[RDB]: Unable to commit the records to:%s" % self.filename)
+            return False
+        self.uncommitted = 0
+        self.commits = self.commits + 1
+        return True
+
+    def _commit_due(self):
+        # True if enough records have been inserted, or the first of them has waited long enough
+        if self.commit_records > 0 and self.uncommitted >= self.commit_records:
+            return True
+        return self.commit_ms > 0 and (time.monotonic() - self.first_uncommitted) * 1000 >= self.commit_ms
+
+
+def _node_key(node):
+    # Return the node address as bytes, as it is held in the database
+    if isinstance(node, str):
+        node = node.encode('utf-8')
+    return bytes(node[:ADDRESS_LEN]).ljust(ADDRESS_LEN)
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Bostin Technology  (see www.CognIoT.eu)
+
+An outbox of the records waiting to be sent by a node, kept in append-only queue files, as an
+alternative to a file for each record in RECORDFILE_LOCATION.
+
+The program producing the records appends them with an OutboxWriter to the newest segment,
+OUTBOX_NAME + number + OUTBOX_EXT, starting the next one when it is longer than segment_size. Each
+record in a segment is
+
+    Bytes   - Meaning
+    ======  - =======
+    0 - 3   - Length of the record
+    4 - 7   - CRC32 of the record
+    8 - n   - The record
+
+The node sends them with a RecordOutbox, which reads the records in order from a cursor, the
+position of the first record the hub hasn't acknowledged, and returns each with a tag of its
+(segment, offset). As the hub acknowledges them the cursor moves on, and is saved to the cursor
+file, with the tags of any acknowledged after a record that hasn't been, before the records are
+treated as sent. A segment is deleted whole once the cursor has passed it, rather than a file being
+deleted for each record, and after a restart the node carries on from the cursor without sending
+anything the hub has already acknowledged.
+
+Only the records in the window are held in memory, and each is read once, so adding and taking a
+record costs the same however long the backlog is.
+
+A writer that stops part way through a record leaves it incomplete at the end of the segment. When
+a writer is opened it checks the newest segment and starts the next one if the last record is
+incomplete, and the reader moves on to the next segment when it finds one. There should be only
+one writer at a time.
+"""
+
+import logging
+import os
+import struct
+import zlib
+
+# The default directory, name and extension of the segments
+OUTBOX_DIR = "."
+OUTBOX_NAME = "OUTBOX_"
+OUTBOX_EXT = ".q"
+
+# The default cursor file, in the outbox directory
+CURSOR_FILE = "outbox.cursor"
+
+# The number of digits in the number of each segment, so they sort in order
+SEGMENT_DIGITS = 10
+
+# The default size, in bytes, of a segment before the next one is started
+SEGMENT_SIZE = 1024 * 1024
+
+# The header of each record, the length and crc
+RECORD_HEADER = struct.Struct('>II')
+
+# The cursor file, the segment and offset of the cursor and the number of tags acknowledged after
+# it, followed by the segment and offset of each
+CURSOR = struct.Struct('>QQH')
+ACKED_TAG = struct.Struct('>QQ')
+
+_log = logging.getLogger()
+
+
+class OutboxWriter:
+    """
+    Appends records to the newest segment of the outbox
+
+    append(record)      adds the record, as bytes or a string, returns False if it can't
+    close()             closes the segment
+    """
+
+    def __init__(self, directory=OUTBOX_DIR, segment_size=SEGMENT_SIZE):
+        self.log = logging.getLogger()
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fd = None                  # The newest segment, opened to append
+        self.number = 0                 # The number of the newest segment
+        numbers = segment_numbers(directory)
+        if len(numbers) > 0:
+            self.number = numbers[-1]
+            if _complete_length(segment_name(directory, self.number)) is None:
+                # The last record wasn't finished, so nothing more is added after it
+                self.log.info("[OBX]: Incomplete record at the end of segment:%s, starting the next" % self.number)
+                self.number = self.number + 1
+        else:
+            self.number = 1
+        return
+
+    def append(self, record):
+        # Add the record to the end of the newest segment, in one write so the reader never sees
+        # part of the header without the rest
+        if isinstance(record, str):
+            record = record.encode('utf-8')
+        entry = RECORD_HEADER.pack(len(record), zlib.crc32(record)) + record
+        try:
+            if self.fd is None:
+                self._open()
+            elif os.fstat(self.fd).st_size >= self.segment_size:
+                os.close(self.fd)
+                self.fd = None
+                self.number = self.number + 1
+                self._open()
+            os.write(self.fd, entry)
+        except OSError:
+            self.log.warning("[OBX]: Unable to append to segment:%s" % self.number)
+            return False
+        return True
+
+    def close(self):
+        # Close the segment
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        return
+
+    def _open(self):
+        # Open the newest segment to append to, creating it if need be
+        self.fd = os.open(segment_name(self.directory, self.number), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        return
+
+
+class RecordOutbox:
+    """
+    Reads the records in the outbox from the cursor, and moves the cursor on as they are acknowledged
+
+    records(count, exclude) returns up to count (tag, record) not yet acknowledged, oldest first,
+                            skipping those with tags in exclude
+    acknowledge(tags)       marks the records as sent, saves the cursor and deletes any segments
+                            that have all been sent, returns False if the cursor can't be saved
+    close()                 closes the segment being read
+
+    Records are returned as bytes.
+    """
+
+    def __init__(self, directory=OUTBOX_DIR, cursor_file=CURSOR_FILE):
+        self.log = logging.getLogger()
+        self.directory = directory
+        self.cursor_file = os.path.join(directory, cursor_file)
+        self.unacked = []               # The (tag, record) read and not yet acknowledged, in order
+        self.head = 0                   # The index in unacked of the first, the ones before have been acknowledged
+        self.acked = set()              # The tags acknowledged after a record that hasn't been
+        self.file = None                # The segment being read
+        self.read_segment, self.read_offset = self._load_cursor()
+        self.oldest = 0                 # The oldest segment not deleted
+        self._delete_sent()
+        return
+
+    def records(self, count, exclude=()):
+        # Return a list of up to count (tag, record) not yet acknowledged, skipping any in exclude
+        records = []
+        position = self.head
+        while len(records) < count:
+            if position == len(self.unacked) and self._read_next() == False:
+                break
+            tag, record = self.unacked[position]
+            position = position + 1
+            if tag not in self.acked and tag not in exclude:
+                records.append((tag, record))
+        return records
+
+    def acknowledge(self, tags):
+        # Mark the records as sent and move the cursor past those at the front, then save it
+        # Returns False if the cursor can't be saved, the records will then be sent again
+        if len(tags) == 0:
+            return True
+        self.acked.update(tags)
+        while self.head < len(self.unacked) and self.unacked[self.head][0] in self.acked:
+            self.acked.discard(self.unacked[self.head][0])
+            self.head = self.head + 1
+        if self.head > len(self.unacked) // 2:
+            # Drop the acknowledged records from the front now and then, rather than each time
+            del self.unacked[:self.head]
+            self.head = 0
+        status = self._save_cursor()
+        if status and self._cursor()[0] > self.oldest:
+            self._delete_sent()
+        return status
+
+    def close(self):
+        # Close the segment being read
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        return
+
+#=======================================================================
+#
+#    P R I V A T E   F U N C T I O N S
+#
+#    Not to be Called Directly from outside class
+#
+#=======================================================================
+
+    def _cursor(self):
+        # Return the (segment, offset) of the first record not acknowledged
+        if self.head < len(self.unacked):
+            return self.unacked[self.head][0]
+        return (self.read_segment, self.read_offset)
+
+    def _read_next(self):
+        # Read the next record into unacked, returns False if there isn't a complete one yet
+        while True:
+            if self.file is None:
+                try:
+                    self.file = open(segment_name(self.directory, self.read_segment), mode='rb')
+                except FileNotFoundError:
+                    if os.path.exists(segment_name(self.directory, self.read_segment + 1)) == False:
+                        return False
+                    self._next_segment()
+                    continue
+                except OSError:
+                    self.log.warning("[OBX]: Unable to open segment:%s" % self.read_segment)
+                    return False
+            self.file.seek(self.read_offset)
+            header = self.file.read(RECORD_HEADER.size)
+            if len(header) == RECORD_HEADER.size:
+                length, crc = RECORD_HEADER.unpack(header)
+                record = self.file.read(length)
+                if len(record) == length and zlib.crc32(record) == crc:
+                    self.unacked.append(((self.read_segment, self.read_offset), record))
+                    self.read_offset = self.read_offset + RECORD_HEADER.size + length
+                    return True
+            # No complete record yet, unless the writer has moved on to the next segment
+            if os.path.exists(segment_name(self.directory, self.read_segment + 1)) == False:
+                return False
+            if len(header) > 0:
+                self.log.info("[OBX]: Skipping incomplete record at the end of segment:%s" % self.read_segment)
+            self._next_segment()
+
+    def _next_segment(self):
+        # Move the reading on to the start of the next segment
+        self.close()
+        self.read_segment = self.read_segment + 1
+        self.read_offset = 0
+        return
+
+    def _load_cursor(self):
+        # Return the (segment, offset) to start reading from, with the tags acknowledged after it
+        # Without a cursor file, reading starts at the oldest segment
+        try:
+            with open(self.cursor_file, mode='rb') as f:
+                data = f.read()
+            segment, offset, count = CURSOR.unpack_from(data)
+            for index in range(0, count):
+                self.acked.add(ACKED_TAG.unpack_from(data, CURSOR.size + index * ACKED_TAG.size))
+            return segment, offset
+        except (OSError, struct.error):
+            numbers = segment_numbers(self.directory)
+            self.log.info("[OBX]: No outbox cursor, starting at the oldest segment")
+            return (numbers[0] if len(numbers) > 0 else 1), 0
+
+    def _save_cursor(self):
+        # Write the cursor to a new file, flush it to the card and replace the old one with it
+        segment, offset = self._cursor()
+        data = CURSOR.pack(segment, offset, len(self.acked)) + b''.join(ACKED_TAG.pack(*tag) for tag in self.acked)
+        try:
+            with open(self.cursor_file + '.tmp', mode='wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.cursor_file + '.tmp', self.cursor_file)
+        except OSError:
+            self.log.warning("[OBX]: Unable to save the outbox cursor:%s" % self.cursor_file)
+            return False
+        return True
+
+    def _delete_sent(self):
+        # Delete the segments before the cursor, as all their records have been sent
+        segment = self._cursor()[0]
+        self.oldest = segment
+        for number in segment_numbers(self.directory):
+            if number >= segment:
+                break
+            try:
+                os.remove(segment_name(self.directory, number))
+                self.log.info("[OBX]: Segment sent and deleted:%s" % number)
+            except OSError:
+                self.log.warning("[OBX]: Unable to delete segment:%s" % number)
+        return
+
+
+def segment_name(directory, number):
+    # Return the file name of the segment
+    return os.path.join(directory, OUTBOX_NAME + str(number).zfill(SEGMENT_DIGITS) + OUTBOX_EXT)
+
+def segment_numbers(directory):
+    # Return the numbers of the segments in the directory, oldest first
+    numbers = []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return numbers
+    for name in names:
+        stem = name[len(OUTBOX_NAME):-len(OUTBOX_EXT)]
+        if name.startswith(OUTBOX_NAME) and name.endswith(OUTBOX_EXT) and stem.isdigit():
+            numbers.append(int(stem))
+    numbers.sort()
+    return numbers
+
+def _complete_length(filename):
+    # Return the length of the segment if it ends with a complete record, otherwise None
+    try:
+        with open(filename, mode='rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    position = 0
+    while position + RECORD_HEADER.size <= len(data):
+        length, crc = RECORD_HEADER.unpack_from(data, position)
+        end = position + RECORD_HEADER.size + length
+        if end > len(data) or zlib.crc32(data[position + RECORD_HEADER.size:end]) != crc:
+            return None
+        position = end
+    if position != len(data):
+        return None
+    return position
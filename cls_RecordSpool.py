@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Bostin Technology  (see www.CognIoT.eu)
+
+An index of the record files waiting to be sent by a node, so the next record can be found without
+listing and sorting the whole record directory for every record sent.
+
+The directory is scanned once when the spool is created, or restarted, with os.scandir, which only
+reads the directory and doesn't open or stat the files, and the names ending in the extension are
+sorted into a queue. After that, on Linux, the spool watches the directory with inotify and adds
+each new record file to the queue as it is closed after writing, or moved in, and drops any that
+are deleted or moved out. The events are read, without waiting, whenever the spool is used, so no
+thread is needed.
+
+The record file names start with the time they were written, so a new file almost always belongs
+at the end of the queue and is added in O(1), one written out of order is inserted in its place.
+Files that are removed are dropped from the set of pending names at once and from the queue when
+they reach the front of it, so finding the next record is O(1).
+
+Without inotify, e.g. not on Linux, or if the kernel's event queue overflows, the directory is
+scanned again, at most once every rescan_interval seconds.
+"""
+
+import bisect
+import collections
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import time
+
+# The default extension of the record files
+RECORDFILE_EXT = ".rec"
+
+# How often, in seconds, the directory is scanned again when inotify isn't available
+RESCAN_INTERVAL = 5
+
+# The inotify events watched for, and those that mean the watch has been lost
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM | IN_DELETE_SELF | IN_MOVE_SELF
+
+# The header of each inotify event, the watch, mask, cookie and length of the name after it
+INOTIFY_EVENT = struct.Struct('iIII')
+
+# The most bytes of events read at a time
+INOTIFY_READ = 64 * 1024
+
+
+class RecordSpool:
+    """
+    The record files in the directory waiting to be sent, oldest first
+
+    next_record()       returns the name of the oldest record file, or '' if there are none
+    names(count, exclude) returns up to count names, oldest first, skipping those in exclude
+    discard(name)       drops the name, once the file has been removed or renamed
+    refresh()           reads the inotify events, or scans the directory again if due
+    close()             stops watching the directory
+
+    len() is the number of record files waiting, and a name can be checked with in.
+    """
+
+    def __init__(self, directory, extension=RECORDFILE_EXT, rescan_interval=RESCAN_INTERVAL):
+        self.log = logging.getLogger()
+        self.directory = directory
+        self.extension = extension
+        self.rescan_interval = rescan_interval
+        self.queue = collections.deque()    # The names in order, including any discarded but not yet dropped
+        self.pending = set()                # The names of the record files waiting
+        self.inotify = None                 # The inotify file descriptor, None if the directory isn't watched
+        self._next_scan = 0
+        self._watch()
+        self.scan()
+        return
+
+    def scan(self):
+        # Rebuild the queue from the names in the directory
+        try:
+            with os.scandir(self.directory) as entries:
+                names = [entry.name for entry in entries if entry.name.endswith(self.extension)]
+        except OSError:
+            self.log.warning("[SPL]: Unable to read the record directory:%s" % self.directory)
+            names = []
+        names.sort()
+        self.queue = collections.deque(names)
+        self.pending = set(names)
+        self._next_scan = time.monotonic() + self.rescan_interval
+        self.log.info("[SPL]: Record spool loaded with %s records" % len(names))
+        return
+
+    def refresh(self):
+        # Bring the queue up to date with the files added to or removed from the directory
+        if self.inotify is not None:
+            self._read_events()
+        elif time.monotonic() >= self._next_scan:
+            self.scan()
+        return
+
+    def next_record(self):
+        # Return the name of the oldest record file, or '' if there are none
+        self.refresh()
+        self._drop_discarded()
+        if len(self.queue) == 0:
+            return ''
+        return self.queue[0]
+
+    def names(self, count, exclude=()):
+        # Return a list of up to count names, oldest first, skipping any in exclude
+        self.refresh()
+        self._drop_discarded()
+        names = []
+        for name in self.queue:
+            if len(names) >= count:
+                break
+            # A name discarded and added again can be in the queue twice until it is dropped
+            if name in self.pending and name not in exclude and name not in names:
+                names.append(name)
+        return names
+
+    def discard(self, name):
+        # Drop the name, e.g. once the record has been sent and its file removed
+        self.pending.discard(name)
+        self._drop_discarded()
+        return
+
+    def close(self):
+        # Stop watching the directory
+        if self.inotify is not None:
+            os.close(self.inotify)
+            self.inotify = None
+        return
+
+    def __contains__(self, name):
+        return name in self.pending
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __repr__(self):
+        return "RecordSpool(%s, %s records)" % (self.directory, len(self.pending))
+
+#=======================================================================
+#
+#    P R I V A T E   F U N C T I O N S
+#
+#    Not to be Called Directly from outside class
+#
+#=======================================================================
+
+    def _watch(self):
+        # Start watching the directory with inotify, leaves inotify as None if it can't
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            self.log.info("[SPL]: inotify not available, the record directory will be scanned")
+            return
+        if fd < 0:
+            self.log.info("[SPL]: Unable to start inotify, errno:%s" % ctypes.get_errno())
+            return
+        if libc.inotify_add_watch(fd, os.fsencode(self.directory), WATCH_MASK) < 0:
+            self.log.warning("[SPL]: Unable to watch the record directory:%s, errno:%s" %
+                             (self.directory, ctypes.get_errno()))
+            os.close(fd)
+            return
+        self.inotify = fd
+        return
+
+    def _read_events(self):
+        # Read the inotify events waiting and update the queue with them
+        while True:
+            try:
+                data = os.read(self.inotify, INOTIFY_READ)
+            except BlockingIOError:
+                return
+            except OSError:
+                self.log.warning("[SPL]: Unable to read the inotify events, scanning instead")
+                self.close()
+                self._next_scan = 0
+                return
+            position = 0
+            while position + INOTIFY_EVENT.size <= len(data):
+                wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, position)
+                position = position + INOTIFY_EVENT.size
+                name = os.fsdecode(data[position:position + length].rstrip(b'\0'))
+                position = position + length
+                if mask & IN_Q_OVERFLOW:
+                    # Events have been lost, the directory has to be read again
+                    self.log.info("[SPL]: inotify events lost, scanning the record directory")
+                    self.scan()
+                elif mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    self.log.warning("[SPL]: Record directory no longer watched, scanning instead")
+                    self.close()
+                    self._next_scan = 0
+                    return
+                elif mask & IN_ISDIR or name.endswith(self.extension) == False:
+                    continue
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    self._add(name)
+                else:
+                    self.pending.discard(name)
+
+    def _add(self, name):
+        # Add the name to the queue in order, at the end unless it was written out of order
+        if name in self.pending:
+            return
+        self.pending.add(name)
+        if len(self.queue) == 0 or name > self.queue[-1]:
+            self.queue.append(name)
+        else:
+            names = list(self.queue)
+            names.insert(bisect.bisect(names, name), name)
+            self.queue = collections.deque(names)
+        return
+
+    def _drop_discarded(self):
+        # Drop the names at the front of the queue that are no longer pending
+        while len(self.queue) > 0 and self.queue[0] not in self.pending:
+            self.queue.popleft()
+        return
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Bostin Technology  (see www.CognIoT.eu)
+
+An append-only log of the records received by the hub, kept in segment files, as an alternative
+to writing each record to its own file with WriteDataToDir. Appending to one open file saves
+creating, writing and closing a file, and updating the directory, for every record, and the writes
+to the SD card can be grouped so it is only flushed once for many records.
+
+Each record in a segment is
+
+    Bytes   - Meaning
+    ======  - =======
+    0 - 3   - Length of the record
+    4 - 7   - CRC32 of the rest of the entry, bytes 8 onwards
+    8 - 11  - The node the record came from
+    12 - 19 - The time the record was received, in milliseconds since the epoch
+    20 - n  - The record
+
+Records are appended to the open segment, SEGMENT_NAME + number + OPEN_EXT. When it is longer than
+segment_size, or older than segment_age seconds, it is flushed and renamed to SEGMENT_EXT and the
+next one is opened, so only complete segments have SEGMENT_EXT and can be collected by another
+program. If the hub stops, the open segment is completed when it starts again, with any record
+that was only partly written removed from the end.
+
+Records are flushed to the card in groups, by commit(), once commit_records have been appended or
+the oldest of them was appended commit_ms ago. 0 turns either off, and a commit_records of 1
+flushes every record. The HubPipeline calls commit() before marking records as stored in its
+write-ahead log, so records that weren't flushed are stored again if the hub stops.
+
+read_segment() returns the records in a segment, and segments() the complete segments in order.
+"""
+
+import logging
+import os
+import struct
+import time
+import zlib
+
+# The default directory, name and extensions of the segment files
+SEGMENT_DIR = "."
+SEGMENT_NAME = "SEGMENT_"
+SEGMENT_EXT = ".seg"
+OPEN_EXT = ".open"
+
+# The number of digits in the number of each segment, so they sort in order
+SEGMENT_DIGITS = 10
+
+# The default largest size, in bytes, and age, in seconds, of a segment before the next one is started
+SEGMENT_SIZE = 4 * 1024 * 1024
+SEGMENT_AGE = 3600
+
+# The default number of records, or milliseconds, after which the records are flushed to the card
+COMMIT_RECORDS = 64
+COMMIT_MS = 1000
+
+# The header of each record, the length, crc, node and time received, and the part covered by the crc
+RECORD_HEADER = struct.Struct('>II4sQ')
+CRC_START = 8
+
+# The length of a node address
+ADDRESS_LEN = 4
+
+_log = logging.getLogger()
+
+
+class SegmentLog:
+    """
+    Appends records to the open segment and flushes them to the card in groups
+
+    append(record, node, received)  adds the record, returns True, or False if it can't be written
+    commit(force)                   flushes the records if they are due, or if force is True,
+                                    returns True if every record appended is on the card
+    close()                         flushes the records and completes the open segment
+
+    append() can be given to HubPipeline as the store and commit() as the store_commit.
+    """
+
+    def __init__(self, directory=SEGMENT_DIR, segment_size=SEGMENT_SIZE, segment_age=SEGMENT_AGE,
+                 commit_records=COMMIT_RECORDS, commit_ms=COMMIT_MS):
+        self.log = logging.getLogger()
+        self.directory = directory
+        self.segment_size = segment_size
+        self.segment_age = segment_age
+        self.commit_records = commit_records
+        self.commit_ms = commit_ms
+        self.file = None                # The open segment
+        self.filename = ''
+        self.number = 0                 # The number of the open segment
+        self.size = 0                   # The bytes written to the open segment
+        self.opened = 0                 # When the open segment was started, as time.monotonic()
+        self.uncommitted = 0            # The records appended but not yet flushed to the card
+        self.first_uncommitted = 0      # When the first of them was appended, as time.monotonic()
+        self.commits = 0                # The number of times the records have been flushed
+        self._recover()
+        return
+
+    def append(self, record, node, received=None):
+        # Add the record from the node, received at the time from time.time() or now if not given
+        # Returns True once it is written, but not necessarily flushed, or False if it can't be
+        if self.file is None or self._rollover_due(len(record)):
+            if self._next_segment() == False:
+                return False
+        if isinstance(node, str):
+            node = node.encode('utf-8')
+        if received is None:
+            received = time.time()
+        body = bytes(node[:ADDRESS_LEN]).ljust(ADDRESS_LEN) + struct.pack('>Q', int(received * 1000)) + record
+        entry = struct.pack('>II', len(record), zlib.crc32(body)) + body
+        try:
+            self.file.write(entry)
+        except OSError:
+            self.log.warning("[RST]: Unable to write to segment:%s" % self.filename)
+            self._truncate()
+            return False
+        self.size = self.size + len(entry)
+        if self.uncommitted == 0:
+            self.first_uncommitted = time.monotonic()
+        self.uncommitted = self.uncommitted + 1
+        return True
+
+    def commit(self, force=False):
+        # Flush the records to the card if enough have been appended or the oldest has waited long
+        # enough, or whatever if force is True. Returns True if there are none left to flush
+        if self.uncommitted == 0:
+            return True
+        if force == False and self._commit_due() == False:
+            return False
+        try:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except OSError:
+            self.log.warning("[RST]: Unable to flush segment:%s" % self.filename)
+            return False
+        self.uncommitted = 0
+        self.commits = self.commits + 1
+        return True
+
+    def close(self):
+        # Flush the records and complete the open segment
+        if self.file is not None:
+            self._complete()
+        return
+
+#=======================================================================
+#
+#    P R I V A T E   F U N C T I O N S
+#
+#    Not to be Called Directly from outside class
+#
+#=======================================================================
+
+    def _recover(self):
+        # Complete any segment left open when the hub stopped, and carry on the numbering after
+        # the last segment
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            names = os.listdir(self.directory)
+        except OSError:
+            self.log.warning("[RST]: Unable to read the segment directory:%s" % self.directory)
+            return
+        for name in sorted(names):
+            number = _segment_number(name)
+            if number is None:
+                continue
+            self.number = max(self.number, number)
+            if name.endswith(OPEN_EXT):
+                filename = os.path.join(self.directory, name)
+                length = _valid_length(filename)
+                self.log.info("[RST]: Completing segment:%s, %s bytes" % (filename, length))
+                try:
+                    os.truncate(filename, length)
+                    os.replace(filename, filename[:-len(OPEN_EXT)] + SEGMENT_EXT)
+                except OSError:
+                    self.log.warning("[RST]: Unable to complete segment:%s" % filename)
+        return
+
+    def _rollover_due(self, length):
+        # True if the record won't fit in the open segment, or it is too old
+        if self.size > 0 and self.size + RECORD_HEADER.size + length > self.segment_size:
+            return True
+        return self.segment_age > 0 and time.monotonic() - self.opened > self.segment_age
+
+    def _commit_due(self):
+        # True if enough records have been appended, or the first of them has waited long enough
+        if self.commit_records > 0 and self.uncommitted >= self.commit_records:
+            return True
+        return self.commit_ms > 0 and (time.monotonic() - self.first_uncommitted) * 1000 >= self.commit_ms
+
+    def _next_segment(self):
+        # Complete the open segment, if any, and open the next one
+        if self.file is not None:
+            if self._complete() == False:
+                return False
+        self.number = self.number + 1
+        self.filename = os.path.join(self.directory, SEGMENT_NAME + str(self.number).zfill(SEGMENT_DIGITS) + OPEN_EXT)
+        try:
+            self.file = open(self.filename, mode='xb')
+        except OSError:
+            self.log.warning("[RST]: Unable to open segment:%s" % self.filename)
+            self.file = None
+            return False
+        self.log.info("[RST]: Started segment:%s" % self.filename)
+        self.size = 0
+        self.opened = time.monotonic()
+        return True
+
+    def _complete(self):
+        # Flush and close the open segment and rename it so it can be collected
+        if self.commit(force=True) == False:
+            return False
+        try:
+            self.file.close()
+            os.replace(self.filename, self.filename[:-len(OPEN_EXT)] + SEGMENT_EXT)
+        except OSError:
+            self.log.warning("[RST]: Unable to complete segment:%s" % self.filename)
+            return False
+        self.file = None
+        return True
+
+    def _truncate(self):
+        # Remove any part of a record left at the end of the open segment by a failed write
+        try:
+            self.file.flush()
+        except OSError:
+            pass
+        try:
+            self.file.truncate(self.size)
+            self.file.seek(self.size)
+        except OSError:
+            self.log.warning("[RST]: Unable to truncate segment:%s" % self.filename)
+        return
+
+
+def segments(directory=SEGMENT_DIR):
+    # Return the file names of the complete segments in the directory, oldest first
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    return [os.path.join(directory, name) for name in sorted(names)
+            if name.endswith(SEGMENT_EXT) and _segment_number(name) is not None]
+
+def read_segment(filename):
+    # Return a list of the (node, time received, record) in the segment, stopping at the first
+    # record that is incomplete or doesn't match its crc
+    records = []
+    try:
+        with open(filename, mode='rb') as f:
+            data = f.read()
+    except OSError:
+        _log.warning("[RST]: Unable to read segment:%s" % filename)
+        return records
+    for node, received, record, end in _entries(data):
+        records.append((node, received / 1000, record))
+    return records
+
+def _entries(data):
+    # Yield the node, time received in ms, record and the position after it, for each valid record
+    position = 0
+    while position + RECORD_HEADER.size <= len(data):
+        length, crc, node, received = RECORD_HEADER.unpack_from(data, position)
+        end = position + RECORD_HEADER.size + length
+        if end > len(data) or zlib.crc32(data[position + CRC_START:end]) != crc:
+            return
+        yield node, received, data[position + RECORD_HEADER.size:end], end
+        position = end
+    return
+
+def _valid_length(filename):
+    # Return the length of the valid records at the start of the segment
+    length = 0
+    try:
+        with open(filename, mode='rb') as f:
+            data = f.read()
+    except OSError:
+        return length
+    for node, received, record, end in _entries(data):
+        length = end
+    return length
+
+def _segment_number(name):
+    # Return the number of the segment file, or None if it isn't one
+    if name.startswith(SEGMENT_NAME) == False:
+        return None
+    stem = os.path.splitext(name)[0][len(SEGMENT_NAME):]
+    if stem.isdigit() == False or os.path.splitext(name)[1] not in (SEGMENT_EXT, OPEN_EXT):
+        return None
+    return int(stem)